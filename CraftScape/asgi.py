@@ -0,0 +1,100 @@
+"""
+ASGI entry point for the long-poll change feed.
+
+It serves only ``GET /api/character/<id>/feed/``, with the same parameters and response as the DRF route, but waits
+as an asyncio task, so idle clients do not hold a worker thread each. Authentication and the version reads run in the
+default executor. Serve it with any ASGI 3 server (for example ``uvicorn CraftScape.asgi:application``) and route
+every other URL to the WSGI application. The writes then happen in other processes, so set ``FEED_BROKER`` to a
+cross-process broker such as RedisBroker, otherwise waiters only notice changes when they poll the database.
+"""
+import asyncio
+import json
+import os
+import re
+from urllib.parse import parse_qsl
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "CraftScape.production")
+django.setup()
+
+from django.db import close_old_connections  # noqa: E402
+from django.http import HttpRequest  # noqa: E402
+from rest_framework import exceptions  # noqa: E402
+from rest_framework.request import Request  # noqa: E402
+from CraftScapeAPI.authentication import CachedTokenAuthentication, CachedBasicAuthentication  # noqa: E402
+from CraftScapeAPI.serializers import FeedSerializer  # noqa: E402
+from CraftScapeDatabase.feed import wait_for_change_async  # noqa: E402
+from CraftScapeDatabase.models import Character  # noqa: E402
+
+FEED_PATH = re.compile(r'^/api/character/(?P<pk>[0-9]+)/feed/$')
+
+AUTHENTICATION_CLASSES = (CachedTokenAuthentication, CachedBasicAuthentication)
+
+
+def authenticate(headers):
+    request = HttpRequest()
+    if b'authorization' in headers:
+        request.META['HTTP_AUTHORIZATION'] = headers[b'authorization'].decode('latin-1')
+    request = Request(request)
+    for authentication_class in AUTHENTICATION_CLASSES:
+        result = authentication_class().authenticate(request)
+        if result is not None:
+            return result[0]
+    raise exceptions.NotAuthenticated()
+
+
+def read_version(character_id, user=None):
+    try:
+        characters = Character.objects.filter(pk=character_id)
+        if user is not None and not user.is_staff:
+            characters = characters.filter(user=user)
+        return characters.values_list('state_version', flat=True).first()
+    finally:
+        close_old_connections()
+
+
+def owned_version(headers, character_id):
+    try:
+        user = authenticate(headers)
+    finally:
+        close_old_connections()
+    return read_version(character_id, user)
+
+
+async def send_json(send, status, data):
+    body = json.dumps(data).encode('utf-8')
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())]})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def application(scope, receive, send):
+    if scope['type'] != 'http':
+        return
+    match = FEED_PATH.match(scope['path'])
+    if match is None:
+        return await send_json(send, 404, {'detail': 'Not found.'})
+    if scope['method'] not in ('GET', 'HEAD'):
+        return await send_json(send, 405, {'detail': 'Method "{0}" not allowed.'.format(scope['method'])})
+
+    serializer = FeedSerializer(data=dict(parse_qsl(scope.get('query_string', b'').decode('latin-1'))))
+    if not serializer.is_valid():
+        return await send_json(send, 400, serializer.errors)
+    since, timeout = serializer.validated_data['since'], serializer.validated_data['timeout']
+    character_id = int(match.group('pk'))
+
+    loop = asyncio.get_event_loop()
+    try:
+        version = await loop.run_in_executor(None, owned_version, dict(scope.get('headers', ())), character_id)
+    except exceptions.APIException as exc:
+        return await send_json(send, exc.status_code, {'detail': str(exc.detail)})
+    if version is None:
+        return await send_json(send, 404, {'detail': 'Not found.'})
+
+    if version <= since:
+        async def read():
+            return await loop.run_in_executor(None, read_version, character_id)
+
+        version = await wait_for_change_async(character_id, since, timeout, read) or version
+    await send_json(send, 200, {'state_version': version, 'changed': version > since})
@@ -0,0 +1,52 @@
+"""
+Sends reads to the replica databases listed in ``DATABASE_REPLICAS`` and everything else to the primary.
+
+Reads stay on the primary while the thread is inside ``transaction.atomic`` on it, while it is pinned with
+``use_primary`` (ReplicaRoutingMiddleware pins write requests and, for ``REPLICA_STICKY_SECONDS`` after a write, every
+request from the same client so it reads its own writes), and for related objects of an instance loaded from or saved
+to the primary. The process-wide caches (catalog, skill graph, catalog bundle, spatial grid and authentication) also
+reload under ``use_primary``, a lagging replica would otherwise leave stale rows cached until the next change.
+"""
+import random
+import threading
+from contextlib import contextmanager
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+_state = threading.local()
+
+
+@contextmanager
+def use_primary():
+    previous = getattr(_state, 'primary', False)
+    _state.primary = True
+    try:
+        yield
+    finally:
+        _state.primary = previous
+
+
+def pinned_to_primary():
+    return getattr(_state, 'primary', False) or connections[DEFAULT_DB_ALIAS].in_atomic_block
+
+
+class ReplicaRouter:
+    def __init__(self, replicas=None):
+        self.replicas = list(settings.DATABASE_REPLICAS if replicas is None else replicas)
+        self.databases = {DEFAULT_DB_ALIAS} | set(self.replicas)
+
+    def db_for_read(self, model, **hints):
+        if not self.replicas or pinned_to_primary():
+            return DEFAULT_DB_ALIAS
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db in self.databases:
+            return instance._state.db
+        return random.choice(self.replicas)
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if obj1._state.db in self.databases and obj2._state.db in self.databases:
+            return True
+        return None
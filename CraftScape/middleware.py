@@ -0,0 +1,126 @@
+import json
+import logging
+import random
+import re
+import time
+from collections import Counter
+from contextlib import ExitStack
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from CraftScape.db_router import use_primary
+
+logger = logging.getLogger('CraftScape.sql')
+
+IN_LIST_RE = re.compile(r'IN \((?:%s, )*%s\)')
+STRING_RE = re.compile(r"'(?:[^']|'')*'")
+NUMBER_RE = re.compile(r'\b\d+(?:\.\d+)?\b')
+
+
+def fingerprint(sql):
+    """
+    Reduces a statement to its shape so the same query issued with different parameters counts as a repeat.
+    """
+    sql = IN_LIST_RE.sub('IN (...)', sql)
+    sql = STRING_RE.sub('?', sql)
+    return NUMBER_RE.sub('?', sql)
+
+
+class QueryTracer:
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.fingerprints = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.count += 1
+            self.fingerprints[sql] += 1
+
+    def repeated(self, threshold):
+        repeats = Counter()
+        for sql, count in self.fingerprints.items():
+            repeats[fingerprint(sql)] += count
+        return [(sql, count) for sql, count in repeats.most_common() if count >= threshold]
+
+
+class QueryTracingMiddleware:
+    """
+    Records the number of queries, total database time and repeated statements for a sample of requests. Sampled
+    responses get ``X-DB-Queries`` and ``X-DB-Time`` (milliseconds) headers and a JSON log line on the
+    ``CraftScape.sql`` logger; statements repeated ``SQL_TRACE_REPEAT_THRESHOLD`` times are reported as likely N+1
+    patterns at warning level.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.sample_rate = getattr(settings, 'SQL_TRACE_SAMPLE_RATE', 0)
+        self.repeat_threshold = getattr(settings, 'SQL_TRACE_REPEAT_THRESHOLD', 5)
+        if not self.sample_rate:
+            raise MiddlewareNotUsed()
+
+    def __call__(self, request):
+        if self.sample_rate < 1 and random.random() >= self.sample_rate:
+            return self.get_response(request)
+
+        tracer = QueryTracer()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(tracer))
+            response = self.get_response(request)
+
+        response['X-DB-Queries'] = str(tracer.count)
+        response['X-DB-Time'] = '{0:.2f}'.format(tracer.duration * 1000)
+        self.log(request, response, tracer)
+        return response
+
+    def log(self, request, response, tracer):
+        repeated = tracer.repeated(self.repeat_threshold)
+        record = {
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'queries': tracer.count,
+            'db_time_ms': round(tracer.duration * 1000, 2),
+            'n_plus_one': [{'sql': sql, 'count': count} for sql, count in repeated],
+        }
+        logger.log(logging.WARNING if repeated else logging.INFO, json.dumps(record))
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Pins write requests to the primary database, and for ``REPLICA_STICKY_SECONDS`` after a write every request from
+    the same client, so a client always reads its own writes even while the replicas lag. Writes answer with a signed,
+    timestamped cookie that carries the pin, so it holds whichever worker the next request reaches without any state
+    shared between them. Clients that do not send cookies back may read from a lagging replica right after a write.
+    """
+    SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+    COOKIE_NAME = 'replica_sticky'
+    COOKIE_SALT = 'CraftScape.middleware.ReplicaRoutingMiddleware'
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.sticky_seconds = getattr(settings, 'REPLICA_STICKY_SECONDS', 5)
+        if not getattr(settings, 'DATABASE_REPLICAS', None):
+            raise MiddlewareNotUsed()
+
+    def sticky(self, request):
+        # Forged, tampered and expired cookies all read as missing
+        return bool(self.sticky_seconds) and request.get_signed_cookie(
+            self.COOKIE_NAME, default=None, salt=self.COOKIE_SALT, max_age=self.sticky_seconds) is not None
+
+    def __call__(self, request):
+        writes = request.method not in self.SAFE_METHODS
+        with ExitStack() as stack:
+            if writes or self.sticky(request):
+                stack.enter_context(use_primary())
+            response = self.get_response(request)
+
+        if writes and self.sticky_seconds:
+            response.set_signed_cookie(self.COOKIE_NAME, '1', salt=self.COOKIE_SALT, max_age=self.sticky_seconds,
+                                       httponly=True)
+        return response
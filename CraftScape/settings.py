@@ -57,6 +57,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'CraftScape.middleware.QueryTracingMiddleware',
+    'CraftScape.middleware.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -66,15 +68,48 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Per-request SQL tracing, disabled unless a sample rate between 0 and 1 is configured
+SQL_TRACE_SAMPLE_RATE = data.get('sql_trace', {}).get('sample_rate', 0)
+SQL_TRACE_REPEAT_THRESHOLD = data.get('sql_trace', {}).get('repeat_threshold', 5)
+
 REST_FRAMEWORK = {
     'EXCEPTION_HANDLER': 'rest_framework.views.exception_handler',
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework.authentication.TokenAuthentication',
-        'rest_framework.authentication.BasicAuthentication',
+        'CraftScapeAPI.authentication.CachedTokenAuthentication',
+        'CraftScapeAPI.authentication.CachedBasicAuthentication',
         'rest_framework.authentication.SessionAuthentication',
-    )
+    ),
+    'DEFAULT_PAGINATION_CLASS': 'CraftScapeAPI.pagination.IdCursorPagination',
+    'PAGE_SIZE': data.get('pagination', {}).get('page_size', 100),
 }
 
+# Largest page a client may ask for with ?page_size=, and how many game items are nested in each inventory
+API_MAX_PAGE_SIZE = data.get('pagination', {}).get('max_page_size', 1000)
+INVENTORY_GAME_ITEMS_LIMIT = data.get('pagination', {}).get('inventory_game_items', 64)
+
+# Seconds a successful token or basic authentication is remembered, and how many are remembered per worker. Other
+# workers keep accepting a revoked token or deactivated user for up to the TTL, see CraftScapeAPI.authentication
+AUTH_CACHE_TTL = data.get('auth_cache', {}).get('ttl', 10)
+AUTH_CACHE_SIZE = data.get('auth_cache', {}).get('size', 10000)
+
+# Seconds between writes of buffered character positions, see CraftScapeDatabase.positions
+POSITION_FLUSH_INTERVAL = data.get('positions', {}).get('flush_interval', 0.5)
+
+# Cell size and reload age (seconds) of the nearby characters grid, and the largest radius a client may ask for
+SPATIAL_GRID_CELL_SIZE = data.get('spatial_grid', {}).get('cell_size', 50.0)
+SPATIAL_GRID_MAX_AGE = data.get('spatial_grid', {}).get('max_age', 30)
+NEARBY_MAX_RADIUS = data.get('spatial_grid', {}).get('max_radius', 500.0)
+
+# Longest a change feed request may wait, and how often a waiting request re-reads the version from the database
+FEED_MAX_TIMEOUT = data.get('feed', {}).get('max_timeout', 25.0)
+FEED_POLL_INTERVAL = data.get('feed', {}).get('poll_interval', 2.0)
+# Broker class waiters are woken through, see CraftScapeDatabase.feed; RedisBroker shares publishes between processes
+FEED_BROKER = data.get('feed', {}).get('broker', 'CraftScapeDatabase.feed.LocalBroker')
+FEED_REDIS_URL = data.get('feed', {}).get('redis_url', 'redis://localhost:6379/0')
+
+# 'django.contrib.sessions.backends.signed_cookies' or '...backends.cache' keep sessions out of the database
+SESSION_ENGINE = data.get('session_engine', 'django.contrib.sessions.backends.db')
+
 ROOT_URLCONF = 'CraftScape.urls'
 
 PROJECT_ROOT = os.path.abspath(os.path.dirname(__file__))
@@ -104,26 +139,46 @@ WSGI_APPLICATION = 'CraftScape.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/2.0/ref/settings/#databases
 
-if data['database']['engine'] == 'django.db.backends.sqlite3':
-    DATABASES = {
-        'default': {
-            'ENGINE': 'django.db.backends.sqlite3',
-            'NAME': os.path.join(BASE_DIR, data['database']['name'])
-        }
-    }
-else:
-    DATABASES = {
-        'default': {
-            'ENGINE': data['database']['engine'],
-            'NAME': data['database']['name'],
-            'USER': data['database']['user'],
-            'PASSWORD': data['database']['password'],
-            'HOST': data['database']['host'],
-            'PORT': data['database']['port']
+# 'CraftScape.sqlite_backend' is SQLite in WAL mode with serialized writers, its "options" are described there
+SQLITE_ENGINES = ('django.db.backends.sqlite3', 'CraftScape.sqlite_backend')
+
+
+def database_settings(database):
+    if database['engine'] in SQLITE_ENGINES:
+        return {
+            'ENGINE': database['engine'],
+            'NAME': os.path.join(BASE_DIR, database['name']),
+            'OPTIONS': database.get('options', {})
         }
+    return {
+        'ENGINE': database['engine'],
+        'NAME': database['name'],
+        'USER': database['user'],
+        'PASSWORD': database['password'],
+        'HOST': database['host'],
+        'PORT': database['port'],
+        'OPTIONS': database.get('options', {})
     }
 
 
+DATABASES = {
+    'default': database_settings(data['database'])
+}
+
+# Read replicas, each entry overrides keys of the primary's "database" block (usually "host", or "name" for SQLite).
+# Safe reads go to a random replica, see CraftScape.db_router, and tests run them against the primary.
+DATABASE_REPLICAS = []
+for index, replica in enumerate(data.get('replicas', {}).get('databases', [])):
+    alias = 'replica{0}'.format(index + 1)
+    DATABASES[alias] = dict(database_settings(dict(data['database'], **replica)), TEST={'MIRROR': 'default'})
+    DATABASE_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ['CraftScape.db_router.ReplicaRouter']
+
+# Seconds a client keeps reading from the primary after a write
+REPLICA_STICKY_SECONDS = data.get('replicas', {}).get('sticky_seconds', 5)
+
+
 # Password validation
 # https://docs.djangoproject.com/en/2.0/ref/settings/#auth-password-validators
 
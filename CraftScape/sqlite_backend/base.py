@@ -0,0 +1,94 @@
+"""
+SQLite backend for shards with concurrent writers, used with ``"engine": "CraftScape.sqlite_backend"``.
+
+Every connection switches the database to WAL, so readers no longer block the writer, and applies the ``PRAGMAS``
+below (overridable with ``"options": {"pragmas": {...}}`` in settings.json). Transactions start with ``BEGIN
+IMMEDIATE`` instead of a deferred ``BEGIN``: a deferred transaction that reads before it writes fails straight away
+with "database is locked" when another one holds the write lock, since SQLite cannot wait for it without deadlocking.
+With ``serialize_writes`` (the default) the threads of a process also queue on one lock per database file before
+they begin, and only the thread at the front waits on ``busy_timeout`` for writers in other processes. Writes outside
+``transaction.atomic`` are single statements and simply wait on ``busy_timeout``.
+"""
+import threading
+from collections import OrderedDict
+from django.db.backends.sqlite3 import base
+
+PRAGMAS = OrderedDict((
+    # Milliseconds to wait for the write lock held by another connection, set first so switching to WAL waits too
+    ('busy_timeout', 5000),
+    ('journal_mode', 'WAL'),
+    # In WAL mode NORMAL only syncs at checkpoints, a power loss can drop the last commits but not corrupt the file
+    ('synchronous', 'NORMAL'),
+    # Negative values are KiB: 64 MiB of page cache per connection, plus up to 256 MiB of the file memory mapped
+    ('cache_size', -64000),
+    ('mmap_size', 268435456),
+    ('temp_store', 'MEMORY'),
+))
+
+_locks_lock = threading.Lock()
+_write_locks = {}
+
+
+def write_lock(name):
+    with _locks_lock:
+        return _write_locks.setdefault(name, threading.Lock())
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        options = self.settings_dict['OPTIONS']
+        self.pragmas = OrderedDict(PRAGMAS)
+        self.pragmas.update(options.get('pragmas', {}))
+        self.serialize_writes = options.get('serialize_writes', True)
+        self.write_lock = write_lock(self.settings_dict['NAME'])
+        self.holds_write_lock = False
+
+    def get_connection_params(self):
+        kwargs = super().get_connection_params()
+        kwargs.pop('pragmas', None)
+        kwargs.pop('serialize_writes', None)
+        return kwargs
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        for name, value in self.pragmas.items():
+            if not name.isidentifier():
+                raise ValueError('Invalid SQLite pragma {0!r}.'.format(name))
+            conn.execute('PRAGMA {0} = {1}'.format(name, value))
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        if self.serialize_writes and not self.holds_write_lock:
+            if not self.write_lock.acquire(timeout=self.pragmas['busy_timeout'] / 1000):
+                with self.wrap_database_errors:
+                    raise base.Database.OperationalError('database is locked')
+            self.holds_write_lock = True
+        try:
+            self.cursor().execute('BEGIN IMMEDIATE')
+        except Exception:
+            self.release_write_lock()
+            raise
+
+    def release_write_lock(self):
+        if self.holds_write_lock:
+            self.holds_write_lock = False
+            self.write_lock.release()
+
+    def _commit(self):
+        try:
+            return super()._commit()
+        finally:
+            self.release_write_lock()
+
+    def _rollback(self):
+        try:
+            return super()._rollback()
+        finally:
+            self.release_write_lock()
+
+    def _close(self):
+        try:
+            return super()._close()
+        finally:
+            self.release_write_lock()
@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class CraftscapeapiConfig(AppConfig):
     name = 'CraftScapeAPI'
+
+    def ready(self):
+        from CraftScapeAPI import signals  # noqa: F401
@@ -0,0 +1,110 @@
+"""
+Authentication classes that remember successful authentications for a short time.
+
+Token authentication otherwise joins authtoken_token to auth_user on every request, and basic authentication runs the
+full password hasher on every request. Both cache the authenticated user in-process for ``AUTH_CACHE_TTL`` seconds.
+
+Entries are dropped straight away only in the process that deletes the token or saves the user (deactivation,
+password change, ...). Other workers, and changes that send no signals such as ``User.objects.update(is_active=False)``,
+are only caught when the entry expires: a revoked token or deactivated user keeps working for up to ``AUTH_CACHE_TTL``
+seconds. That window is the accepted price of skipping the lookup, keep the TTL short.
+"""
+import copy
+import hashlib
+import hmac
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from rest_framework.authentication import TokenAuthentication, BasicAuthentication
+from CraftScape.db_router import use_primary
+
+
+class TTLCache:
+    """
+    Thread safe, size bounded mapping whose entries expire ``ttl`` seconds after being set. Every entry is tagged with
+    the id of the user it belongs to so all of a user's entries can be dropped at once.
+    """
+
+    def __init__(self, ttl, maxsize):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, user_id, value = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            return value
+
+    def set(self, key, value, user_id):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (time.monotonic() + self.ttl, user_id, value)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def delete_user(self, user_id):
+        with self._lock:
+            for key in [key for key, entry in self._entries.items() if entry[1] == user_id]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+token_cache = TTLCache(getattr(settings, 'AUTH_CACHE_TTL', 10), getattr(settings, 'AUTH_CACHE_SIZE', 10000))
+credential_cache = TTLCache(getattr(settings, 'AUTH_CACHE_TTL', 10), getattr(settings, 'AUTH_CACHE_SIZE', 10000))
+# Character id -> id of the owning user, for hot endpoints that only need to check ownership
+character_owners = TTLCache(getattr(settings, 'AUTH_CACHE_TTL', 10), getattr(settings, 'AUTH_CACHE_SIZE', 10000))
+
+
+def credential_key(userid, password):
+    """
+    Keyed hash of a username and password pair so the cache never holds the password itself.
+    """
+    message = '{0}:{1}'.format(userid, password).encode('utf-8')
+    return hmac.new(settings.SECRET_KEY.encode('utf-8'), message, hashlib.sha256).hexdigest()
+
+
+def invalidate_user(user_id):
+    token_cache.delete_user(user_id)
+    credential_cache.delete_user(user_id)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    def authenticate_credentials(self, key):
+        cached = token_cache.get(key)
+        if cached is not None:
+            user, token = cached
+            return copy.copy(user), token
+
+        # A lagging replica would keep a revoked token or deactivated user cached for another TTL
+        with use_primary():
+            user, token = super().authenticate_credentials(key)
+        token_cache.set(key, (user, token), user.pk)
+        return copy.copy(user), token
+
+
+class CachedBasicAuthentication(BasicAuthentication):
+    def authenticate_credentials(self, userid, password, request=None):
+        key = credential_key(userid, password)
+        user = credential_cache.get(key)
+        if user is not None:
+            return copy.copy(user), None
+
+        with use_primary():
+            user, auth = super().authenticate_credentials(userid, password, request=request)
+        credential_cache.set(key, user, user.pk)
+        return copy.copy(user), auth
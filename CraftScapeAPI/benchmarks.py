@@ -0,0 +1,351 @@
+"""
+Benchmarks run by ``manage.py benchmark``.
+
+Each benchmark is registered under a name with ``@benchmark`` and called with the requested number of iterations
+against a freshly flushed test database. It returns an ordered mapping of labels to ``measure`` results so alternative
+implementations can be compared side by side.
+"""
+import base64
+import math
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from random import Random
+from django.contrib.auth.models import User
+from django.db import connection, connections, reset_queries, transaction, OperationalError
+from django.urls import reverse
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authentication import TokenAuthentication, BasicAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory, APIClient
+from CraftScapeDatabase import spatial
+from CraftScapeDatabase.bulk import bulk_update
+from CraftScapeDatabase.models import Character, Inventory, GameItem, StaticGameItem
+from CraftScapeDatabase.positions import positions
+from CraftScapeDatabase.provisioning import provision_characters
+from CraftScapeDatabase.world import generate_world
+from CraftScapeAPI.authentication import CachedTokenAuthentication, CachedBasicAuthentication, token_cache, \
+    credential_cache
+
+BENCHMARKS = OrderedDict()
+
+
+def benchmark(name):
+    def register(func):
+        BENCHMARKS[name] = func
+        return func
+    return register
+
+
+def percentile(timings, percent):
+    return timings[min(len(timings) - 1, int(round(percent / 100 * (len(timings) - 1))))]
+
+
+def summarize(timings):
+    timings = sorted(timings)
+    total = sum(timings)
+    return OrderedDict((
+        ('iterations', len(timings)),
+        ('mean_ms', round(total / len(timings) * 1000, 4)),
+        ('p50_ms', round(percentile(timings, 50) * 1000, 4)),
+        ('p95_ms', round(percentile(timings, 95) * 1000, 4)),
+        ('p99_ms', round(percentile(timings, 99) * 1000, 4)),
+        ('ops_per_sec', round(len(timings) / total, 1) if total else None),
+    ))
+
+
+def measure(func, iterations):
+    timings = []
+    for iteration in range(iterations):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return summarize(timings)
+
+
+@benchmark('auth')
+def auth_benchmark(iterations):
+    username, password = 'benchmark', 'benchmark-password'
+    user = User.objects.create_user(username, password=password)
+    token = Token.objects.create(user=user)
+    credentials = base64.b64encode('{0}:{1}'.format(username, password).encode('utf-8')).decode('ascii')
+    factory = APIRequestFactory()
+    token_request = Request(factory.get('/', HTTP_AUTHORIZATION='Token {0}'.format(token.key)))
+    basic_request = Request(factory.get('/', HTTP_AUTHORIZATION='Basic {0}'.format(credentials)))
+    token_cache.clear()
+    credential_cache.clear()
+
+    # Every uncached basic authentication runs the full password hasher, so fewer rounds are enough to compare
+    return OrderedDict((
+        ('TokenAuthentication', measure(lambda: TokenAuthentication().authenticate(token_request), iterations)),
+        ('CachedTokenAuthentication',
+         measure(lambda: CachedTokenAuthentication().authenticate(token_request), iterations)),
+        ('BasicAuthentication',
+         measure(lambda: BasicAuthentication().authenticate(basic_request), max(1, iterations // 10))),
+        ('CachedBasicAuthentication',
+         measure(lambda: CachedBasicAuthentication().authenticate(basic_request), iterations)),
+    ))
+
+
+@benchmark('game_item_create')
+def game_item_create_benchmark(iterations, batch_size=25):
+    user = User.objects.create_user('benchmark', password='benchmark-password')
+    inventory = Character.objects.create(name='benchmark', user=user).inventories.get()
+    apple = StaticGameItem.objects.create(name='apple', sprite_name='apple', description='An apple.', max_stack=10,
+                                          value=5.0, equipable=False)
+    client = APIClient()
+    client.force_authenticate(user)
+    item = {'static_game_item': apple.pk, 'inventory': inventory.pk, 'inventory_position': 0}
+
+    def per_item():
+        for index in range(batch_size):
+            client.post('/api/game_item/', item, format='json')
+
+    def bulk():
+        client.post('/api/game_item/', [item] * batch_size, format='json')
+
+    return OrderedDict((
+        ('{0} single POSTs'.format(batch_size), measure(per_item, iterations)),
+        ('1 POST of {0} items'.format(batch_size), measure(bulk, iterations)),
+    ))
+
+
+@benchmark('character_snapshot')
+def character_snapshot_benchmark(iterations, fills=(0, 16, 64, 256)):
+    """
+    Loads a character snapshot as its bags fill up, the query count (and ideally the time per game item) stays flat.
+    """
+    user = User.objects.create_user('benchmark', password='benchmark-password')
+    character = Character.objects.create(name='benchmark', user=user, max_inventories=32)
+    axe = StaticGameItem.objects.create(name='axe', sprite_name='axe', description='An axe.', max_stack=1, value=5.0,
+                                        equipable=True)
+    client = APIClient()
+    client.force_authenticate(user)
+    url = '/api/character/{0}/snapshot/'.format(character.pk)
+
+    results = OrderedDict()
+    inventories = list(character.inventories.all())
+    filled = 0
+    for fill in fills:
+        while len(inventories) * 16 < fill:
+            inventories.append(Inventory.objects.create(character=character, size=16))
+        slots = [(inventory, position) for inventory in inventories for position in range(inventory.size)]
+        GameItem.objects.bulk_create([
+            GameItem(inventory=inventory, inventory_position=position, static_game_item=axe, created_by=character)
+            for inventory, position in slots[filled:fill]
+        ])
+        filled = fill
+
+        # The query log is a bounded deque, with DEBUG on it is already full of the setup queries
+        reset_queries()
+        with CaptureQueriesContext(connection) as queries:
+            client.get(url)
+        stats = measure(lambda: client.get(url), iterations)
+        stats['queries'] = len(queries)
+        results['{0} game items'.format(fill)] = stats
+    return results
+
+
+@benchmark('positions')
+def positions_benchmark(iterations, characters=50):
+    """
+    One round of position updates from ``characters`` characters, as full PATCHes and through the position buffer.
+    """
+    user = User.objects.create_user('benchmark', password='benchmark-password')
+    character_ids = provision_characters(user, characters)
+    client = APIClient()
+    client.force_authenticate(user)
+
+    def patch():
+        for character_id in character_ids:
+            client.patch('/api/character/{0}/'.format(character_id), {'x_pos': 1.0, 'y_pos': 2.0}, format='json')
+
+    def buffered():
+        for character_id in character_ids:
+            client.post('/api/character/{0}/position/'.format(character_id), {'x_pos': 1.0, 'y_pos': 2.0},
+                        format='json')
+
+    def buffered_and_flushed():
+        buffered()
+        positions.flush()
+
+    return OrderedDict((
+        ('{0} PATCHes'.format(characters), measure(patch, iterations)),
+        ('{0} buffered updates'.format(characters), measure(buffered, iterations)),
+        ('{0} buffered updates + flush'.format(characters), measure(buffered_and_flushed, iterations)),
+    ))
+
+
+@benchmark('nearby')
+def nearby_benchmark(iterations, sizes=(10000, 100000), density=0.0004, radius=100.0):
+    """
+    Radius queries at a fixed player density (characters per square unit) as the world and player count grow: the
+    grid's cost follows the local density, a bounding box query on the character table follows the table size.
+    """
+    user = User.objects.create_user('benchmark', password='benchmark-password')
+    random = Random(0)
+    character_ids = []
+    results = OrderedDict()
+    for size in sizes:
+        character_ids.extend(provision_characters(user, size - len(character_ids)))
+        side = math.sqrt(size / density)
+        characters = [Character(id=character_id, x_pos=random.uniform(0, side), y_pos=random.uniform(0, side))
+                      for character_id in character_ids]
+        bulk_update(characters, ['x_pos', 'y_pos'])
+        grid = spatial.characters.reload()
+        centers = [(random.uniform(radius, side - radius), random.uniform(radius, side - radius))
+                   for iteration in range(iterations)]
+
+        def grid_query():
+            x_pos, y_pos = centers[random.randrange(len(centers))]
+            grid.nearby(x_pos, y_pos, radius)
+
+        def table_query():
+            x_pos, y_pos = centers[random.randrange(len(centers))]
+            list(Character.objects.filter(x_pos__range=(x_pos - radius, x_pos + radius),
+                                          y_pos__range=(y_pos - radius, y_pos + radius))
+                 .values_list('id', 'x_pos', 'y_pos'))
+
+        results['grid, {0} characters'.format(size)] = measure(grid_query, iterations)
+        results['table, {0} characters'.format(size)] = measure(table_query, iterations)
+    return results
+
+
+# Query strings for routes that need more than a lookup, keyed by route name
+ENDPOINT_QUERIES = {
+    'character-nearby': lambda world: {'character': world['character'], 'radius': 250},
+    'character-feed': lambda world: {'since': -1},
+    'character-changes': lambda world: {'since': 0},
+}
+ENDPOINT_KWARGS = {
+    'game_item-by-uuid': lambda world: {'uuid': world['game_item_uuid']},
+}
+
+
+def endpoint_urls(client, world):
+    """
+    A GET URL for every list, detail and extra GET route of the API router. Detail routes use the first object the
+    list route returns to the benchmark user.
+    """
+    from CraftScapeAPI.urls import router
+
+    urls = OrderedDict()
+    for prefix, viewset, basename in router.registry:
+        lookup = None
+        for route in router.get_routes(viewset):
+            if 'get' not in route.mapping:
+                continue
+            name = route.name.format(basename=basename)
+            kwargs = ENDPOINT_KWARGS[name](world) if name in ENDPOINT_KWARGS else {}
+            if '{lookup}' in route.url:
+                if lookup is None:
+                    response = client.get(reverse('api:{0}-list'.format(basename)))
+                    rows = response.data.get('results', []) if isinstance(response.data, dict) else response.data
+                    lookup = rows[0]['id'] if rows else 0
+                kwargs['pk'] = lookup
+            query = ENDPOINT_QUERIES[name](world) if name in ENDPOINT_QUERIES else {}
+            urls[name] = (reverse('api:{0}'.format(name), kwargs=kwargs), query)
+    return urls
+
+
+@benchmark('endpoints')
+def endpoints_benchmark(iterations, **world_options):
+    """
+    Every GET route of the API against a small generated world, with the queries and response bytes of each.
+    """
+    options = {'users': 20, 'characters': 3, 'bags': 3, 'items': 10, 'static_items': 100, 'skills': 40,
+               'modifiers': 200}
+    options.update(world_options)
+    generate_world(**options)
+    user = User.objects.filter(username__startswith='world').order_by('id').first()
+    user.is_staff = True
+    user.save()
+    world = {
+        'character': user.characters.order_by('id').values_list('id', flat=True).first(),
+        'game_item_uuid': GameItem.objects.filter(inventory__character__user=user).values_list('uuid', flat=True)[0],
+    }
+    spatial.characters.reload()
+    client = APIClient()
+    client.force_authenticate(user)
+
+    results = OrderedDict()
+    for name, (url, query) in endpoint_urls(client, world).items():
+        reset_queries()
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(url, query)
+        stats = measure(lambda: client.get(url, query), iterations)
+        stats['status'] = response.status_code
+        stats['queries'] = len(queries)
+        stats['bytes'] = len(response.content)
+        results[name] = stats
+    return results
+
+
+SQLITE_MODES = OrderedDict((
+    ('django sqlite3', ('django.db.backends.sqlite3', {})),
+    ('WAL + pragmas', ('CraftScape.sqlite_backend', {'serialize_writes': False})),
+    ('WAL + serialized writes', ('CraftScape.sqlite_backend', {})),
+))
+
+
+def sqlite_database(alias, engine, name, options):
+    connections.databases[alias] = {'ENGINE': engine, 'NAME': name, 'OPTIONS': options}
+    connections.ensure_defaults(alias)
+    connections.prepare_test_settings(alias)
+
+
+@benchmark('sqlite_concurrency')
+def sqlite_concurrency_benchmark(iterations, threads=8, rows=16):
+    """
+    ``threads`` threads each run ``iterations`` read-then-write transactions against one SQLite file, in each
+    backend mode. Failed transactions ("database is locked") are counted, throughput is per wall clock second.
+    """
+    results = OrderedDict()
+    for label, (engine, options) in SQLITE_MODES.items():
+        directory = tempfile.TemporaryDirectory()
+        alias = 'sqlite_benchmark'
+        sqlite_database(alias, engine, os.path.join(directory.name, 'benchmark.sqlite3'), options)
+        with connections[alias].cursor() as cursor:
+            cursor.execute('CREATE TABLE counter (id INTEGER PRIMARY KEY, value INTEGER NOT NULL)')
+            for row in range(rows):
+                cursor.execute('INSERT INTO counter (id, value) VALUES (%s, 0)', [row])
+        connections[alias].close()
+
+        timings, errors = [], []
+
+        def writer(seed):
+            random = Random(seed)
+            for iteration in range(iterations):
+                row = random.randrange(rows)
+                start = time.perf_counter()
+                try:
+                    with transaction.atomic(using=alias), connections[alias].cursor() as cursor:
+                        cursor.execute('SELECT value FROM counter WHERE id = %s', [row])
+                        value = cursor.fetchone()[0]
+                        cursor.execute('UPDATE counter SET value = %s WHERE id = %s', [value + 1, row])
+                except OperationalError:
+                    errors.append(row)
+                else:
+                    timings.append(time.perf_counter() - start)
+            connections[alias].close()
+
+        workers = [threading.Thread(target=writer, args=(seed,)) for seed in range(threads)]
+        start = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - start
+
+        stats = summarize(timings) if timings else OrderedDict((field, 0) for field in (
+            'iterations', 'mean_ms', 'p50_ms', 'p95_ms', 'p99_ms', 'ops_per_sec'))
+        stats['errors'] = len(errors)
+        stats['tx_per_sec'] = round(len(timings) / elapsed, 1)
+        results[label] = stats
+        del connections[alias]
+        del connections.databases[alias]
+        directory.cleanup()
+    return results
@@ -0,0 +1,66 @@
+"""
+Prebuilt catalog bundle.
+
+The whole static catalog (static items with their item types, static item modifiers, item type modifiers, skills and
+skill dependencies) is serialized once per catalog version into a single JSON document, compressed with gzip and,
+when the optional ``brotli`` package is installed, with brotli. Requests are then answered with a plain copy of the
+stored bytes. The document is addressed by a hash of its content, so it can be cached forever.
+"""
+import gzip
+import hashlib
+import threading
+from collections import OrderedDict, namedtuple
+from rest_framework.renderers import JSONRenderer
+from CraftScape.db_router import use_primary
+from CraftScapeDatabase import catalog
+from CraftScapeDatabase.models import StaticGameItem, StaticItemModifier, StaticItemTypeModifier, Skill, \
+    SkillDependency
+from CraftScapeAPI.serializers import StaticGameItemSerializer, StaticItemModifierSerializer, \
+    StaticItemTypeModifierSerializer, SkillSerializer, SkillDependencySerializer
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Content-Encoding -> compressor, in order of preference
+ENCODERS = OrderedDict()
+if brotli is not None:
+    ENCODERS['br'] = lambda content: brotli.compress(content, quality=11)
+ENCODERS['gzip'] = lambda content: gzip.compress(content, compresslevel=9)
+
+Bundle = namedtuple('Bundle', ('version', 'digest', 'content', 'encoded'))
+
+_lock = threading.Lock()
+_bundle = None
+
+
+def build(version):
+    data = OrderedDict((
+        ('static_game_items', StaticGameItemSerializer(StaticGameItem.objects.order_by('id'), many=True).data),
+        ('static_item_modifiers', StaticItemModifierSerializer(StaticItemModifier.objects.order_by('id'),
+                                                               many=True).data),
+        ('static_item_type_modifiers', StaticItemTypeModifierSerializer(StaticItemTypeModifier.objects.order_by('id'),
+                                                                        many=True).data),
+        ('skills', SkillSerializer(Skill.objects.order_by('id'), many=True).data),
+        ('skill_dependencies', SkillDependencySerializer(SkillDependency.objects.order_by('id'), many=True).data),
+    ))
+    content = JSONRenderer().render(data)
+    encoded = {encoding: encode(content) for encoding, encode in ENCODERS.items()}
+    return Bundle(version, hashlib.sha256(content).hexdigest()[:20], content, encoded)
+
+
+def get_bundle():
+    """
+    The bundle for the current catalog version, built by the first request that sees a new version.
+    """
+    global _bundle
+    version = catalog.get_version()
+    bundle = _bundle
+    if bundle is not None and bundle.version == version:
+        return bundle
+
+    with _lock, use_primary():
+        if _bundle is None or _bundle.version != version:
+            _bundle = build(version)
+        return _bundle
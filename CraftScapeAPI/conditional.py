@@ -0,0 +1,97 @@
+"""
+Conditional GET support for viewsets.
+
+The ETag of a response is derived from cheap version stamps (the catalog version token, plus the state versions of
+the requesting user's characters for their own data) together with the path, query string and rendered format, never
+from the rendered body. A request whose ``If-None-Match`` matches is answered with ``304 Not Modified`` straight after
+authentication, before the queryset or any serializer is touched.
+
+There is no Last-Modified support: neither version stamp is a timestamp and none of the tables record one.
+"""
+import hashlib
+from django.utils.http import parse_etags
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from rest_framework.response import Response
+from CraftScapeDatabase import catalog
+from CraftScapeDatabase.models import Character
+
+
+class NotModified(APIException):
+    status_code = status.HTTP_304_NOT_MODIFIED
+
+
+class ConditionalGetMixin:
+    """
+    Subclasses override ``get_etag_version`` to return the version a response is tagged with, or None when the
+    response cannot be tagged. The default tags nothing.
+    """
+    conditional_actions = ('list', 'retrieve')
+    etag = None
+
+    def get_etag_version(self, request):
+        return None
+
+    def get_etag(self, request):
+        if request.method not in ('GET', 'HEAD') or self.action not in self.conditional_actions:
+            return None
+        version = self.get_etag_version(request)
+        if version is None:
+            return None
+        key = '|'.join(str(part) for part in (version, request.accepted_renderer.format, request.get_full_path()))
+        return '"{0}"'.format(hashlib.sha1(key.encode('utf-8')).hexdigest())
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self.etag = self.get_etag(request)
+        if self.etag is not None:
+            etags = parse_etags(request.META.get('HTTP_IF_NONE_MATCH', ''))
+            if '*' in etags or self.etag in etags:
+                raise NotModified()
+
+    def handle_exception(self, exc):
+        if isinstance(exc, NotModified):
+            return Response(status=exc.status_code)
+        return super().handle_exception(exc)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if self.etag is not None and response.status_code in (status.HTTP_200_OK, status.HTTP_304_NOT_MODIFIED):
+            response['ETag'] = self.etag
+        return response
+
+
+class CatalogConditionalGetMixin(ConditionalGetMixin):
+    """
+    Tags catalog endpoints with the shared catalog version, which changes whenever a catalog row is saved or deleted.
+    """
+
+    def get_etag_version(self, request):
+        return catalog.get_version()
+
+
+class CharacterStateConditionalGetMixin(ConditionalGetMixin):
+    """
+    Tags per-character endpoints with the state versions of the characters they show, read with one query. Every
+    write to a character, its bags, game items or equipment increments its state version.
+
+    ``character_lookup`` is the Character field the detail route's pk refers to. Endpoints with ``embeds_catalog``
+    nest static items in their game items, so the catalog version is part of their tag as well.
+    """
+    character_lookup = 'pk'
+    embeds_catalog = True
+    # Character fields that change whenever the response does
+    version_fields = ('state_version',)
+
+    def get_etag_version(self, request):
+        if request.query_params.get('find_all'):
+            return None
+        characters = Character.objects.filter(user=request.user.id)
+        if 'pk' in self.kwargs:
+            characters = characters.filter(**{self.character_lookup: self.kwargs['pk']})
+        versions = list(characters.order_by('id').values_list('id', *self.version_fields))
+        if 'pk' in self.kwargs and not versions:
+            return None
+        if self.embeds_catalog:
+            return request.user.id, versions, catalog.get_version()
+        return request.user.id, versions
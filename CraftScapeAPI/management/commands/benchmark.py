@@ -0,0 +1,54 @@
+import datetime
+import json
+from collections import OrderedDict
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from CraftScapeAPI.benchmarks import BENCHMARKS
+
+SUMMARY_FIELDS = ('iterations', 'mean_ms', 'p50_ms', 'p95_ms', 'p99_ms', 'ops_per_sec')
+
+
+class Command(BaseCommand):
+    help = 'Runs the named benchmarks (all of them by default) against a throwaway test database.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('benchmarks', nargs='*', help='One or more of: {0}'.format(', '.join(BENCHMARKS)))
+        parser.add_argument('--iterations', type=int, default=200, help='Timed iterations per measurement.')
+        parser.add_argument('--output', help='Also write the results as JSON to this file.')
+
+    def handle(self, *args, **options):
+        names = options['benchmarks'] or list(BENCHMARKS)
+        unknown = [name for name in names if name not in BENCHMARKS]
+        if unknown:
+            raise CommandError('Unknown benchmarks: {0}'.format(', '.join(unknown)))
+
+        results = OrderedDict()
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            for name in names:
+                call_command('flush', interactive=False, verbosity=0)
+                results[name] = BENCHMARKS[name](options['iterations'])
+                self.report(name, results[name])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(OrderedDict((
+                    ('created', datetime.datetime.utcnow().isoformat()),
+                    ('iterations', options['iterations']),
+                    ('vendor', connection.vendor),
+                    ('benchmarks', results),
+                )), output, indent=2)
+
+    def report(self, name, results):
+        self.stdout.write(self.style.MIGRATE_HEADING(name))
+        for label, stats in results.items():
+            line = '  {0:<32} mean {1:>10.4f} ms  p50 {2:>10.4f} ms  p95 {3:>10.4f} ms  p99 {4:>10.4f} ms  ' \
+                   '{5:>10} ops/s'.format(label, stats['mean_ms'], stats['p50_ms'], stats['p95_ms'], stats['p99_ms'],
+                                          stats['ops_per_sec'])
+            # Benchmark specific extras such as query counts
+            extras = ['{0} {1}'.format(key, value) for key, value in stats.items() if key not in SUMMARY_FIELDS]
+            self.stdout.write('  '.join([line] + extras))
@@ -0,0 +1,110 @@
+import json
+import operator
+from functools import reduce
+from django.conf import settings
+from django.core import exceptions
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import Cursor, CursorPagination, _reverse_ordering
+
+
+class IdCursorPagination(CursorPagination):
+    """
+    Keyset pagination on the primary key, every page costs the same indexed range scan however deep it is.
+    """
+    ordering = 'id'
+    page_size = settings.REST_FRAMEWORK['PAGE_SIZE']
+    page_size_query_param = 'page_size'
+    max_page_size = settings.API_MAX_PAGE_SIZE
+
+
+class KeysetCursorPagination(IdCursorPagination):
+    """
+    Keyset pagination on several columns that are unique together. CursorPagination only filters on the first column
+    and skips rows that tie on it with an OFFSET, so the cursor here holds every column of the row a page stops at and
+    the next page starts strictly after that row.
+    """
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.cursor = self.decode_cursor(request)
+        reverse, position = (False, None) if self.cursor is None else (self.cursor.reverse, self.cursor.position)
+
+        queryset = queryset.order_by(*(_reverse_ordering(self.ordering) if reverse else self.ordering))
+        if position is not None:
+            try:
+                queryset = queryset.filter(self.after(position, reverse))
+            except (TypeError, ValueError, exceptions.ValidationError):
+                raise NotFound(self.invalid_cursor_message)
+
+        results = list(queryset[:self.page_size + 1])
+        self.page = results[:self.page_size]
+        if reverse:
+            self.page.reverse()
+        # The row a cursor points at is on the other side of it, so there is always a page back the way it came
+        self.has_next = position is not None if reverse else len(results) > self.page_size
+        self.has_previous = len(results) > self.page_size if reverse else position is not None
+        self.display_page_controls = (self.has_previous or self.has_next) and self.template is not None
+        return self.page
+
+    def after(self, position, reverse):
+        """
+        Returns the filter for the rows that come after ``position``, or before it when paging in ``reverse``.
+        """
+        if len(position) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        conditions, equal = [], Q()
+        for order, value in zip(self.ordering, position):
+            name = order.lstrip('-')
+            lookup = 'lt' if order.startswith('-') != reverse else 'gt'
+            conditions.append(equal & Q(**{'{0}__{1}'.format(name, lookup): value}))
+            equal &= Q(**{name: value})
+        return reduce(operator.or_, conditions)
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        position = self._get_position_from_instance(self.page[-1], self.ordering) if self.page else None
+        return self.encode_cursor(Cursor(offset=0, reverse=False, position=position))
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        position = self._get_position_from_instance(self.page[0], self.ordering) if self.page else None
+        return self.encode_cursor(Cursor(offset=0, reverse=True, position=position))
+
+    def decode_cursor(self, request):
+        cursor = super().decode_cursor(request)
+        if cursor is None or cursor.position is None:
+            return cursor
+        try:
+            position = json.loads(cursor.position)
+        except ValueError:
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(position, list):
+            raise NotFound(self.invalid_cursor_message)
+        return cursor._replace(position=position)
+
+    def encode_cursor(self, cursor):
+        if cursor.position is not None:
+            cursor = cursor._replace(position=json.dumps(cursor.position))
+        return super().encode_cursor(cursor)
+
+    def _get_position_from_instance(self, instance, ordering):
+        names = [order.lstrip('-') for order in ordering]
+        if isinstance(instance, dict):
+            return [str(instance[name]) for name in names]
+        return [str(getattr(instance, name)) for name in names]
+
+
+class NameCursorPagination(KeysetCursorPagination):
+    ordering = ('name', 'id')
+
+
+class InventoryCursorPagination(KeysetCursorPagination):
+    # Keeps each character's bags in position order, (character, position) is unique
+    ordering = ('character_id', 'position')
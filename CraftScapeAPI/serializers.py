@@ -1,10 +1,16 @@
 import uuid
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.db import models, transaction
 from django.db.models import ManyToOneRel
 from rest_framework import serializers
 from CraftScapeDatabase.models import Character, Inventory, GameItem, Skill, SkillDependency, CharacterSkill, \
     GameItemModifier, ItemModifier, StaticItemModifier, StaticGameItem, GameItemType, StaticItemTypeModifier, \
-    Equipment
+    Equipment, DeletedObject
+from CraftScapeDatabase.catalog import catalog
+from CraftScapeDatabase.skills import check_dependency
+from CraftScapeDatabase.state import bump_state_versions
+from CraftScapeDatabase.inventory_operations import OPERATIONS, MOVE, SWAP, SPLIT, MERGE
 
 
 class SkillSerializer(serializers.ModelSerializer):
@@ -18,6 +24,15 @@ class SkillDependencySerializer(serializers.ModelSerializer):
         model = SkillDependency
         fields = '__all__'
 
+    def validate(self, attrs):
+        # Partial updates keep the stored value of the fields they leave out
+        child, parent, dependency_type = (attrs.get(name, getattr(self.instance, name, None))
+                                          for name in ('child_skill', 'parent_skill', 'dependency_type'))
+        # The Django ValidationError raised on a cycle becomes a 400 like any other serializer error
+        check_dependency(child.pk, parent.pk, dependency_type or SkillDependency.UNION,
+                         exclude=getattr(self.instance, 'pk', None))
+        return attrs
+
 
 class CharacterSkillSerializer(serializers.ModelSerializer):
     class Meta:
@@ -32,9 +47,12 @@ class GameItemModifierSerializer(serializers.ModelSerializer):
 
 
 class ItemModifierSerializer(serializers.ModelSerializer):
+    duration_remainder = serializers.IntegerField(min_value=0)
+
     class Meta:
         model = ItemModifier
         fields = '__all__'
+        read_only_fields = ('expires_at',)
 
 
 class StaticItemModifierSerializer(serializers.ModelSerializer):
@@ -44,12 +62,16 @@ class StaticItemModifierSerializer(serializers.ModelSerializer):
 
 
 class StaticGameItemSerializer(serializers.ModelSerializer):
-    item_types = serializers.StringRelatedField(many=True, read_only=True)
+    item_types = serializers.SerializerMethodField()
 
     class Meta:
         model = StaticGameItem
         fields = '__all__'
 
+    def get_item_types(self, obj):
+        static_item = catalog.get_static_item(obj.pk)
+        return list(static_item.item_types) if static_item else []
+
 
 class GameItemTypeSerializer(serializers.ModelSerializer):
     class Meta:
@@ -64,7 +86,7 @@ class StaticItemTypeModifierSerializer(serializers.ModelSerializer):
 
 
 class GameItemSerializer(serializers.ModelSerializer):
-    static_game_item = StaticGameItemSerializer(many=False, read_only=True)
+    static_game_item = StaticGameItemSerializer(source='static_item', many=False, read_only=True)
     created_by_name = serializers.ReadOnlyField(read_only=True)
     created_by = serializers.PrimaryKeyRelatedField(read_only=True)
 
@@ -81,31 +103,162 @@ class GameItemSerializer(serializers.ModelSerializer):
             }
         }
 
+
+class GameItemCreateListSerializer(serializers.ListSerializer):
+    """
+    Validates a whole batch of new game items with one query for their uuids and one for their inventories, then
+    inserts them with a single bulk_create.
+    """
+
+    def validate(self, attrs):
+        errors = []
+        uuids = [item['uuid'] for item in attrs]
+        if len(set(uuids)) != len(uuids):
+            errors.append('Game item uuids must be unique.')
+        for item_uuid in GameItem.objects.filter(uuid__in=uuids).values_list('uuid', flat=True):
+            errors.append('Game item {0} already exists.'.format(item_uuid))
+
+        inventories = Inventory.objects.in_bulk({item['inventory'] for item in attrs})
+        user = self.context['request'].user
+        for index, item in enumerate(attrs):
+            inventory = inventories.get(item['inventory'])
+            if inventory is None:
+                errors.append('Item {0}: inventory {1} does not exist.'.format(index, item['inventory']))
+            elif not user.is_staff and inventory.character_id not in self.context['character_ids']:
+                errors.append('Item {0}: inventory {1} does not belong to you.'.format(index, item['inventory']))
+
+        if errors:
+            raise serializers.ValidationError(errors)
+        self.inventories = inventories
+        return attrs
+
     def create(self, validated_data):
-        static_game_item_id = self.context['request'].data['static_game_item']
-        static_game_item = StaticGameItem.objects.get(pk=static_game_item_id)
-        inventory = Inventory.objects.get(pk=self.context['request'].data['inventory'])
-        created_by = inventory.character
-        data = {
-            "uuid": validated_data.pop("uuid"),
-            "inventory_position": validated_data.pop('inventory_position'),
-            "stack_size": validated_data.pop('stack_size'),
-            "inventory": inventory,
-            "created_by": created_by,
-            "static_game_item": static_game_item
-        }
-        item = GameItem.objects.create(**data)
-        return item
+        with transaction.atomic():
+            versions = bump_state_versions(inventory.character_id for inventory in self.inventories.values())
+            items = []
+            for item in validated_data:
+                character_id = self.inventories[item['inventory']].character_id
+                items.append(GameItem(uuid=item['uuid'],
+                                      inventory_id=item['inventory'],
+                                      inventory_position=item['inventory_position'],
+                                      stack_size=item['stack_size'],
+                                      static_game_item_id=item['static_game_item'],
+                                      created_by_id=character_id,
+                                      state_version=versions[character_id]))
+            GameItem.objects.bulk_create(items)
+        created = GameItem.objects.select_related('created_by').in_bulk([item.uuid for item in items], field_name='uuid')
+        return [created[item.uuid] for item in items]
+
+
+class GameItemCreateSerializer(serializers.Serializer):
+    uuid = serializers.UUIDField(default=uuid.uuid4)
+    static_game_item = serializers.IntegerField()
+    inventory = serializers.IntegerField()
+    inventory_position = serializers.IntegerField()
+    stack_size = serializers.IntegerField(min_value=1, default=1)
+
+    class Meta:
+        list_serializer_class = GameItemCreateListSerializer
+
+    def validate(self, attrs):
+        static_item = catalog.get_static_item(attrs['static_game_item'])
+        if static_item is None:
+            raise serializers.ValidationError('Static game item {0} does not exist.'.format(attrs['static_game_item']))
+        if attrs['stack_size'] > static_item.max_stack:
+            raise serializers.ValidationError('Stack size has exceeded the max stack size.')
+        return attrs
+
+
+class EquippedGameItemSerializer(GameItemSerializer):
+    """
+    Equipment slots are filled by uuid only, so nothing else is validated (or looked up) on the way in.
+    """
+    uuid = serializers.UUIDField()
+
+    class Meta(GameItemSerializer.Meta):
+        read_only_fields = ('inventory', 'inventory_position', 'stack_size')
+
+
+class BoundedListSerializer(serializers.ListSerializer):
+    """
+    Nested list that only serializes the first ``limit`` objects, the rest can be paged through their own endpoint.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.limit = kwargs.pop('limit')
+        super().__init__(*args, **kwargs)
+
+    def to_representation(self, data):
+        iterable = data.all() if isinstance(data, models.Manager) else data
+        return super().to_representation(iterable[:self.limit])
+
+
+class InventoryOperationSerializer(serializers.Serializer):
+    REQUIRED_FIELDS = {
+        MOVE: ('inventory', 'position'),
+        SWAP: ('other',),
+        SPLIT: ('amount', 'inventory', 'position'),
+        MERGE: ('into',),
+    }
+
+    op = serializers.ChoiceField(choices=OPERATIONS)
+    item = serializers.UUIDField()
+    other = serializers.UUIDField(required=False)
+    into = serializers.UUIDField(required=False)
+    inventory = serializers.IntegerField(required=False)
+    position = serializers.IntegerField(required=False, min_value=0)
+    amount = serializers.IntegerField(required=False, min_value=1)
+    uuid = serializers.UUIDField(required=False)
+
+    def validate(self, attrs):
+        missing = [name for name in self.REQUIRED_FIELDS[attrs['op']] if name not in attrs]
+        if missing:
+            raise serializers.ValidationError({name: 'This field is required.' for name in missing})
+        return attrs
+
+
+class InventoryTransactionSerializer(serializers.Serializer):
+    operations = InventoryOperationSerializer(many=True)
+
+
+class InventorySlotSerializer(serializers.Serializer):
+    inventory = serializers.IntegerField()
+    inventory_position = serializers.IntegerField()
+    game_item = GameItemSerializer(allow_null=True)
 
 
 class InventorySerializer(serializers.ModelSerializer):
-    game_items = GameItemSerializer(many=True, read_only=True)
+    game_items = BoundedListSerializer(child=GameItemSerializer(), read_only=True,
+                                       limit=settings.INVENTORY_GAME_ITEMS_LIMIT)
 
     class Meta:
         model = Inventory
         fields = ('id', 'position', 'character', 'size', 'game_items')
 
 
+class InventoryStateSerializer(serializers.ModelSerializer):
+    """
+    A bag without its game items, delta sync sends changed game items on their own.
+    """
+
+    class Meta:
+        model = Inventory
+        fields = ('id', 'position', 'character', 'size', 'state_version')
+
+
+class InventorySnapshotSerializer(InventorySerializer):
+    """
+    A bag with all of its game items, a bag's size already bounds how many there can be.
+    """
+    game_items = GameItemSerializer(many=True, read_only=True)
+
+
+class DeletedObjectSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = DeletedObject
+        fields = ('model', 'object_id', 'state_version')
+
+
 class CharacterSerializer(serializers.ModelSerializer):
     inventories = serializers.HyperlinkedRelatedField(many=True, read_only=True, view_name='api:inventory-detail')
     equipment = serializers.HyperlinkedRelatedField(read_only=True, view_name="api:equipment-detail")
@@ -131,6 +284,30 @@ class CharacterSerializer(serializers.ModelSerializer):
         return Character.objects.create(name=name, user=user)
 
 
+class CharacterProvisionSerializer(serializers.Serializer):
+    MAX_COUNT = 10000
+
+    user = serializers.PrimaryKeyRelatedField(queryset=User.objects.all())
+    count = serializers.IntegerField(min_value=1, max_value=MAX_COUNT)
+    name_prefix = serializers.CharField(max_length=200, default='character')
+
+
+class PositionSerializer(serializers.Serializer):
+    x_pos = serializers.FloatField()
+    y_pos = serializers.FloatField()
+
+
+class NearbySerializer(serializers.Serializer):
+    character = serializers.IntegerField()
+    radius = serializers.FloatField(min_value=0, max_value=settings.NEARBY_MAX_RADIUS)
+    limit = serializers.IntegerField(min_value=1, max_value=settings.API_MAX_PAGE_SIZE, default=100)
+
+
+class FeedSerializer(serializers.Serializer):
+    since = serializers.IntegerField(default=0)
+    timeout = serializers.FloatField(min_value=0, max_value=settings.FEED_MAX_TIMEOUT, default=settings.FEED_MAX_TIMEOUT)
+
+
 class UserSerializer(serializers.ModelSerializer):
     characters = serializers.HyperlinkedRelatedField(many=True, read_only=True, view_name='api:character-detail')
 
@@ -140,16 +317,16 @@ class UserSerializer(serializers.ModelSerializer):
 
 
 class EquipmentSerializer(serializers.ModelSerializer):
-    ring = GameItemSerializer(required=False, allow_null=True)
-    neck = GameItemSerializer(required=False, allow_null=True)
-    head = GameItemSerializer(required=False, allow_null=True)
-    shoulders = GameItemSerializer(required=False, allow_null=True)
-    chest = GameItemSerializer(required=False, allow_null=True)
-    main_hand = GameItemSerializer(required=False, allow_null=True)
-    back = GameItemSerializer(required=False, allow_null=True)
-    hands = GameItemSerializer(required=False, allow_null=True)
-    feet = GameItemSerializer(required=False, allow_null=True)
-    legs = GameItemSerializer(required=False, allow_null=True)
+    ring = EquippedGameItemSerializer(required=False, allow_null=True)
+    neck = EquippedGameItemSerializer(required=False, allow_null=True)
+    head = EquippedGameItemSerializer(required=False, allow_null=True)
+    shoulders = EquippedGameItemSerializer(required=False, allow_null=True)
+    chest = EquippedGameItemSerializer(required=False, allow_null=True)
+    main_hand = EquippedGameItemSerializer(required=False, allow_null=True)
+    back = EquippedGameItemSerializer(required=False, allow_null=True)
+    hands = EquippedGameItemSerializer(required=False, allow_null=True)
+    feet = EquippedGameItemSerializer(required=False, allow_null=True)
+    legs = EquippedGameItemSerializer(required=False, allow_null=True)
 
     class Meta:
         model = Equipment
@@ -167,11 +344,16 @@ class EquipmentSerializer(serializers.ModelSerializer):
             if not isinstance(field, ManyToOneRel) and field.name != 'id':
                 field_names.append(field.name)
 
+        uuids = {name: validated_data[name]['uuid'] for name in field_names if validated_data.get(name) is not None}
+        items = GameItem.objects.in_bulk(list(uuids.values()), field_name='uuid')
+
         for name in field_names:
-            if name in validated_data and validated_data[name] is not None:
-                setattr(instance, name, GameItem.objects.get(uuid=validated_data[name]['uuid']))
-            else:
+            if name not in uuids:
                 setattr(instance, name, None)
+            elif uuids[name] in items:
+                setattr(instance, name, items[uuids[name]])
+            else:
+                raise serializers.ValidationError({name: 'Game item {0} does not exist.'.format(uuids[name])})
 
         instance.save()
 
@@ -0,0 +1,23 @@
+from django.contrib.auth.models import User
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+from CraftScapeDatabase.models import Character
+from CraftScapeAPI.authentication import token_cache, invalidate_user, character_owners
+
+
+# These only reach this worker's caches, other workers drop their entries when AUTH_CACHE_TTL runs out
+@receiver(post_delete, sender=Token)
+def invalidate_token(sender, instance, **kwargs):
+    token_cache.delete(instance.key)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user_credentials(sender, instance, **kwargs):
+    invalidate_user(instance.pk)
+
+
+@receiver(post_delete, sender=Character)
+def forget_character_owner(sender, instance, **kwargs):
+    character_owners.delete(instance.pk)
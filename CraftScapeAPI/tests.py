@@ -1,3 +1,1266 @@
-from django.test import TestCase
+import asyncio
+import base64
+import gzip
+import json
+import os
+import tempfile
+import re
+import threading
+import time
+import uuid
+from unittest import mock
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection, connections, transaction, OperationalError
+from django.http import HttpResponse
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework import viewsets
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+from CraftScape.db_router import ReplicaRouter, pinned_to_primary, use_primary
+from CraftScape.middleware import ReplicaRoutingMiddleware
+from CraftScapeAPI import bundle
+from CraftScapeAPI.benchmarks import sqlite_database
+from CraftScapeAPI.conditional import ConditionalGetMixin
+from CraftScapeAPI.authentication import CachedTokenAuthentication, CachedBasicAuthentication, token_cache, \
+    credential_cache, character_owners
+from CraftScapeDatabase import feed, spatial
+from CraftScapeDatabase.catalog import catalog, bump_version
+from CraftScapeDatabase.positions import positions
+from CraftScapeDatabase.skills import skill_graph
+from CraftScapeDatabase.models import Character, Inventory, GameItem, Equipment, Skill, SkillDependency, \
+    CharacterSkill, StaticGameItem, ItemModifier
+from CraftScapeDatabase.tests import create_static_item
+from CraftScapeAPI.views import CharacterViewSet, InventoryViewSet, StaticGameItemViewSet
 
-# Create your tests here.
+
+class APITestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('player', password='password')
+        self.character = Character.objects.create(name='player', user=self.user)
+        self.axe = create_static_item('axe', types=('mainHand',))
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def fill_inventories(self, bags, items_per_bag):
+        inventories = list(self.character.inventories.all())
+        while len(inventories) < bags:
+            inventories.append(Inventory.objects.create(character=self.character, size=16))
+        for inventory in inventories:
+            for position in range(items_per_bag):
+                GameItem.objects.create(inventory=inventory, inventory_position=position,
+                                        static_game_item=self.axe, created_by=self.character)
+        catalog.snapshot()
+        return inventories
+
+
+class InventoryQueryBudgetTestCase(APITestCase):
+    def test_list_query_count_is_constant(self):
+        self.fill_inventories(bags=1, items_per_bag=1)
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/inventory/')
+        self.assertEqual(len(response.data['results']), 1)
+
+        self.fill_inventories(bags=5, items_per_bag=16)
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/inventory/')
+        self.assertEqual(len(response.data['results']), 5)
+        game_item = response.data['results'][0]['game_items'][0]
+        self.assertEqual(game_item['created_by_name'], 'player')
+        self.assertEqual(game_item['static_game_item']['item_types'], ['mainHand'])
+
+    def test_detail_query_count_is_constant(self):
+        inventory = self.fill_inventories(bags=1, items_per_bag=16)[0]
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/inventory/{0}/'.format(inventory.pk))
+        self.assertEqual(len(response.data['game_items']), 16)
+
+    def test_other_characters_are_hidden(self):
+        other = User.objects.create_user('other', password='password')
+        Character.objects.create(name='other', user=other)
+
+        response = self.client.get('/api/inventory/')
+
+        self.assertEqual([inventory['character'] for inventory in response.data['results']], [self.character.pk])
+
+
+@override_settings(SQL_TRACE_SAMPLE_RATE=1, SQL_TRACE_REPEAT_THRESHOLD=3)
+class QueryTracingTestCase(APITestCase):
+    def test_headers_report_queries(self):
+        self.fill_inventories(bags=1, items_per_bag=1)
+
+        with self.assertLogs('CraftScape.sql', 'INFO'):
+            response = self.client.get('/api/inventory/')
+
+        self.assertEqual(response['X-DB-Queries'], '2')
+        self.assertIn('X-DB-Time', response)
+
+    def test_repeated_statements_are_flagged(self):
+        for index in range(3):
+            Character.objects.create(name='alt{0}'.format(index), user=self.user)
+
+        with self.assertLogs('CraftScape.sql', 'WARNING') as logs:
+            self.client.get('/api/character/')
+
+        self.assertIn('"n_plus_one": [{"sql": "SELECT', logs.output[0])
+
+
+class QueryTracingDisabledTestCase(APITestCase):
+    def test_no_headers_by_default(self):
+        response = self.client.get('/api/inventory/')
+
+        self.assertNotIn('X-DB-Queries', response)
+
+
+class GameItemByUUIDTestCase(APITestCase):
+    def test_lookup_by_uuid(self):
+        item = GameItem.objects.create(inventory=self.character.inventories.get(), inventory_position=0,
+                                       static_game_item=self.axe)
+
+        response = self.client.get('/api/game_item/by-uuid/{0}/'.format(item.uuid))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['id'], item.pk)
+
+    def test_unknown_uuid(self):
+        response = self.client.get('/api/game_item/by-uuid/{0}/'.format(uuid.uuid4()))
+
+        self.assertEqual(response.status_code, 404)
+
+
+class EquipmentUpdateTestCase(APITestCase):
+    def setUp(self):
+        super().setUp()
+        inventory = self.character.inventories.get()
+        self.items = {}
+        for position, (slot, item_type) in enumerate(Equipment.SLOTS):
+            static_item = create_static_item(slot, types=(item_type,))
+            self.items[slot] = GameItem.objects.create(inventory=inventory, inventory_position=position,
+                                                       static_game_item=static_item)
+        catalog.snapshot()
+
+    def put_equipment(self, slots):
+        data = {'id': self.character.equipment_id}
+        data.update({slot: {'uuid': str(value)} for slot, value in slots.items()})
+        return self.client.put('/api/equipment/{0}/'.format(self.character.equipment_id), data, format='json')
+
+    def test_all_slots_resolve_in_one_lookup(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.put_equipment({slot: item.uuid for slot, item in self.items.items()})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len([q for q in queries if '"game_item"."uuid" IN' in q['sql']]), 1)
+        equipment = Equipment.objects.get(pk=self.character.equipment_id)
+        self.assertEqual(equipment.main_hand_id, self.items['main_hand'].pk)
+
+    def test_unknown_uuid_is_rejected(self):
+        response = self.put_equipment({'ring': uuid.uuid4()})
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('ring', response.data)
+
+
+class CharacterProvisionTestCase(APITestCase):
+    def test_staff_can_provision(self):
+        self.user.is_staff = True
+        self.user.save()
+
+        response = self.client.post('/api/character/provision/', {'user': self.user.pk, 'count': 3}, format='json')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['created'], 3)
+        self.assertEqual(self.user.characters.count(), 4)
+
+    def test_players_cannot_provision(self):
+        response = self.client.post('/api/character/provision/', {'user': self.user.pk, 'count': 3}, format='json')
+
+        self.assertEqual(response.status_code, 403)
+
+
+class CachedAuthenticationTestCase(TestCase):
+    def setUp(self):
+        token_cache.clear()
+        credential_cache.clear()
+        self.user = User.objects.create_user('auth', password='password')
+        self.token = Token.objects.create(user=self.user)
+        self.factory = APIRequestFactory()
+
+    def token_request(self):
+        return Request(self.factory.get('/', HTTP_AUTHORIZATION='Token {0}'.format(self.token.key)))
+
+    def basic_request(self, password='password'):
+        credentials = base64.b64encode('auth:{0}'.format(password).encode('utf-8')).decode('ascii')
+        return Request(self.factory.get('/', HTTP_AUTHORIZATION='Basic {0}'.format(credentials)))
+
+    def test_token_is_cached(self):
+        CachedTokenAuthentication().authenticate(self.token_request())
+
+        with self.assertNumQueries(0):
+            user, token = CachedTokenAuthentication().authenticate(self.token_request())
+        self.assertEqual(user, self.user)
+
+    def test_deleted_token_is_rejected(self):
+        CachedTokenAuthentication().authenticate(self.token_request())
+        self.token.delete()
+
+        with self.assertRaises(AuthenticationFailed):
+            CachedTokenAuthentication().authenticate(self.token_request())
+
+    def test_deactivated_user_is_rejected(self):
+        CachedTokenAuthentication().authenticate(self.token_request())
+        CachedBasicAuthentication().authenticate(self.basic_request())
+        self.user.is_active = False
+        self.user.save()
+
+        with self.assertRaises(AuthenticationFailed):
+            CachedTokenAuthentication().authenticate(self.token_request())
+        with self.assertRaises(AuthenticationFailed):
+            CachedBasicAuthentication().authenticate(self.basic_request())
+
+    def test_changes_without_signals_expire_with_the_ttl(self):
+        CachedTokenAuthentication().authenticate(self.token_request())
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+
+        # Like another worker, this cache has not seen the change and serves the entry until it expires
+        CachedTokenAuthentication().authenticate(self.token_request())
+        with mock.patch.object(token_cache, 'ttl', 0):
+            token_cache.set(self.token.key, token_cache.get(self.token.key), self.user.pk)
+        with self.assertRaises(AuthenticationFailed):
+            CachedTokenAuthentication().authenticate(self.token_request())
+
+    def test_basic_credentials_are_cached(self):
+        CachedBasicAuthentication().authenticate(self.basic_request())
+
+        with self.assertNumQueries(0):
+            user, auth = CachedBasicAuthentication().authenticate(self.basic_request())
+        self.assertEqual(user, self.user)
+
+    def test_wrong_password_is_never_cached(self):
+        CachedBasicAuthentication().authenticate(self.basic_request())
+
+        with self.assertRaises(AuthenticationFailed):
+            CachedBasicAuthentication().authenticate(self.basic_request(password='wrong'))
+
+    def test_password_change_invalidates_credentials(self):
+        CachedBasicAuthentication().authenticate(self.basic_request())
+        self.user.set_password('changed')
+        self.user.save()
+
+        with self.assertRaises(AuthenticationFailed):
+            CachedBasicAuthentication().authenticate(self.basic_request())
+
+
+class PaginationTestCase(APITestCase):
+    def test_static_items_page_by_name(self):
+        for name in ('bag', 'apple', 'sword', 'cape'):
+            create_static_item(name)
+
+        names = []
+        url = '/api/static_game_item/?page_size=2'
+        while url:
+            response = self.client.get(url)
+            names.extend(item['name'] for item in response.data['results'])
+            url = response.data['next']
+
+        self.assertEqual(names, ['apple', 'axe', 'bag', 'cape', 'sword'])
+
+    def test_duplicate_names_page_on_the_full_key(self):
+        items = [create_static_item(name) for name in ('bag', 'bag', 'apple', 'bag', 'bag', 'apple')]
+        expected = sorted([(item.name, item.pk) for item in items] + [('axe', self.axe.pk)])
+
+        pages, url = [], '/api/static_game_item/?page_size=2'
+        while url:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertNotIn('OFFSET', ' '.join(query['sql'] for query in queries))
+            pages.append([(item['name'], item['id']) for item in response.data['results']])
+            url = response.data['next']
+
+        self.assertEqual([row for page in pages for row in page], expected)
+
+        previous = []
+        url = response.data['previous']
+        while url:
+            response = self.client.get(url)
+            previous.insert(0, [(item['name'], item['id']) for item in response.data['results']])
+            url = response.data['previous']
+        self.assertEqual(previous, pages[:-1])
+
+    def test_inventories_page_by_character_and_position(self):
+        other = Character.objects.create(user=User.objects.create_user('other', password='password'), name='other')
+        for character in (other, self.character):
+            for _ in range(3):
+                Inventory.objects.create(character=character, size=16)
+        expected = list(Inventory.objects.order_by('character_id', 'position').values_list('id', flat=True))
+
+        ids, url = [], '/api/inventory/?find_all=true&page_size=2'
+        self.user.is_staff = True
+        self.user.save()
+        while url:
+            response = self.client.get(url)
+            ids.extend(inventory['id'] for inventory in response.data['results'])
+            url = response.data['next']
+
+        self.assertEqual(ids, expected)
+
+    def test_invalid_cursor_is_not_found(self):
+        response = self.client.get('/api/static_game_item/', {'cursor': base64.b64encode(b'p=["x"]').decode()})
+        self.assertEqual(response.status_code, 404)
+
+    def test_deep_pages_use_a_keyset(self):
+        self.fill_inventories(bags=1, items_per_bag=6)
+        first = self.client.get('/api/game_item/?page_size=3')
+
+        with CaptureQueriesContext(connection) as queries:
+            second = self.client.get(first.data['next'])
+
+        self.assertEqual([item['id'] for item in second.data['results']], [4, 5, 6])
+        self.assertNotIn('OFFSET', queries[0]['sql'])
+        self.assertIn('"game_item"."id" >', queries[0]['sql'])
+
+    def test_nested_game_items_are_bounded(self):
+        limit = settings.INVENTORY_GAME_ITEMS_LIMIT
+        inventory = self.fill_inventories(bags=1, items_per_bag=limit + 1)[0]
+
+        response = self.client.get('/api/inventory/{0}/'.format(inventory.pk))
+        remaining = self.client.get('/api/game_item/?inventory={0}&page_size={1}'.format(inventory.pk, limit))
+
+        self.assertEqual(len(response.data['game_items']), limit)
+        self.assertEqual(len(self.client.get(remaining.data['next']).data['results']), 1)
+
+
+class GameItemCreateTestCase(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.inventory = self.character.inventories.get()
+        self.apple = create_static_item('apple', max_stack=10)
+        catalog.snapshot()
+
+    def item(self, position, **kwargs):
+        data = {'static_game_item': self.apple.pk, 'inventory': self.inventory.pk, 'inventory_position': position}
+        data.update(kwargs)
+        return data
+
+    def test_single_item(self):
+        response = self.client.post('/api/game_item/', self.item(0, stack_size=5), format='json')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['static_game_item']['name'], 'apple')
+        self.assertEqual(response.data['created_by'], self.character.pk)
+        self.assertEqual(GameItem.objects.get().stack_size, 5)
+
+    def test_batch_query_count_is_constant(self):
+        with CaptureQueriesContext(connection) as small:
+            self.client.post('/api/game_item/', [self.item(0)], format='json')
+        with CaptureQueriesContext(connection) as large:
+            response = self.client.post('/api/game_item/', [self.item(position) for position in range(50)],
+                                        format='json')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.data), 50)
+        self.assertEqual(len(small), len(large))
+        self.assertEqual(GameItem.objects.count(), 51)
+
+    def test_unknown_static_items_do_not_reload_the_catalog(self):
+        with CaptureQueriesContext(connection) as small:
+            self.client.post('/api/game_item/', [self.item(0, static_game_item=0)], format='json')
+        with CaptureQueriesContext(connection) as large:
+            response = self.client.post('/api/game_item/', [self.item(position, static_game_item=-position - 1)
+                                                            for position in range(50)], format='json')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(len(small), len(large))
+        self.assertFalse([query for query in large if 'FROM "static_game_item"' in query['sql']])
+
+    def test_batch_is_all_or_nothing(self):
+        items = [self.item(0), self.item(1, stack_size=11)]
+
+        response = self.client.post('/api/game_item/', items, format='json')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(GameItem.objects.exists())
+
+    def test_existing_uuid_is_rejected(self):
+        existing = GameItem.objects.create(inventory=self.inventory, inventory_position=0, static_game_item=self.apple)
+
+        response = self.client.post('/api/game_item/', [self.item(1, uuid=str(existing.uuid))], format='json')
+
+        self.assertEqual(response.status_code, 400)
+
+    def test_other_players_inventories_are_rejected(self):
+        other = Character.objects.create(name='other', user=User.objects.create_user('other', password='password'))
+
+        response = self.client.post('/api/game_item/', self.item(0, inventory=other.inventories.get().pk),
+                                    format='json')
+
+        self.assertEqual(response.status_code, 400)
+
+
+class InventoryTransactionTestCase(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.bag = self.character.inventories.get()
+        self.other_bag = Inventory.objects.create(character=self.character, size=8)
+        self.apple = create_static_item('apple', max_stack=10)
+        self.apples = GameItem.objects.create(inventory=self.bag, inventory_position=0, static_game_item=self.apple,
+                                              stack_size=6)
+        self.sword = GameItem.objects.create(inventory=self.other_bag, inventory_position=3,
+                                             static_game_item=self.axe)
+        catalog.snapshot()
+
+    def transaction(self, *operations):
+        return self.client.post('/api/inventory/transaction/', {'operations': list(operations)}, format='json')
+
+    def slot(self, item):
+        item = GameItem.objects.get(pk=item.pk)
+        return item.inventory_id, item.inventory_position
+
+    def test_move(self):
+        response = self.transaction({'op': 'move', 'item': str(self.apples.uuid), 'inventory': self.other_bag.pk,
+                                     'position': 7})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.slot(self.apples), (self.other_bag.pk, 7))
+        self.assertEqual([(slot['inventory'], slot['inventory_position'], bool(slot['game_item']))
+                          for slot in response.data['slots']],
+                         [(self.bag.pk, 0, False), (self.other_bag.pk, 7, True)])
+
+    def test_swap(self):
+        response = self.transaction({'op': 'swap', 'item': str(self.apples.uuid), 'other': str(self.sword.uuid)})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.slot(self.apples), (self.other_bag.pk, 3))
+        self.assertEqual(self.slot(self.sword), (self.bag.pk, 0))
+
+    def test_split_and_merge(self):
+        response = self.transaction(
+            {'op': 'split', 'item': str(self.apples.uuid), 'amount': 2, 'inventory': self.bag.pk, 'position': 1},
+        )
+        split_uuid = response.data['slots'][1]['game_item']['uuid']
+        self.assertEqual(GameItem.objects.get(uuid=split_uuid).stack_size, 2)
+        self.assertEqual(GameItem.objects.get(pk=self.apples.pk).stack_size, 4)
+
+        response = self.transaction({'op': 'merge', 'item': split_uuid, 'into': str(self.apples.uuid)})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(GameItem.objects.filter(uuid=split_uuid).exists())
+        self.assertEqual(GameItem.objects.get(pk=self.apples.pk).stack_size, 6)
+
+    def test_merge_respects_max_stack(self):
+        full = GameItem.objects.create(inventory=self.bag, inventory_position=1, static_game_item=self.apple,
+                                       stack_size=8)
+
+        self.transaction({'op': 'merge', 'item': str(self.apples.uuid), 'into': str(full.uuid)})
+
+        self.assertEqual(GameItem.objects.get(pk=full.pk).stack_size, 10)
+        self.assertEqual(GameItem.objects.get(pk=self.apples.pk).stack_size, 4)
+
+    def test_failed_operation_rolls_everything_back(self):
+        response = self.transaction(
+            {'op': 'move', 'item': str(self.apples.uuid), 'inventory': self.bag.pk, 'position': 5},
+            {'op': 'move', 'item': str(self.sword.uuid), 'inventory': self.bag.pk, 'position': 5},
+        )
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.slot(self.apples), (self.bag.pk, 0))
+
+    def test_other_players_items_are_rejected(self):
+        other = Character.objects.create(name='other', user=User.objects.create_user('other', password='password'))
+        theirs = GameItem.objects.create(inventory=other.inventories.get(), inventory_position=0,
+                                         static_game_item=self.axe)
+
+        response = self.transaction({'op': 'swap', 'item': str(self.apples.uuid), 'other': str(theirs.uuid)})
+
+        self.assertEqual(response.status_code, 400)
+
+    def test_query_count_does_not_grow_with_operations(self):
+        items = [GameItem.objects.create(inventory=self.bag, inventory_position=position, static_game_item=self.axe)
+                 for position in range(1, 9)]
+        catalog.snapshot()
+        moves = [{'op': 'move', 'item': str(item.uuid), 'inventory': self.other_bag.pk, 'position': index}
+                 for index, item in enumerate(items) if index != 3]
+
+        with CaptureQueriesContext(connection) as one:
+            self.transaction(moves[0])
+        with CaptureQueriesContext(connection) as many:
+            response = self.transaction(*moves[1:])
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(one), len(many))
+
+
+class CharacterChangesTestCase(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.bag = self.character.inventories.get()
+        self.item = GameItem.objects.create(inventory=self.bag, inventory_position=0, static_game_item=self.axe,
+                                            created_by=self.character)
+        catalog.snapshot()
+
+    def changes(self, since):
+        return self.client.get('/api/character/{0}/changes/'.format(self.character.pk), {'since': since})
+
+    def version(self):
+        return self.changes(0).data['state_version']
+
+    def test_idle_poll_is_one_query(self):
+        version = self.version()
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.changes(version)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {'state_version': version})
+        self.assertEqual(len(queries), 1)
+
+    def test_only_changed_rows_are_returned(self):
+        version = self.version()
+        other = GameItem.objects.create(inventory=self.bag, inventory_position=1, static_game_item=self.axe)
+
+        response = self.changes(version)
+
+        self.assertGreater(response.data['state_version'], version)
+        self.assertEqual([item['id'] for item in response.data['game_items']], [other.pk])
+        self.assertEqual(response.data['inventories'], [])
+        self.assertIsNone(response.data['equipment'])
+        self.assertEqual(response.data['deleted'], [])
+
+    def test_bulk_writes_bump_the_version(self):
+        version = self.version()
+        self.client.post('/api/game_item/', [{'static_game_item': self.axe.pk, 'inventory': self.bag.pk,
+                                              'inventory_position': 2}], format='json')
+        version_after_create = self.version()
+        self.client.post('/api/inventory/transaction/', {'operations': [
+            {'op': 'move', 'item': str(self.item.uuid), 'inventory': self.bag.pk, 'position': 5}
+        ]}, format='json')
+
+        self.assertEqual(len(self.changes(version).data['game_items']), 2)
+        self.assertEqual([item['id'] for item in self.changes(version_after_create).data['game_items']],
+                         [self.item.pk])
+
+    def test_deletions_leave_tombstones(self):
+        version = self.version()
+        item_id = self.item.pk
+        self.item.delete()
+
+        response = self.changes(version)
+
+        self.assertEqual([(deleted['model'], deleted['object_id']) for deleted in response.data['deleted']],
+                         [('gameitem', item_id)])
+
+    def test_items_moved_away_leave_tombstones(self):
+        other = Character.objects.create(name='other', user=User.objects.create_user('other', password='password'))
+        second = GameItem.objects.create(inventory=self.bag, inventory_position=1, static_game_item=self.axe)
+        version = self.version()
+
+        self.item.inventory = other.inventories.get()
+        self.item.save()
+        second = GameItem.objects.get(pk=second.pk)
+        second.inventory = None
+        second.save()
+
+        response = self.changes(version)
+        self.assertGreater(response.data['state_version'], version)
+        self.assertEqual(response.data['game_items'], [])
+        self.assertEqual([(deleted['model'], deleted['object_id']) for deleted in response.data['deleted']],
+                         [('gameitem', self.item.pk), ('gameitem', second.pk)])
+        self.assertEqual(GameItem.objects.get(pk=self.item.pk).state_version,
+                         Character.objects.get(pk=other.pk).state_version)
+
+    def test_equipment_changes(self):
+        version = self.version()
+        equipment = self.character.equipment
+        equipment.main_hand = self.item
+        equipment.save()
+
+        response = self.changes(version)
+
+        self.assertEqual(response.data['equipment']['main_hand']['uuid'], str(self.item.uuid))
+
+    def test_other_characters_are_hidden(self):
+        other = Character.objects.create(name='other', user=User.objects.create_user('other', password='password'))
+
+        response = self.client.get('/api/character/{0}/changes/'.format(other.pk), {'since': 0})
+
+        self.assertEqual(response.status_code, 404)
+
+
+class ConditionalGetTestCase(APITestCase):
+    def conditional_get(self, url, etag):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        return response, len(queries)
+
+    def test_catalog_not_modified(self):
+        response = self.client.get('/api/static_game_item/')
+        self.assertTrue(response['ETag'])
+
+        response, queries = self.conditional_get('/api/static_game_item/', response['ETag'])
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(queries, 0)
+
+    def test_catalog_changes_change_the_etag(self):
+        etag = self.client.get('/api/skill/')['ETag']
+        Skill.objects.create(name='mining', skill_type='gathering', value=1.0, static_game_item=self.axe)
+        bump_version()
+
+        response, queries = self.conditional_get('/api/skill/', etag)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_etag_depends_on_the_query(self):
+        first = self.client.get('/api/static_game_item/')['ETag']
+        second = self.client.get('/api/static_game_item/', {'page_size': 1})['ETag']
+
+        self.assertNotEqual(first, second)
+
+    def test_character_not_modified_costs_one_query(self):
+        url = '/api/character/{0}/'.format(self.character.pk)
+        etag = self.client.get(url)['ETag']
+
+        response, queries = self.conditional_get(url, etag)
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(queries, 1)
+
+    def test_character_writes_change_the_etag(self):
+        url = '/api/character/{0}/'.format(self.character.pk)
+        etag = self.client.get(url)['ETag']
+        GameItem.objects.create(inventory=self.character.inventories.get(), inventory_position=0,
+                                static_game_item=self.axe)
+
+        response, queries = self.conditional_get(url, etag)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_catalog_changes_change_the_character_etag(self):
+        for url in ('/api/character/{0}/'.format(self.character.pk),
+                    '/api/equipment/{0}/'.format(self.character.equipment_id)):
+            etag = self.client.get(url)['ETag']
+            self.axe.max_stack += 1
+            self.axe.save()
+            bump_version()
+
+            response, queries = self.conditional_get(url, etag)
+
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response['ETag'], etag)
+
+    def test_equipment_not_modified(self):
+        url = '/api/equipment/{0}/'.format(self.character.equipment_id)
+        etag = self.client.get(url)['ETag']
+
+        response, queries = self.conditional_get(url, etag)
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(queries, 1)
+
+    def test_etags_are_per_user(self):
+        etag = self.client.get('/api/character/')['ETag']
+        other = User.objects.create_user('other', password='password')
+        self.client.force_authenticate(other)
+
+        response, queries = self.conditional_get('/api/character/', etag)
+
+        self.assertEqual(response.status_code, 200)
+
+    def test_views_without_a_version_are_not_tagged(self):
+        class UntaggedViewSet(ConditionalGetMixin, viewsets.ViewSet):
+            def list(self, request):
+                return HttpResponse('[]')
+
+        request = APIRequestFactory().get('/', HTTP_IF_NONE_MATCH='*')
+        response = UntaggedViewSet.as_view({'get': 'list'})(request)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('ETag'))
+
+
+class CatalogBundleTestCase(APITestCase):
+    def setUp(self):
+        super().setUp()
+        # TestCase never commits, so the catalog version has to be bumped by hand
+        bump_version()
+
+    def bundle_url(self):
+        response = self.client.get('/api/catalog/bundle/')
+        self.assertEqual(response.status_code, 302)
+        return response['Location']
+
+    def test_bundle_is_served_precompressed(self):
+        response = self.client.get(self.bundle_url(), HTTP_ACCEPT_ENCODING='gzip, deflate')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('immutable', response['Cache-Control'])
+        data = json.loads(gzip.decompress(response.content).decode('utf-8'))
+        self.assertEqual([item['name'] for item in data['static_game_items']], ['axe'])
+        self.assertEqual(data['static_game_items'][0]['item_types'], ['mainHand'])
+
+    def test_bundle_is_built_once_per_catalog_version(self):
+        url = self.bundle_url()
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+
+        self.assertEqual(len(queries), 0)
+        self.assertNotIn('Content-Encoding', response)
+        self.assertEqual(json.loads(response.content.decode('utf-8'))['skills'], [])
+
+    def test_catalog_changes_move_the_bundle(self):
+        url = self.bundle_url()
+        create_static_item('apple')
+        bump_version()
+
+        self.assertNotEqual(self.bundle_url(), url)
+        self.assertEqual(self.client.get(url).status_code, 302)
+
+    def test_not_modified(self):
+        url = self.bundle_url()
+        etag = self.client.get(url)['ETag']
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 304)
+
+
+class CharacterSnapshotTestCase(APITestCase):
+    def snapshot(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/character/{0}/snapshot/'.format(self.character.pk))
+        self.assertEqual(response.status_code, 200)
+        return response, len(queries)
+
+    def test_snapshot_contents(self):
+        bag = self.fill_inventories(2, 3)[0]
+        equipment = self.character.equipment
+        equipment.main_hand = bag.game_items.first()
+        equipment.save()
+        skill = Skill.objects.create(name='mining', skill_type='gathering', value=1.0, static_game_item=self.axe)
+        CharacterSkill.objects.create(character=self.character, skill=skill)
+
+        response, queries = self.snapshot()
+
+        self.assertEqual(response.data['character']['id'], self.character.pk)
+        self.assertEqual([len(inventory['game_items']) for inventory in response.data['inventories']], [3, 3])
+        self.assertEqual(response.data['equipment']['main_hand']['uuid'], str(equipment.main_hand.uuid))
+        self.assertEqual([skill['name'] for skill in response.data['skills']], ['mining'])
+
+    def test_query_count_is_constant(self):
+        self.fill_inventories(1, 1)
+        response, few = self.snapshot()
+        self.fill_inventories(4, 12)
+        response, many = self.snapshot()
+
+        self.assertEqual(few, many)
+        self.assertLessEqual(many, 6)
+
+    def test_other_characters_are_hidden(self):
+        other = Character.objects.create(name='other', user=User.objects.create_user('other', password='password'))
+
+        response = self.client.get('/api/character/{0}/snapshot/'.format(other.pk))
+
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(POSITION_FLUSH_INTERVAL=None)
+class PositionBufferTestCase(APITestCase):
+    def setUp(self):
+        super().setUp()
+        # Rolled back characters never send post_delete, and their ids are reused
+        character_owners.clear()
+        positions.flush()
+        self.addCleanup(positions.flush)
+
+    def move(self, x_pos, y_pos, character=None):
+        character = character or self.character
+        return self.client.post('/api/character/{0}/position/'.format(character.pk), {'x_pos': x_pos, 'y_pos': y_pos},
+                                format='json')
+
+    def test_updates_are_buffered_and_coalesced(self):
+        metrics = positions.metrics()
+        self.move(1.0, 2.0)
+
+        with CaptureQueriesContext(connection) as queries:
+            for step in range(10):
+                response = self.move(float(step), 5.0)
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(len(queries), 0)
+        self.assertIsNone(Character.objects.get(pk=self.character.pk).x_pos)
+        self.assertEqual(positions.metrics()['coalesced'] - metrics['coalesced'], 10)
+
+    def test_flush_writes_one_statement(self):
+        other = Character.objects.create(name='second', user=self.user)
+        before = Character.objects.get(pk=self.character.pk)
+        self.move(1.0, 2.0)
+        self.move(3.0, 4.0, other)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(positions.flush(), 2)
+
+        self.assertEqual(len(queries), 1)
+        character = Character.objects.get(pk=self.character.pk)
+        self.assertEqual((character.x_pos, character.y_pos), (1.0, 2.0))
+        self.assertEqual(character.position_version, before.position_version + 1)
+        self.assertEqual(character.state_version, before.state_version)
+        self.assertEqual(Character.objects.get(pk=other.pk).x_pos, 3.0)
+        self.assertEqual(positions.metrics()['pending'], 0)
+
+    def test_flush_changes_the_etag_but_not_the_feed(self):
+        url = '/api/character/{0}/'.format(self.character.pk)
+        etag = self.client.get(url)['ETag']
+        version = self.client.get(url + 'feed/', {'since': -1}).data['state_version']
+
+        self.move(1.0, 2.0)
+        positions.flush()
+
+        self.assertNotEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        feed = self.client.get(url + 'feed/', {'since': version, 'timeout': 0})
+        self.assertEqual(feed.data, {'state_version': version, 'changed': False})
+
+    def test_other_players_characters_are_rejected(self):
+        other = Character.objects.create(name='other', user=User.objects.create_user('other', password='password'))
+
+        self.assertEqual(self.move(1.0, 2.0, other).status_code, 404)
+        self.assertEqual(positions.metrics()['pending'], 0)
+
+    def test_invalid_position(self):
+        response = self.client.post('/api/character/{0}/position/'.format(self.character.pk), {'x_pos': 'left'},
+                                    format='json')
+
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(POSITION_FLUSH_INTERVAL=None)
+class NearbyTestCase(APITestCase):
+    def setUp(self):
+        super().setUp()
+        character_owners.clear()
+        self.addCleanup(positions.flush)
+        self.character.x_pos, self.character.y_pos = 0.0, 0.0
+        self.character.save()
+        other_user = User.objects.create_user('other', password='password')
+        self.near = Character.objects.create(name='near', user=other_user, x_pos=3.0, y_pos=4.0)
+        self.far = Character.objects.create(name='far', user=other_user, x_pos=300.0, y_pos=0.0)
+        spatial.characters.reload()
+
+    def nearby(self, **params):
+        params.setdefault('character', self.character.pk)
+        return self.client.get('/api/character/nearby/', params)
+
+    def test_nearby(self):
+        response = self.nearby(radius=10)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, [{'id': self.near.pk, 'name': 'near', 'x_pos': 3.0, 'y_pos': 4.0,
+                                          'distance': 5.0}])
+
+    def test_buffered_positions_are_visible(self):
+        self.client.post('/api/character/{0}/position/'.format(self.character.pk), {'x_pos': 290.0, 'y_pos': 0.0},
+                         format='json')
+
+        self.assertEqual([character['name'] for character in self.nearby(radius=20).data], ['far'])
+
+    def test_only_own_characters(self):
+        self.assertEqual(self.nearby(character=self.near.pk, radius=10).status_code, 404)
+
+    def test_radius_is_bounded(self):
+        self.assertEqual(self.nearby(radius=settings.NEARBY_MAX_RADIUS + 1).status_code, 400)
+
+
+class UnlockableSkillsTestCase(APITestCase):
+    def test_unlockable_skills(self):
+        chop, build = [Skill.objects.create(name=name, skill_type='crafting', value=1.0, static_game_item=self.axe)
+                       for name in ('chop', 'build')]
+        SkillDependency.objects.create(child_skill=chop, parent_skill=build)
+        url = '/api/character/{0}/unlockable_skills/'.format(self.character.pk)
+
+        self.assertEqual([skill['name'] for skill in self.client.get(url).data], ['chop'])
+        CharacterSkill.objects.create(character=self.character, skill=chop)
+        self.assertEqual([skill['name'] for skill in self.client.get(url).data], ['build'])
+
+
+class SkillDependencyCycleTestCase(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.chop, self.build = [Skill.objects.create(name=name, skill_type='crafting', value=1.0,
+                                                      static_game_item=self.axe) for name in ('chop', 'build')]
+        self.dependency = SkillDependency.objects.create(child_skill=self.chop, parent_skill=self.build)
+        self.cycle = {'child_skill': self.build.pk, 'parent_skill': self.chop.pk, 'dependency_type': 'U'}
+
+    def test_api_rejects_cycles(self):
+        response = self.client.post('/api/skill_dependency/', self.cycle, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['non_field_errors'], ['Skill dependencies form a cycle between: build, chop.'])
+
+        url = '/api/skill_dependency/{0}/'.format(self.dependency.pk)
+        self.assertEqual(self.client.patch(url, {'dependency_type': 'I'}, format='json').status_code, 200)
+        self.assertEqual(SkillDependency.objects.get().dependency_type, 'I')
+
+    def test_admin_rejects_cycles(self):
+        User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.login(username='admin', password='password')
+        response = self.client.post('/admin/CraftScapeDatabase/skilldependency/add/', self.cycle)
+
+        self.assertContains(response, 'Skill dependencies form a cycle between: build, chop.')
+        self.assertEqual(SkillDependency.objects.count(), 1)
+
+
+class ChangeFeedTestCase(APITestCase):
+    def feed(self, **params):
+        return self.client.get('/api/character/{0}/feed/'.format(self.character.pk), params)
+
+    def test_newer_version_returns_immediately(self):
+        response = self.feed(since=-1, timeout=5)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['changed'])
+
+    def test_times_out_without_changes(self):
+        version = self.feed(since=-1).data['state_version']
+
+        response = self.feed(since=version, timeout=0.05)
+
+        self.assertEqual(response.data, {'state_version': version, 'changed': False})
+
+    def test_timeout_is_bounded(self):
+        self.assertEqual(self.feed(timeout=settings.FEED_MAX_TIMEOUT + 1).status_code, 400)
+
+
+class CharacterWriteFeedTestCase(TransactionTestCase):
+    """
+    Character saves outside a transaction publish straight away, which TestCase never does.
+    """
+
+    def test_patching_a_character_publishes_its_version(self):
+        user = User.objects.create_user('player', password='password')
+        character = Character.objects.create(name='player', user=user)
+        client = APIClient()
+        client.force_authenticate(user)
+
+        response = client.patch('/api/character/{0}/'.format(character.pk), {'health': 50}, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        version = Character.objects.get(pk=character.pk).state_version
+        self.assertEqual(feed.broker.latest(character.pk), version)
+
+        character.currency = 10
+        character.save()
+        self.assertEqual(feed.broker.latest(character.pk), version + 1)
+
+
+class AsgiChangeFeedTestCase(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('player', password='password')
+        self.character = Character.objects.create(name='player', user=self.user)
+        self.token = Token.objects.create(user=self.user)
+        self.bag = self.character.inventories.get()
+        self.axe = create_static_item('axe')
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.addCleanup(self.loop.close)
+
+    def request(self, path, query=b'', token=None):
+        from CraftScape.asgi import application
+
+        messages = []
+        headers = [(b'authorization', 'Token {0}'.format(token or self.token.key).encode())]
+        scope = {'type': 'http', 'method': 'GET', 'path': path, 'query_string': query, 'headers': headers}
+
+        async def receive():
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+        async def send(message):
+            messages.append(message)
+
+        self.loop.run_until_complete(application(scope, receive, send))
+        return messages[0]['status'], json.loads(messages[1]['body'].decode('utf-8'))
+
+    def test_waiter_is_released_when_a_write_commits(self):
+        version = Character.objects.get(pk=self.character.pk).state_version
+        threading.Timer(0.2, GameItem.objects.create, kwargs={
+            'inventory': self.bag, 'inventory_position': 0, 'static_game_item': self.axe,
+        }).start()
+
+        start = time.monotonic()
+        status, data = self.request('/api/character/{0}/feed/'.format(self.character.pk),
+                                    'since={0}&timeout=10'.format(version).encode())
+
+        self.assertEqual(status, 200)
+        self.assertTrue(data['changed'])
+        # Well before the first poll of the database
+        self.assertLess(time.monotonic() - start, settings.FEED_POLL_INTERVAL)
+
+    def test_other_players_characters_are_hidden(self):
+        other = User.objects.create_user('other', password='password')
+
+        status, data = self.request('/api/character/{0}/feed/'.format(self.character.pk), b'timeout=0',
+                                    token=Token.objects.create(user=other).key)
+
+        self.assertEqual(status, 404)
+
+    def test_unauthenticated(self):
+        status, data = self.request('/api/character/{0}/feed/'.format(self.character.pk), token='nope')
+
+        self.assertEqual(status, 401)
+
+
+class QueryPlanTestCase(APITestCase):
+    """
+    Runs EXPLAIN on the queries behind the hot API paths and fails when one of them reads a whole table.
+    """
+
+    def setUp(self):
+        super().setUp()
+        if connection.vendor not in ('sqlite', 'mysql'):
+            self.skipTest('Query plans are only checked on SQLite and MySQL.')
+        self.bag = self.character.inventories.get()
+        self.item = GameItem.objects.create(inventory=self.bag, inventory_position=0, static_game_item=self.axe)
+
+    def viewset_queryset(self, viewset_class, **kwargs):
+        view = viewset_class(request=Request(APIRequestFactory().get('/')), kwargs=kwargs, format_kwarg=None)
+        view.request.user = self.user
+        ordering = view.paginator.ordering if view.paginator else ()
+        return view.get_queryset().order_by(*(ordering if isinstance(ordering, (list, tuple)) else [ordering]))
+
+    def full_scans(self, queryset, sorts=False):
+        """
+        Tables the query reads in full and, with ``sorts``, the sorts it cannot read off an index.
+        """
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            if connection.vendor == 'sqlite':
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+                details = [row[-1] for row in cursor.fetchall()]
+                return [detail for detail in details
+                        if re.match(r'SCAN (TABLE )?\w+$', detail) or (sorts and 'TEMP B-TREE' in detail)]
+            cursor.execute('EXPLAIN ' + sql, params)
+            columns = [column[0] for column in cursor.description]
+            rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+            return ['{0}: {1}'.format(row['table'], row['type']) for row in rows if row['type'] == 'ALL'] + \
+                   ['{0}: {1}'.format(row['table'], row['Extra']) for row in rows
+                    if sorts and 'filesort' in (row['Extra'] or '')]
+
+    def assertUsesIndexes(self, queryset, sorts=False):
+        self.assertEqual(self.full_scans(queryset, sorts=sorts), [], str(queryset.query))
+
+    def test_character_list(self):
+        self.assertUsesIndexes(self.viewset_queryset(CharacterViewSet), sorts=True)
+
+    def test_inventory_list(self):
+        # Sorting a player's bags is cheap, reading every bag is not
+        self.assertUsesIndexes(self.viewset_queryset(InventoryViewSet))
+
+    def test_nested_game_items(self):
+        self.assertUsesIndexes(GameItem.objects.filter(inventory__in=[self.bag.pk]).order_by('id'))
+
+    def test_inventory_slot(self):
+        self.assertUsesIndexes(GameItem.objects.filter(inventory=self.bag, inventory_position=0))
+
+    def test_game_item_by_uuid(self):
+        self.assertUsesIndexes(GameItem.objects.filter(uuid=self.item.uuid))
+
+    def test_static_items_by_name(self):
+        self.assertUsesIndexes(self.viewset_queryset(StaticGameItemViewSet)[:100], sorts=True)
+        self.assertUsesIndexes(StaticGameItem.objects.filter(name='axe'))
+
+    def test_character_changes(self):
+        self.assertUsesIndexes(GameItem.objects.filter(inventory__character=self.character, state_version__gt=0))
+        self.assertUsesIndexes(self.character.deleted_objects.filter(state_version__gt=0).order_by('state_version'))
+
+    def test_expired_modifiers(self):
+        self.assertUsesIndexes(ItemModifier.objects.expired())
+
+
+class ReplicaRouterTestCase(TransactionTestCase):
+    def setUp(self):
+        self.router = ReplicaRouter(replicas=['replica1'])
+
+    def test_reads_go_to_replicas_unless_pinned(self):
+        self.assertEqual(self.router.db_for_read(Character), 'replica1')
+        self.assertEqual(self.router.db_for_write(Character), 'default')
+        with transaction.atomic():
+            self.assertEqual(self.router.db_for_read(Character), 'default')
+        with use_primary():
+            self.assertEqual(self.router.db_for_read(Character), 'default')
+        self.assertEqual(self.router.db_for_read(Character), 'replica1')
+
+    def test_related_reads_follow_the_instance(self):
+        character = Character(name='player')
+        character._state.db = 'default'
+
+        self.assertEqual(self.router.db_for_read(Inventory, instance=character), 'default')
+        self.assertEqual(ReplicaRouter(replicas=[]).db_for_read(Character), 'default')
+
+    @override_settings(DATABASE_REPLICAS=['replica1'], REPLICA_STICKY_SECONDS=5)
+    def test_clients_read_their_own_writes(self):
+        pinned = []
+
+        def get_response(request):
+            pinned.append(pinned_to_primary())
+            return HttpResponse()
+
+        def request(method, cookies=None):
+            request = getattr(APIRequestFactory(), method)('/api/equipment/')
+            request.COOKIES.update(cookies or {})
+            return middleware(request)
+
+        middleware = ReplicaRoutingMiddleware(get_response)
+        request('get')
+        sticky = {name: morsel.value for name, morsel in request('patch').cookies.items()}
+        request('get', sticky)
+        request('get')
+        request('get', {ReplicaRoutingMiddleware.COOKIE_NAME: '1'})
+        with mock.patch('time.time', return_value=time.time() + 6):
+            request('get', sticky)
+
+        self.assertEqual(pinned, [False, True, True, False, False, False])
+        self.assertFalse(pinned_to_primary())
+
+
+class ReplicaCacheReloadTestCase(TransactionTestCase):
+    """
+    The only replica has none of the tables, so any cache reload that is not pinned to the primary fails.
+    """
+    alias = 'stale_replica'
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        sqlite_database(self.alias, 'django.db.backends.sqlite3', os.path.join(directory.name, 'stale.sqlite3'), {})
+        self.addCleanup(connections.databases.pop, self.alias)
+        self.addCleanup(connections.__delitem__, self.alias)
+        self.addCleanup(lambda: connections[self.alias].close())
+
+        self.user = User.objects.create_user('player', password='password')
+        self.character = Character.objects.create(name='player', user=self.user, x_pos=1.0, y_pos=2.0)
+        self.token = Token.objects.create(user=self.user)
+        self.axe = create_static_item('axe')
+        for auth_cache in (token_cache, credential_cache, character_owners):
+            auth_cache.clear()
+        self.addCleanup(catalog.mark_stale)
+        self.addCleanup(skill_graph.clear)
+        self.addCleanup(spatial.characters.clear)
+
+        routing = override_settings(DATABASE_REPLICAS=[self.alias], DATABASE_ROUTERS=[ReplicaRouter([self.alias])])
+        routing.enable()
+        self.addCleanup(routing.disable)
+
+    def test_reloads_read_the_primary(self):
+        with self.assertRaises(OperationalError):
+            Character.objects.count()
+
+        bump_version()
+        self.assertEqual(catalog.get_static_item(self.axe.pk).name, 'axe')
+        self.assertEqual(skill_graph.graph().skills, {})
+        self.assertEqual(bundle.get_bundle().version, catalog.version())
+        self.assertEqual(spatial.characters.reload().nearby(1.0, 2.0, 1.0), [(self.character.pk, 0.0)])
+        self.assertEqual(CachedTokenAuthentication().authenticate_credentials(self.token.key)[0], self.user)
+        self.assertEqual(CachedBasicAuthentication().authenticate_credentials('player', 'password')[0], self.user)
+
+
+class SqliteBackendTestCase(TransactionTestCase):
+    alias = 'sqlite_backend'
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'shard.sqlite3')
+        self.database(self.alias, {'pragmas': {'busy_timeout': 2000}})
+        with connections[self.alias].cursor() as cursor:
+            cursor.execute('CREATE TABLE counter (id INTEGER PRIMARY KEY, value INTEGER NOT NULL)')
+            cursor.execute('INSERT INTO counter (id, value) VALUES (1, 0)')
+
+    def database(self, alias, options):
+        sqlite_database(alias, 'CraftScape.sqlite_backend', self.path, options)
+        self.addCleanup(connections.databases.pop, alias)
+        self.addCleanup(connections.__delitem__, alias)
+        self.addCleanup(lambda: connections[alias].close())
+
+    def pragma(self, name):
+        with connections[self.alias].cursor() as cursor:
+            cursor.execute('PRAGMA {0}'.format(name))
+            return cursor.fetchone()[0]
+
+    def counter(self):
+        with connections[self.alias].cursor() as cursor:
+            cursor.execute('SELECT value FROM counter WHERE id = 1')
+            return cursor.fetchone()[0]
+
+    def increment(self, alias, iterations, errors):
+        try:
+            for iteration in range(iterations):
+                with transaction.atomic(using=alias), connections[alias].cursor() as cursor:
+                    cursor.execute('SELECT value FROM counter WHERE id = 1')
+                    value = cursor.fetchone()[0]
+                    time.sleep(0.001)
+                    cursor.execute('UPDATE counter SET value = %s WHERE id = 1', [value + 1])
+        except Exception as error:
+            errors.append(error)
+        finally:
+            connections[alias].close()
+
+    def run_threads(self, *targets):
+        threads = [threading.Thread(target=target) for target in targets]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def test_pragmas(self):
+        self.assertEqual(self.pragma('journal_mode'), 'wal')
+        self.assertEqual(self.pragma('synchronous'), 1)
+        self.assertEqual(self.pragma('cache_size'), -64000)
+        self.assertEqual(self.pragma('mmap_size'), 268435456)
+        # 2 is MEMORY
+        self.assertEqual(self.pragma('temp_store'), 2)
+        # Overridden by the options
+        self.assertEqual(self.pragma('busy_timeout'), 2000)
+
+    def test_concurrent_read_write_transactions_queue(self):
+        errors = []
+        self.run_threads(*[lambda: self.increment(self.alias, 20, errors)] * 4)
+
+        self.assertEqual(errors, [])
+        self.assertEqual(self.counter(), 80)
+        self.assertFalse(connections[self.alias].write_lock.locked())
+
+    def test_begin_immediate_queues_writers_without_the_process_lock(self):
+        # Like connections from separate processes, only BEGIN IMMEDIATE and busy_timeout keep these apart. With a
+        # deferred BEGIN the read-then-write transactions fail with "database is locked" instead of waiting.
+        self.database('sqlite_backend_unlocked', {'serialize_writes': False})
+        errors = []
+        self.run_threads(*[lambda: self.increment('sqlite_backend_unlocked', 20, errors)] * 4)
+
+        self.assertEqual(errors, [])
+        self.assertEqual(self.counter(), 80)
+        self.assertFalse(connections['sqlite_backend_unlocked'].holds_write_lock)
+
+    def test_second_writer_waits_for_the_first(self):
+        events, started = [], threading.Event()
+
+        def first():
+            with transaction.atomic(using=self.alias):
+                events.append('first begun')
+                started.set()
+                time.sleep(0.2)
+                events.append('first committing')
+            connections[self.alias].close()
+
+        def second():
+            started.wait(5)
+            with transaction.atomic(using=self.alias):
+                events.append('second begun')
+            connections[self.alias].close()
+
+        self.run_threads(first, second)
+
+        self.assertEqual(events, ['first begun', 'first committing', 'second begun'])
@@ -22,5 +22,7 @@ router.register('equipment', views.EquipmentViewSet, base_name='equipment')
 app_name = 'api'
 urlpatterns = [
     path('', include(router.urls)),
+    path('catalog/bundle/', views.catalog_bundle, name='catalog_bundle'),
+    path('catalog/bundle/<slug:digest>.json', views.catalog_bundle_content, name='catalog_bundle_content'),
     path('authorize/', auth_views.obtain_auth_token)
 ]
@@ -1,19 +1,45 @@
 from django.contrib.auth.models import User
-from django.db.models import Q
+from django.http import HttpResponse, HttpResponseNotModified
+from django.shortcuts import redirect
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags
+from django.views.decorators.http import require_safe
+from django.db.models import Q, Prefetch
 from django.shortcuts import get_object_or_404
-from rest_framework import viewsets
+from rest_framework import viewsets, status
+from rest_framework.decorators import list_route, detail_route
+from rest_framework.exceptions import ValidationError, NotFound
+from rest_framework.permissions import IsAdminUser
 from rest_framework.response import Response
+from CraftScape.db_router import use_primary
 from CraftScapeDatabase.models import Character, Inventory, GameItem, Skill, SkillDependency, CharacterSkill, \
     GameItemModifier, ItemModifier, StaticItemModifier, StaticGameItem, GameItemType, StaticItemTypeModifier, \
     Equipment
 from CraftScapeAPI.serializers import UserSerializer, CharacterSerializer, InventorySerializer, GameItemSerializer, \
     SkillSerializer, SkillDependencySerializer, CharacterSkillSerializer, GameItemModifierSerializer, \
     ItemModifierSerializer, StaticItemModifierSerializer, StaticGameItemSerializer, GameItemTypeSerializer, \
-    StaticItemTypeModifierSerializer, EquipmentSerializer
+    StaticItemTypeModifierSerializer, EquipmentSerializer, CharacterProvisionSerializer, GameItemCreateSerializer, \
+    InventoryTransactionSerializer, InventorySlotSerializer, InventoryStateSerializer, DeletedObjectSerializer, \
+    InventorySnapshotSerializer, PositionSerializer, NearbySerializer, \
+    FeedSerializer
+from CraftScapeAPI import bundle as catalog_bundle_cache
+from CraftScapeAPI.authentication import character_owners
+from CraftScapeAPI.conditional import CatalogConditionalGetMixin, CharacterStateConditionalGetMixin
+from CraftScapeAPI.pagination import NameCursorPagination, InventoryCursorPagination
+from CraftScapeDatabase.inventory_operations import apply_inventory_operations
+from CraftScapeDatabase import feed, spatial
+from CraftScapeDatabase.positions import positions
+from CraftScapeDatabase.provisioning import provision_characters
+from CraftScapeDatabase.skills import skill_graph
 from django_filters.rest_framework import DjangoFilterBackend
 from operator import __or__ as OR
 from functools import reduce
 
+UUID_PATTERN = '[0-9a-fA-F]{8}-?[0-9a-fA-F]{4}-?[0-9a-fA-F]{4}-?[0-9a-fA-F]{4}-?[0-9a-fA-F]{12}'
+
+# Bundle URLs change with their content, so a fetched bundle never needs to be revalidated
+BUNDLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
 
 class BaseModelViewSet(viewsets.ModelViewSet):
     def find_all(self):
@@ -31,9 +57,10 @@ class UserViewSet(BaseModelViewSet):
         return self.queryset.filter(pk=self.request.user.pk)
 
 
-class CharacterViewSet(BaseModelViewSet):
+class CharacterViewSet(CharacterStateConditionalGetMixin, BaseModelViewSet):
     serializer_class = CharacterSerializer
     queryset = Character.objects.all().order_by('id')
+    version_fields = ('state_version', 'position_version')
 
     def get_object(self):
         character = super().get_object()
@@ -44,43 +71,227 @@ class CharacterViewSet(BaseModelViewSet):
             return self.queryset
         return self.queryset.filter(user=self.request.user.id)
 
+    @list_route(methods=['post'], permission_classes=[IsAdminUser])
+    def provision(self, request):
+        serializer = CharacterProvisionSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        character_ids = provision_characters(**serializer.validated_data)
+        return Response({'created': len(character_ids), 'ids': character_ids}, status=status.HTTP_201_CREATED)
+
+    @detail_route(methods=['post'])
+    def position(self, request, pk=None):
+        """
+        Buffers a new position for the character. It is written together with every other buffered position at the
+        next flush, so the response is 202 Accepted.
+        """
+        serializer = PositionSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        character_id = self.owned_character_id(request, pk)
+        positions.put(character_id, **serializer.validated_data)
+        spatial.characters.update(character_id, **serializer.validated_data)
+        return Response(status=status.HTTP_202_ACCEPTED)
+
+    @list_route(permission_classes=[IsAdminUser])
+    def position_metrics(self, request):
+        return Response(positions.metrics())
+
+    @list_route()
+    def nearby(self, request):
+        """
+        The characters within ``?radius=`` of ``?character=`` (one of yours), closest first.
+        """
+        serializer = NearbySerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        character_id = self.owned_character_id(request, serializer.validated_data['character'])
+        grid = spatial.characters.grid()
+        position = grid.position(character_id)
+        if position is None:
+            raise ValidationError({'character': 'The character has no position.'})
+
+        limit = serializer.validated_data['limit']
+        found = grid.nearby(position[0], position[1], serializer.validated_data['radius'], limit=limit + 1)
+        found = [(other_id, distance) for other_id, distance in found if other_id != character_id][:limit]
+        names = dict(Character.objects.filter(pk__in=[other_id for other_id, distance in found])
+                     .values_list('id', 'name'))
+        nearby = []
+        for other_id, distance in found:
+            other_position = grid.position(other_id)
+            # Characters deleted or moved away by another worker since the grid was loaded
+            if other_id in names and other_position is not None:
+                nearby.append({'id': other_id, 'name': names[other_id], 'x_pos': other_position[0],
+                               'y_pos': other_position[1], 'distance': distance})
+        return Response(nearby)
+
+    def owned_character_id(self, request, pk):
+        """
+        Checks that the character exists and belongs to the user (or the user is staff) without a query for
+        characters seen recently.
+        """
+        try:
+            character_id = int(pk)
+        except ValueError:
+            raise NotFound()
+
+        owner = character_owners.get(character_id)
+        if owner is None:
+            with use_primary():
+                owner = Character.objects.filter(pk=character_id).values_list('user_id', flat=True).first()
+            if owner is None:
+                raise NotFound()
+            character_owners.set(character_id, owner, owner)
+        if owner != request.user.id and not request.user.is_staff:
+            raise NotFound()
+        return character_id
+
+    @detail_route()
+    def snapshot(self, request, pk=None):
+        """
+        The character with all of its bags and their game items, its equipped game items and its skills in one
+        response, loaded with a fixed four queries however full the bags are.
+        """
+        slots = ['equipment__{0}__created_by'.format(name) for name, item_type in Equipment.SLOTS]
+        queryset = self.filter_queryset(self.get_queryset()).select_related(*slots).prefetch_related(
+            Prefetch('inventories', queryset=Inventory.objects.order_by('position')),
+            Prefetch('inventories__game_items', queryset=GameItem.objects.select_related('created_by').order_by('id')),
+            Prefetch('characterskill_set', queryset=CharacterSkill.objects.select_related('skill').order_by('id')),
+        )
+        character = get_object_or_404(queryset, pk=pk)
+        self.check_object_permissions(request, character)
+
+        context = self.get_serializer_context()
+        return Response({
+            'character': self.get_serializer(character).data,
+            'inventories': InventorySnapshotSerializer(character.inventories.all(), many=True, context=context).data,
+            'equipment': EquipmentSerializer(character.equipment, context=context).data,
+            'skills': SkillSerializer([row.skill for row in character.characterskill_set.all()], many=True).data,
+        })
+
+    @detail_route()
+    def unlockable_skills(self, request, pk=None):
+        """
+        The skills the character does not know yet but can unlock with the ones it knows, children before parents.
+        """
+        character = self.get_object()
+        known = CharacterSkill.objects.filter(character=character).values_list('skill_id', flat=True)
+        graph = skill_graph.graph()
+        skills = [graph.skills[skill_id] for skill_id in graph.unlockable(known)]
+        return Response(SkillSerializer(skills, many=True).data)
+
+    @detail_route()
+    def feed(self, request, pk=None):
+        """
+        Long poll on the character: answers as soon as its state version is newer than ``?since=``, or after
+        ``?timeout=`` seconds with ``changed`` false. The client then fetches ``changes/?since=``. CraftScape.asgi
+        serves the same URL without holding a thread per waiting client.
+        """
+        serializer = FeedSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        since, timeout = serializer.validated_data['since'], serializer.validated_data['timeout']
+        character = self.get_object()
+
+        version = character.state_version
+        if version <= since:
+            versions = Character.objects.filter(pk=character.pk).values_list('state_version', flat=True)
+            version = feed.wait_for_change(character.pk, since, timeout, versions.first) or version
+        return Response({'state_version': version, 'changed': version > since})
+
+    @detail_route()
+    def changes(self, request, pk=None):
+        """
+        Everything written to the character since ``?since=<state_version>``: the character itself, changed bags,
+        game items and equipment, and the ids of deleted bags and game items. Polling an unchanged character costs
+        a single query.
+        """
+        try:
+            since = int(request.query_params.get('since', 0))
+        except ValueError:
+            raise ValidationError({'since': 'A valid integer is required.'})
+
+        character = self.get_object()
+        changes = {'state_version': character.state_version}
+        if character.state_version <= since:
+            return Response(changes)
+
+        context = self.get_serializer_context()
+        inventories = character.inventories.filter(state_version__gt=since).order_by('position')
+        game_items = GameItem.objects.filter(inventory__character=character, state_version__gt=since) \
+            .select_related('created_by').order_by('id')
+        deleted = character.deleted_objects.filter(state_version__gt=since).order_by('state_version')
+        equipment = Equipment.objects.select_related(*['{0}__created_by'.format(name) for name, item_type in Equipment.SLOTS]) \
+            .filter(pk=character.equipment_id, state_version__gt=since).first()
+
+        changes.update({
+            'character': self.get_serializer(character).data,
+            'inventories': InventoryStateSerializer(inventories, many=True).data,
+            'game_items': GameItemSerializer(game_items, many=True, context=context).data,
+            'equipment': EquipmentSerializer(equipment, context=context).data if equipment else None,
+            'deleted': DeletedObjectSerializer(deleted, many=True).data,
+        })
+        return Response(changes)
+
 
 class InventoryViewSet(BaseModelViewSet):
     serializer_class = InventorySerializer
-    queryset = Inventory.objects.all().order_by('position')
+    queryset = Inventory.objects.all().order_by('position').prefetch_related(
+        Prefetch('game_items', queryset=GameItem.objects.select_related('created_by').order_by('id'))
+    )
     filter_fields = ('character', 'position', 'size')
     filter_backends = (DjangoFilterBackend,)
+    pagination_class = InventoryCursorPagination
 
     def get_queryset(self):
         if self.find_all() and self.request.user.is_staff:
             return self.queryset
+        return self.queryset.filter(character__user=self.request.user.id)
 
-        characters = Character.objects.filter(user=self.request.user.id)
-        character_ids = [Q(character=char.id) for char in characters]
-        queryset = self.queryset.filter(reduce(OR, character_ids))
-        return queryset
+    @list_route(methods=['post'])
+    def transaction(self, request):
+        """
+        Applies a list of move, swap, split and merge operations atomically and returns only the changed slots.
+        """
+        serializer = InventoryTransactionSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        slots = apply_inventory_operations(request.user, serializer.validated_data['operations'])
+        slots = [{'inventory': inventory, 'inventory_position': position, 'game_item': item}
+                 for inventory, position, item in slots]
+        return Response({'slots': InventorySlotSerializer(slots, many=True).data})
 
 
 class GameItemViewSet(viewsets.ModelViewSet):
     serializer_class = GameItemSerializer
-    queryset = GameItem.objects.all()
+    queryset = GameItem.objects.all().select_related('created_by')
+    filter_fields = ('inventory',)
+    filter_backends = (DjangoFilterBackend,)
 
     def create(self, request, *args, **kwargs):
-        data = {
-            'uuid': request.data['uuid'],
-            'inventory': request.data['inventory'],
-            'inventory_position': request.data['inventory_position'],
-            'static_game_item_id': request.data['static_game_item']
-        }
-        return GameItem.objects.create(**data)
-
-
-class SkillViewSet(viewsets.ModelViewSet):
+        """
+        Accepts a single game item or a list of them, a list is validated and inserted as one batch.
+        """
+        many = isinstance(request.data, list)
+        context = self.get_serializer_context()
+        context['character_ids'] = set(Character.objects.filter(user=request.user.id).values_list('id', flat=True))
+        serializer = GameItemCreateSerializer(data=request.data if many else [request.data], many=True,
+                                              context=context)
+        if not serializer.is_valid():
+            errors = serializer.errors
+            raise ValidationError(errors if many or not isinstance(errors, list) else errors[0])
+        items = serializer.save()
+        data = GameItemSerializer(items, many=True, context=context).data
+        return Response(data if many else data[0], status=status.HTTP_201_CREATED)
+
+    @list_route(url_path='by-uuid/(?P<uuid>{0})'.format(UUID_PATTERN), url_name='by-uuid')
+    def by_uuid(self, request, uuid=None):
+        item = get_object_or_404(self.get_queryset(), uuid=uuid)
+        self.check_object_permissions(request, item)
+        return Response(self.get_serializer(item).data)
+
+
+class SkillViewSet(CatalogConditionalGetMixin, viewsets.ModelViewSet):
     serializer_class = SkillSerializer
     queryset = Skill.objects.all()
 
 
-class SkillDependencyViewSet(viewsets.ModelViewSet):
+class SkillDependencyViewSet(CatalogConditionalGetMixin, viewsets.ModelViewSet):
     serializer_class = SkillDependencySerializer
     queryset = SkillDependency.objects.all()
 
@@ -94,34 +305,43 @@ class GameItemModifierViewSet(viewsets.ModelViewSet):
     serializer_class = GameItemModifierSerializer
     queryset = GameItemModifier.objects.all()
 
+    def get_queryset(self):
+        # Expired modifiers are hidden until expire_modifiers deletes them
+        return self.queryset.filter(modifier__in=ItemModifier.objects.active())
+
 
 class ItemModifierViewSet(viewsets.ModelViewSet):
     serializer_class = ItemModifierSerializer
     queryset = ItemModifier.objects.all()
 
+    def get_queryset(self):
+        return self.queryset.active()
+
 
-class StaticItemModifierViewSet(viewsets.ModelViewSet):
+class StaticItemModifierViewSet(CatalogConditionalGetMixin, viewsets.ModelViewSet):
     serializer_class = StaticItemModifierSerializer
     queryset = StaticItemModifier.objects.all()
 
 
-class StaticGameItemViewSet(viewsets.ModelViewSet):
+class StaticGameItemViewSet(CatalogConditionalGetMixin, viewsets.ModelViewSet):
     serializer_class = StaticGameItemSerializer
     queryset = StaticGameItem.objects.all().order_by('name')
+    pagination_class = NameCursorPagination
 
 
-class GameItemTypeViewSet(viewsets.ModelViewSet):
+class GameItemTypeViewSet(CatalogConditionalGetMixin, viewsets.ModelViewSet):
     serializer_class = GameItemTypeSerializer
     queryset = GameItemType.objects.all()
 
 
-class StaticItemTypeModifierViewSet(viewsets.ModelViewSet):
+class StaticItemTypeModifierViewSet(CatalogConditionalGetMixin, viewsets.ModelViewSet):
     serializer_class = StaticItemTypeModifierSerializer
     queryset = StaticItemTypeModifier.objects.all()
 
 
-class EquipmentViewSet(BaseModelViewSet):
+class EquipmentViewSet(CharacterStateConditionalGetMixin, BaseModelViewSet):
     serializer_class = EquipmentSerializer
+    character_lookup = 'equipment_id'
     queryset = Equipment.objects.all().order_by('id')
 
     def get_queryset(self):
@@ -131,3 +351,38 @@ class EquipmentViewSet(BaseModelViewSet):
         characters = Character.objects.filter(user=self.request.user.id)
         character_ids = [Q(character=character.id) for character in characters]
         return self.queryset.filter(reduce(OR, character_ids))
+
+
+@require_safe
+def catalog_bundle(request):
+    """
+    Redirects to the content addressed URL of the current catalog bundle.
+    """
+    bundle = catalog_bundle_cache.get_bundle()
+    response = redirect('api:catalog_bundle_content', digest=bundle.digest)
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+
+@require_safe
+def catalog_bundle_content(request, digest):
+    bundle = catalog_bundle_cache.get_bundle()
+    if digest != bundle.digest:
+        return catalog_bundle(request)
+
+    etag = '"{0}"'.format(bundle.digest)
+    if etag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+        response = HttpResponseNotModified()
+    else:
+        accept_encoding = request.META.get('HTTP_ACCEPT_ENCODING', '')
+        accepted = {encoding.split(';')[0].strip() for encoding in accept_encoding.split(',')}
+        encoding = next((encoding for encoding in bundle.encoded if encoding in accepted), None)
+        response = HttpResponse(bundle.encoded[encoding] if encoding else bundle.content,
+                                content_type='application/json')
+        if encoding:
+            response['Content-Encoding'] = encoding
+        response['Content-Length'] = len(response.content)
+    response['ETag'] = etag
+    response['Cache-Control'] = BUNDLE_CACHE_CONTROL
+    patch_vary_headers(response, ('Accept-Encoding',))
+    return response
@@ -10,11 +10,20 @@ admin.site.register(GameItem)
 admin.site.register(Inventory)
 admin.site.register(StaticGameItem)
 admin.site.register(Skill)
-admin.site.register(SkillDependency)
-admin.site.register(CharacterSkill)
 admin.site.register(GameItemModifier)
 admin.site.register(ItemModifier)
 admin.site.register(StaticItemModifier)
 admin.site.register(GameItemType)
 admin.site.register(StaticItemTypeModifier)
 admin.site.register(Equipment)
+
+
+@admin.register(SkillDependency)
+class SkillDependencyAdmin(admin.ModelAdmin):
+    list_display = ('__str__', 'child_skill', 'parent_skill', 'dependency_type')
+    list_select_related = ('child_skill', 'parent_skill')
+
+
+@admin.register(CharacterSkill)
+class CharacterSkillAdmin(admin.ModelAdmin):
+    list_select_related = ('character', 'skill')
@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class CraftscapedatabaseConfig(AppConfig):
     name = 'CraftScapeDatabase'
+
+    def ready(self):
+        from CraftScapeDatabase import signals  # noqa: F401
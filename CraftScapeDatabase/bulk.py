@@ -0,0 +1,29 @@
+from django.db.models import Case, Value, When
+from django.db.models.expressions import Expression
+
+
+def bulk_update(objs, fields, batch_size=500, using=None):
+    """
+    Writes ``fields`` of every object with one ``UPDATE ... SET field = CASE id WHEN ... END`` statement per batch,
+    Django 2.0 has no QuerySet.bulk_update. Field values may also be expressions such as F('value') + 1.
+    """
+    objs = list(objs)
+    if not objs:
+        return 0
+
+    model = type(objs[0])
+    fields = [model._meta.get_field(name) for name in fields]
+    updated = 0
+    for offset in range(0, len(objs), batch_size):
+        batch = objs[offset:offset + batch_size]
+        updates = {}
+        for field in fields:
+            whens = []
+            for obj in batch:
+                value = getattr(obj, field.attname)
+                if not isinstance(value, Expression):
+                    value = Value(value, output_field=field)
+                whens.append(When(pk=obj.pk, then=value))
+            updates[field.attname] = Case(*whens, output_field=field)
+        updated += model._base_manager.using(using).filter(pk__in=[obj.pk for obj in batch]).update(**updates)
+    return updated
@@ -0,0 +1,200 @@
+"""
+In-process cache of the static game catalog.
+
+Static items, their item types and the modifiers that can affect them almost never change but are read on nearly
+every request, so each worker loads them once into immutable records and serves them from memory. Saving or
+deleting a catalog row stores a new version token in the catalog_version table, in the same transaction; workers
+read it from the primary database at most once every ``CATALOG_VERSION_CHECK_INTERVAL`` seconds and reload when it
+has changed. Tokens are never reused, so rows loaded from a transaction that is rolled back are cached under a token
+nobody will read again. Skills and skill dependencies are not cached here but bump the same version, so it stamps
+the whole static catalog.
+"""
+import threading
+import time
+import uuid
+from collections import namedtuple
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, transaction
+from CraftScape.db_router import use_primary
+from CraftScapeDatabase.models import StaticGameItem, GameItemType, StaticItemModifier, StaticItemTypeModifier, \
+    Equipment, CatalogVersion
+
+CATALOG_VERSION_ID = 1
+
+STATIC_ITEM_FIELDS = tuple(field.attname for field in StaticGameItem._meta.concrete_fields)
+
+
+class GameItemTypeRecord(namedtuple('GameItemTypeRecord', ('id', 'item_type'))):
+    __slots__ = ()
+
+    @property
+    def pk(self):
+        return self.id
+
+    def __str__(self):
+        return self.item_type
+
+
+class StaticItemModifierRecord(namedtuple('StaticItemModifierRecord', tuple(
+        field.attname for field in StaticItemModifier._meta.concrete_fields))):
+    __slots__ = ()
+
+    @property
+    def pk(self):
+        return self.id
+
+    def __str__(self):
+        return self.name
+
+
+class StaticItemRecord(namedtuple('StaticItemRecord', STATIC_ITEM_FIELDS + ('item_types', 'modifiers', 'slot_mask'))):
+    """
+    Immutable copy of a StaticGameItem row. ``item_types`` is a tuple of type names, ``modifiers`` a tuple of
+    StaticItemModifierRecord that can affect the item and ``slot_mask`` the Equipment.SLOT_MASKS bits of the slots
+    the item can be equipped in.
+    """
+    __slots__ = ()
+
+    @property
+    def pk(self):
+        return self.id
+
+    def __str__(self):
+        return self.name
+
+
+CatalogSnapshot = namedtuple('CatalogSnapshot', ('version', 'static_items', 'item_types', 'modifiers'))
+
+
+class Catalog:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._version = None
+        self._checked_at = 0.0
+
+    def version(self):
+        """
+        The shared catalog version, read again once ``CATALOG_VERSION_CHECK_INTERVAL`` seconds have passed or after
+        ``mark_stale``.
+        """
+        version = self._version
+        if version is None or time.monotonic() - self._checked_at >= self._check_interval():
+            version = read_version()
+            self._version = version
+            self._checked_at = time.monotonic()
+        return version
+
+    def snapshot(self):
+        version = self.version()
+        snapshot = self._snapshot
+        if snapshot is None or snapshot.version != version:
+            snapshot = self.reload(version)
+        return snapshot
+
+    def reload(self, version=None):
+        with self._lock:
+            if version is None:
+                version = self.version()
+            snapshot = self._snapshot
+            if snapshot is None or snapshot.version != version:
+                # A replica can lag behind the version just read from the primary, and the snapshot would keep its
+                # stale rows under the new version until the next change
+                with use_primary():
+                    snapshot = self._load(version)
+                self._snapshot = snapshot
+            return snapshot
+
+    def mark_stale(self):
+        """
+        Makes the next access read the shared version again, the snapshot is only reloaded if it has changed.
+        """
+        self._version = None
+
+    def get_static_item(self, pk):
+        # Items created by other workers show up once the version is checked again, a miss never forces a reload
+        if pk is None:
+            return None
+        return self.snapshot().static_items.get(pk)
+
+    def static_items(self):
+        return self.snapshot().static_items
+
+    def item_types(self):
+        return self.snapshot().item_types
+
+    def modifiers(self):
+        return self.snapshot().modifiers
+
+    @staticmethod
+    def _check_interval():
+        return getattr(settings, 'CATALOG_VERSION_CHECK_INTERVAL', 1.0)
+
+    @staticmethod
+    def _load(version):
+        item_types = {
+            pk: GameItemTypeRecord(pk, item_type)
+            for pk, item_type in GameItemType.objects.order_by('id').values_list('id', 'item_type')
+        }
+        modifiers = {
+            row[0]: StaticItemModifierRecord(*row)
+            for row in StaticItemModifier.objects.order_by('id').values_list(*StaticItemModifierRecord._fields)
+        }
+
+        types_by_item = {}
+        through = StaticGameItem.item_types.through
+        for item_id, type_id in through.objects.order_by('id').values_list('staticgameitem_id', 'gameitemtype_id'):
+            types_by_item.setdefault(item_id, []).append(item_types[type_id].item_type)
+
+        modifiers_by_item = {}
+        for item_id, modifier_id in StaticItemTypeModifier.objects.order_by('id') \
+                .values_list('item_type_id_id', 'item_modifier_id_id'):
+            modifiers_by_item.setdefault(item_id, []).append(modifiers[modifier_id])
+
+        static_items = {}
+        for row in StaticGameItem.objects.order_by('id').values_list(*STATIC_ITEM_FIELDS):
+            pk = row[0]
+            types = tuple(types_by_item.get(pk, ()))
+            static_items[pk] = StaticItemRecord(*row,
+                                                item_types=types,
+                                                modifiers=tuple(modifiers_by_item.get(pk, ())),
+                                                slot_mask=Equipment.slot_mask(types))
+
+        return CatalogSnapshot(version, static_items, item_types, modifiers)
+
+
+def read_version():
+    versions = CatalogVersion.objects.using(DEFAULT_DB_ALIAS).filter(pk=CATALOG_VERSION_ID)
+    version = versions.values_list('version', flat=True).first()
+    if version is None:
+        version = bump_version()
+    return version
+
+
+def get_version():
+    return catalog.version()
+
+
+def bump_version():
+    """
+    Stores a new version token in the current transaction and returns it.
+    """
+    version = uuid.uuid4().hex
+    versions = CatalogVersion.objects.using(DEFAULT_DB_ALIAS).filter(pk=CATALOG_VERSION_ID)
+    if not versions.update(version=version):
+        CatalogVersion.objects.using(DEFAULT_DB_ALIAS).update_or_create(pk=CATALOG_VERSION_ID,
+                                                                        defaults={'version': version})
+    catalog.mark_stale()
+    return version
+
+
+def invalidate():
+    """
+    Bumps the version inside the current transaction, so other workers see it exactly when the changed rows commit,
+    and checks the version again once the transaction has committed.
+    """
+    bump_version()
+    transaction.on_commit(catalog.mark_stale)
+
+
+catalog = Catalog()
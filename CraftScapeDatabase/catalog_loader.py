@@ -0,0 +1,258 @@
+"""
+Loads the static catalog (item types, modifiers, static items, skills and skill dependencies) from JSON or CSV files.
+
+Rows are matched to the database by name: ``item_type`` for item types, ``name`` for modifiers, static items and
+skills, and the child and parent skill names for dependencies. Each table is read once, the differences are worked
+out in memory and applied with one bulk statement per kind of change inside a single transaction, so reloading an
+unchanged catalog only reads. Rows that are in the database but not in the files are left alone.
+
+A JSON file may hold any of the sections::
+
+    {"item_types": ["mainHand"],
+     "static_items": [{"name": "axe", "max_stack": 1, ..., "item_types": ["mainHand"], "modifiers": ["sharp"]}],
+     "skill_dependencies": [{"child_skill": "chopping", "parent_skill": "carpentry", "dependency_type": "U"}]}
+
+A CSV file holds the one section it is named after (``static_items.csv``), with the ``item_types`` and ``modifiers``
+of a static item separated by semicolons. Listing either for a static item replaces its links, leaving the column out
+keeps them.
+"""
+import csv
+import json
+import os
+from collections import OrderedDict
+from django.core import exceptions
+from django.db import transaction
+from django.db.models import BooleanField
+from rest_framework import serializers
+from CraftScapeDatabase import catalog
+from CraftScapeDatabase.bulk import bulk_update
+from CraftScapeDatabase.models import GameItemType, Skill, SkillDependency, StaticGameItem, StaticItemModifier, \
+    StaticItemTypeModifier
+from CraftScapeDatabase.skills import SkillGraph, skill_graph
+
+SECTIONS = ('item_types', 'modifiers', 'static_items', 'skills', 'skill_dependencies')
+LINK_COLUMNS = ('item_types', 'modifiers')
+DEFAULT_CATALOG = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'catalog.json')
+
+
+def read_catalog(paths):
+    """
+    Reads catalog files into a mapping of section name to a list of row dicts.
+    """
+    sections = OrderedDict((section, []) for section in SECTIONS)
+    for path in paths:
+        name, extension = os.path.splitext(os.path.basename(path))
+        if extension == '.json':
+            with open(path) as catalog_file:
+                data = json.load(catalog_file)
+            unknown = sorted(set(data) - set(SECTIONS))
+            if unknown:
+                raise serializers.ValidationError('{0}: unknown sections {1}.'.format(path, ', '.join(unknown)))
+            for section, rows in data.items():
+                sections[section].extend(rows)
+        elif extension == '.csv':
+            if name not in SECTIONS:
+                raise serializers.ValidationError('{0}: CSV files must be named after a section, one of {1}.'
+                                                  .format(path, ', '.join(SECTIONS)))
+            with open(path, newline='') as catalog_file:
+                sections[name].extend(parse_csv_row(row) for row in csv.DictReader(catalog_file))
+        else:
+            raise serializers.ValidationError('{0}: catalog files must be .json or .csv.'.format(path))
+
+    # Item types are only a name, JSON files may list them as plain strings
+    sections['item_types'] = [row if isinstance(row, dict) else {'item_type': row} for row in sections['item_types']]
+    return sections
+
+
+def parse_csv_row(row):
+    parsed = {}
+    for column, value in row.items():
+        if column in LINK_COLUMNS:
+            parsed[column] = [name.strip() for name in (value or '').split(';') if name.strip()]
+        elif value not in (None, ''):
+            # Empty cells fall back to the model default for new rows and keep the current value of existing ones
+            parsed[column] = value
+    return parsed
+
+
+def to_python(field, value):
+    if isinstance(field, BooleanField) and isinstance(value, str):
+        return value.strip().lower() in ('1', 't', 'true', 'yes')
+    try:
+        return field.to_python(value)
+    except exceptions.ValidationError as error:
+        raise serializers.ValidationError('{0}.{1}: {2}'.format(field.model.__name__, field.name, error.messages[0]))
+
+
+class CatalogLoader:
+    def __init__(self, sections, batch_size=500):
+        self.sections = sections
+        self.batch_size = batch_size
+        self.changes = OrderedDict()
+
+    def load(self, dry_run=False):
+        """
+        Applies the catalog and returns the number of rows created, updated and deleted per table. With ``dry_run``
+        the changes are rolled back at the end.
+        """
+        with transaction.atomic():
+            type_ids = self.sync(GameItemType, 'item_type', self.sections['item_types'])
+            modifier_ids = self.sync(StaticItemModifier, 'name', self.sections['modifiers'])
+            item_ids = self.sync(StaticGameItem, 'name', self.sections['static_items'], skip=LINK_COLUMNS)
+            self.sync_links(StaticGameItem.item_types.through, 'staticgameitem_id', 'gameitemtype_id', item_ids,
+                            type_ids, 'item_types')
+            self.sync_links(StaticItemTypeModifier, 'item_type_id_id', 'item_modifier_id_id', item_ids, modifier_ids,
+                            'modifiers')
+
+            skills = []
+            for row in self.sections['skills']:
+                row = dict(row)
+                if 'static_game_item' in row:
+                    row['static_game_item'] = self.resolve(item_ids, row['static_game_item'], 'Static game item')
+                skills.append(row)
+            skill_ids = self.sync(Skill, 'name', skills)
+            self.sync_dependencies(skill_ids)
+
+            if dry_run:
+                transaction.set_rollback(True)
+            elif self.written():
+                # Bulk statements send no signals
+                catalog.invalidate()
+                skill_graph.clear()
+        return self.changes
+
+    def written(self):
+        return any(any(counts.values()) for counts in self.changes.values())
+
+    def record(self, model, created=0, updated=0, deleted=0):
+        self.changes[model._meta.db_table] = OrderedDict((('created', created), ('updated', updated),
+                                                          ('deleted', deleted)))
+
+    @staticmethod
+    def resolve(ids, name, label):
+        if name not in ids:
+            raise serializers.ValidationError('{0} "{1}" does not exist.'.format(label, name))
+        return ids[name]
+
+    def clean(self, model, row, skip=()):
+        fields = {field.name: field for field in model._meta.concrete_fields if not field.primary_key}
+        values = {}
+        for column, value in row.items():
+            if column in skip:
+                continue
+            field = fields.get(column)
+            if field is None:
+                raise serializers.ValidationError('{0} has no field "{1}".'.format(model.__name__, column))
+            # Relations are resolved to ids by the caller
+            values[field.attname] = value if field.is_relation else to_python(field, value)
+        return values
+
+    def sync(self, model, key, rows, skip=()):
+        """
+        Inserts and updates ``model`` rows matched on ``key`` and returns the ids of every row in the table by key.
+        """
+        existing = {}
+        # The oldest row wins when a name is in the table more than once
+        for obj in model.objects.order_by('-id'):
+            existing[getattr(obj, key)] = obj
+
+        created, updated, fields, seen = [], [], set(), set()
+        for row in rows:
+            values = self.clean(model, row, skip)
+            name = values.get(key)
+            if name is None:
+                raise serializers.ValidationError('Every {0} needs a {1}.'.format(model.__name__, key))
+            if name in seen:
+                raise serializers.ValidationError('{0} "{1}" is listed twice.'.format(model.__name__, name))
+            seen.add(name)
+
+            obj = existing.get(name)
+            if obj is None:
+                created.append(model(**values))
+                continue
+            changed = [attname for attname, value in values.items() if getattr(obj, attname) != value]
+            for attname in changed:
+                setattr(obj, attname, values[attname])
+            if changed:
+                updated.append(obj)
+                fields.update(changed)
+
+        model.objects.bulk_create(created, batch_size=self.batch_size)
+        bulk_update(updated, sorted(fields), batch_size=self.batch_size)
+        self.record(model, created=len(created), updated=len(updated))
+
+        ids = {name: obj.pk for name, obj in existing.items()}
+        # bulk_create leaves the ids unset on SQLite, the new rows are read back by their names
+        names = [getattr(obj, key) for obj in created]
+        for offset in range(0, len(names), self.batch_size):
+            ids.update(model.objects.filter(**{key + '__in': names[offset:offset + self.batch_size]})
+                       .order_by('-id').values_list(key, 'id'))
+        return ids
+
+    def sync_links(self, model, source, target, source_ids, target_ids, column):
+        """
+        Replaces the ``model`` rows linking each static item that lists ``column`` with the ones it lists.
+        """
+        wanted = {}
+        for row in self.sections['static_items']:
+            if column in row:
+                wanted[source_ids[row['name']]] = {self.resolve(target_ids, name, model.__name__ + ' target')
+                                                   for name in row[column]}
+
+        linked, stale = set(), []
+        for pk, source_id, target_id in model.objects.order_by('id').values_list('pk', source, target):
+            if source_id not in wanted:
+                continue
+            if target_id in wanted[source_id] and (source_id, target_id) not in linked:
+                linked.add((source_id, target_id))
+            else:
+                stale.append(pk)
+
+        created = [model(**{source: source_id, target: target_id}) for source_id, target_ids in wanted.items()
+                   for target_id in sorted(target_ids) if (source_id, target_id) not in linked]
+        model.objects.bulk_create(created, batch_size=self.batch_size)
+        for offset in range(0, len(stale), self.batch_size):
+            model.objects.filter(pk__in=stale[offset:offset + self.batch_size]).delete()
+        self.record(model, created=len(created), deleted=len(stale))
+
+    def sync_dependencies(self, skill_ids):
+        labels = {label: code for code, label in SkillDependency.DEPENDENCY_TYPES}
+        existing = {}
+        for dependency in SkillDependency.objects.order_by('-id'):
+            existing[(dependency.child_skill_id, dependency.parent_skill_id)] = dependency
+
+        created, updated = [], []
+        for row in self.sections['skill_dependencies']:
+            edge = (self.resolve(skill_ids, row.get('child_skill'), 'Skill'),
+                    self.resolve(skill_ids, row.get('parent_skill'), 'Skill'))
+            dependency_type = row.get('dependency_type', SkillDependency.UNION)
+            dependency_type = labels.get(dependency_type, dependency_type)
+            if dependency_type not in labels.values():
+                raise serializers.ValidationError('Unknown dependency type "{0}".'.format(dependency_type))
+
+            dependency = existing.get(edge)
+            if dependency is None:
+                dependency = SkillDependency(child_skill_id=edge[0], parent_skill_id=edge[1],
+                                             dependency_type=dependency_type)
+                existing[edge] = dependency
+                created.append(dependency)
+            elif dependency.dependency_type != dependency_type:
+                dependency.dependency_type = dependency_type
+                updated.append(dependency)
+
+        if created:
+            # bulk_create skips SkillDependency.clean, so the new edges are checked for cycles here
+            edges = [(child_id, parent_id, dependency.dependency_type)
+                     for (child_id, parent_id), dependency in existing.items()]
+            try:
+                # Maps ids to names, which is what the cycle error lists
+                SkillGraph({skill_id: name for name, skill_id in skill_ids.items()}, edges)
+            except exceptions.ValidationError as error:
+                raise serializers.ValidationError(error.messages[0])
+        SkillDependency.objects.bulk_create(created, batch_size=self.batch_size)
+        bulk_update(updated, ['dependency_type'], batch_size=self.batch_size)
+        self.record(SkillDependency, created=len(created), updated=len(updated))
+
+
+def load_catalog(paths=(DEFAULT_CATALOG,), dry_run=False, batch_size=500):
+    return CatalogLoader(read_catalog(paths), batch_size=batch_size).load(dry_run=dry_run)
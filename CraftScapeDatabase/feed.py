@@ -0,0 +1,204 @@
+"""
+Change feed of character state versions for long-polling clients.
+
+Every committed write that increments a character's state version is published to a broker on the character's id.
+A waiter blocks (in a thread, or as an asyncio task that holds no thread) until a version newer than the one it has
+seen is published, then fetches the rows with ``character/<id>/changes/``.
+
+The broker class is ``FEED_BROKER``. The default LocalBroker only sees writes made by its own process, which is of no
+use to CraftScape.asgi: it serves nothing but the feed, so no write ever publishes there. Waits therefore also
+re-read the version from the database every ``FEED_POLL_INTERVAL`` seconds, so writes made by other processes are
+picked up with bounded delay. RedisBroker (``"broker": "CraftScapeDatabase.feed.RedisBroker"`` and ``"redis_url"`` in
+the ``feed`` block of settings.json, needs the redis package) passes every publish to all processes, so a commit in a
+WSGI worker wakes the waiters of the ASGI process straight away. Any class with the same ``publish``/``latest``/
+``wait``/``wait_async`` methods can be plugged in the same way.
+"""
+import asyncio
+import logging
+import threading
+import time
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+logger = logging.getLogger('CraftScape.feed')
+
+
+def _resolve(future, version):
+    if not future.done():
+        future.set_result(version)
+
+
+class LocalBroker:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._versions = {}
+        # Thread waiters by channel, as [condition on the shared lock, number of waiting threads]
+        self._conditions = {}
+        self._futures = {}
+
+    def latest(self, channel):
+        with self._lock:
+            return self._versions.get(channel)
+
+    def publish(self, channel, version):
+        with self._lock:
+            if version <= self._versions.get(channel, -1):
+                return
+            self._versions[channel] = version
+            waiters = self._conditions.get(channel)
+            if waiters is not None:
+                waiters[0].notify_all()
+            futures = self._futures.pop(channel, ())
+        for loop, future in futures:
+            loop.call_soon_threadsafe(_resolve, future, version)
+
+    def wait(self, channel, since, timeout):
+        """
+        Blocks until a version newer than ``since`` is published on ``channel`` and returns it, or returns None after
+        ``timeout`` seconds.
+        """
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            version = self._versions.get(channel)
+            if version is not None and version > since:
+                return version
+            waiters = self._conditions.setdefault(channel, [threading.Condition(self._lock), 0])
+            waiters[1] += 1
+            try:
+                while True:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return None
+                    waiters[0].wait(remaining)
+                    version = self._versions.get(channel)
+                    if version is not None and version > since:
+                        return version
+            finally:
+                waiters[1] -= 1
+                if not waiters[1]:
+                    del self._conditions[channel]
+
+    async def wait_async(self, channel, since, timeout):
+        loop = asyncio.get_event_loop()
+        waiter = (loop, loop.create_future())
+        with self._lock:
+            version = self._versions.get(channel)
+            if version is not None and version > since:
+                return version
+            self._futures.setdefault(channel, set()).add(waiter)
+        try:
+            return await asyncio.wait_for(waiter[1], timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            with self._lock:
+                waiters = self._futures.get(channel)
+                if waiters is not None:
+                    waiters.discard(waiter)
+                    if not waiters:
+                        del self._futures[channel]
+
+
+class RedisBroker(LocalBroker):
+    """
+    Sends publishes through Redis pub/sub to every process. Each process still answers waits from its own LocalBroker
+    state, fed by one listener thread started by the first wait.
+    """
+    PREFIX = 'craftscape-feed:'
+
+    def __init__(self, url=None):
+        if redis is None:
+            raise ImproperlyConfigured('RedisBroker needs the redis package.')
+        super().__init__()
+        self._client = redis.StrictRedis.from_url(url or settings.FEED_REDIS_URL)
+        self._listen_lock = threading.Lock()
+        self._listener = None
+
+    def publish(self, channel, version):
+        super().publish(channel, version)
+        try:
+            self._client.publish(self.PREFIX + str(channel), version)
+        except redis.RedisError:
+            # The write has committed already, other processes pick it up on their next database poll
+            logger.exception('Publishing version %s of %s to Redis failed.', version, channel)
+
+    def listen(self):
+        with self._listen_lock:
+            if self._listener is None:
+                pubsub = self._client.pubsub(ignore_subscribe_messages=True)
+                pubsub.psubscribe(**{self.PREFIX + '*': self.receive})
+                self._listener = pubsub.run_in_thread(sleep_time=0.05, daemon=True)
+
+    def receive(self, message):
+        channel = message['channel']
+        if isinstance(channel, bytes):
+            channel = channel.decode('utf-8')
+        LocalBroker.publish(self, int(channel[len(self.PREFIX):]), int(message['data']))
+
+    def wait(self, channel, since, timeout):
+        self.listen()
+        return super().wait(channel, since, timeout)
+
+    async def wait_async(self, channel, since, timeout):
+        self.listen()
+        return await super().wait_async(channel, since, timeout)
+
+
+def load_broker():
+    return import_string(getattr(settings, 'FEED_BROKER', 'CraftScapeDatabase.feed.LocalBroker'))()
+
+
+broker = load_broker()
+
+
+def publish_on_commit(versions, using=None):
+    """
+    Publishes {character id: state version} once the current transaction commits.
+    """
+    if versions:
+        versions = dict(versions)
+        transaction.on_commit(lambda: [broker.publish(key, value) for key, value in versions.items()], using=using)
+
+
+def poll_interval():
+    return getattr(settings, 'FEED_POLL_INTERVAL', 2.0)
+
+
+def wait_for_change(character_id, since, timeout, read_version):
+    """
+    Returns the character's state version once it is newer than ``since``, or None after ``timeout`` seconds.
+    ``read_version`` reads the current version from the database.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return None
+        version = broker.wait(character_id, since, min(remaining, poll_interval()))
+        if version is None:
+            version = read_version()
+        if version is not None and version > since:
+            return version
+
+
+async def wait_for_change_async(character_id, since, timeout, read_version):
+    """
+    Coroutine version of ``wait_for_change``, ``read_version`` is a coroutine function.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return None
+        version = await broker.wait_async(character_id, since, min(remaining, poll_interval()))
+        if version is None:
+            version = await read_version()
+        if version is not None and version > since:
+            return version
@@ -0,0 +1,196 @@
+"""
+Applies a list of inventory operations (move, swap, split and merge of game items) as one transaction.
+
+All items and bags involved are read up front with a fixed number of queries, the operations are applied in memory
+in order, and the result is written back with one bulk statement per kind of change, so a swap is never visible half
+done and the cost does not depend on how many operations are sent.
+"""
+import uuid
+from django.db import transaction, IntegrityError
+from rest_framework import serializers
+from CraftScapeDatabase.bulk import bulk_update
+from CraftScapeDatabase.catalog import catalog
+from CraftScapeDatabase.models import Character, GameItem, Inventory
+from CraftScapeDatabase.state import bump_state_versions, record_deletions
+
+MOVE = 'move'
+SWAP = 'swap'
+SPLIT = 'split'
+MERGE = 'merge'
+
+OPERATIONS = (MOVE, SWAP, SPLIT, MERGE)
+
+
+class InventoryState:
+    def __init__(self, items, inventories, occupied):
+        self.items = items
+        self.inventories = inventories
+        self.slots = occupied
+        self.changed = {}
+        self.created = []
+        self.deleted = {}
+        self.touched = set()
+        # Character each loaded item belonged to before the operations, moving it elsewhere leaves a tombstone
+        self.owners = {item.uuid: inventories[item.inventory_id].character_id for item in items.values()}
+
+    def item(self, item_uuid):
+        item = self.items.get(item_uuid)
+        if item is None or item_uuid in self.deleted:
+            raise serializers.ValidationError('Game item {0} does not exist in your inventories.'.format(item_uuid))
+        return item
+
+    def check_slot(self, inventory_id, position):
+        inventory = self.inventories.get(inventory_id)
+        if inventory is None:
+            raise serializers.ValidationError('Inventory {0} does not exist.'.format(inventory_id))
+        if not 0 <= position < inventory.size:
+            raise serializers.ValidationError('Inventory {0} has no position {1}.'.format(inventory_id, position))
+        if (inventory_id, position) in self.slots:
+            raise serializers.ValidationError('Position {1} of inventory {0} is taken.'.format(inventory_id, position))
+
+    def place(self, item, inventory_id, position):
+        self.vacate(item)
+        item.inventory_id = inventory_id
+        item.inventory_position = position
+        self.slots[(inventory_id, position)] = item.uuid
+        self.touched.add((inventory_id, position))
+        self.mark_changed(item)
+
+    def vacate(self, item):
+        if item.inventory_id is None:
+            return
+        slot = (item.inventory_id, item.inventory_position)
+        if self.slots.get(slot) == item.uuid:
+            del self.slots[slot]
+        self.touched.add(slot)
+
+    def mark_changed(self, item):
+        if item.pk is not None:
+            self.changed[item.uuid] = item
+
+    def move(self, operation):
+        item = self.item(operation['item'])
+        self.check_slot(operation['inventory'], operation['position'])
+        self.place(item, operation['inventory'], operation['position'])
+
+    def swap(self, operation):
+        item, other = self.item(operation['item']), self.item(operation['other'])
+        item_slot = (item.inventory_id, item.inventory_position)
+        other_slot = (other.inventory_id, other.inventory_position)
+        self.vacate(item)
+        self.vacate(other)
+        self.place(item, *other_slot)
+        self.place(other, *item_slot)
+
+    def split(self, operation):
+        item = self.item(operation['item'])
+        amount = operation['amount']
+        if amount >= item.stack_size:
+            raise serializers.ValidationError('Cannot split {0} off a stack of {1}.'.format(amount, item.stack_size))
+        self.check_slot(operation['inventory'], operation['position'])
+
+        new_uuid = operation.get('uuid') or uuid.uuid4()
+        if new_uuid in self.items:
+            raise serializers.ValidationError('Game item {0} already exists.'.format(new_uuid))
+        new_item = GameItem(uuid=new_uuid, static_game_item_id=item.static_game_item_id, created_by=item.created_by,
+                            stack_size=amount)
+        self.items[new_uuid] = new_item
+        self.created.append(new_item)
+        self.place(new_item, operation['inventory'], operation['position'])
+
+        item.stack_size -= amount
+        self.touched.add((item.inventory_id, item.inventory_position))
+        self.mark_changed(item)
+
+    def merge(self, operation):
+        item, target = self.item(operation['item']), self.item(operation['into'])
+        if item is target or item.static_game_item_id != target.static_game_item_id:
+            raise serializers.ValidationError('Cannot merge {0} into {1}.'.format(item.uuid, target.uuid))
+
+        static_item = catalog.get_static_item(target.static_game_item_id)
+        amount = min(item.stack_size, static_item.max_stack - target.stack_size)
+        if amount <= 0:
+            raise serializers.ValidationError('Game item {0} is already a full stack.'.format(target.uuid))
+
+        target.stack_size += amount
+        item.stack_size -= amount
+        self.touched.add((target.inventory_id, target.inventory_position))
+        self.touched.add((item.inventory_id, item.inventory_position))
+        self.mark_changed(target)
+        if item.stack_size:
+            self.mark_changed(item)
+        else:
+            self.vacate(item)
+            self.changed.pop(item.uuid, None)
+            if item.pk is None:
+                self.created.remove(item)
+            else:
+                self.deleted[item.uuid] = item
+
+    def save(self):
+        versions = bump_state_versions(inventory.character_id for inventory in self.inventories.values())
+        moved_out = []
+        for item in list(self.changed.values()) + self.created:
+            character_id = self.inventories[item.inventory_id].character_id
+            if item.pk is not None and self.owners[item.uuid] != character_id:
+                moved_out.append((self.owners[item.uuid], item._meta.model_name, item.pk))
+            item.state_version = versions[character_id]
+        if moved_out:
+            record_deletions(moved_out)
+
+        bulk_update(self.changed.values(), ['inventory', 'inventory_position', 'stack_size', 'state_version'])
+        if self.created:
+            GameItem.objects.bulk_create(self.created)
+            created = dict(GameItem.objects.filter(uuid__in=[item.uuid for item in self.created])
+                           .values_list('uuid', 'id'))
+            for item in self.created:
+                item.pk = created[item.uuid]
+        if self.deleted:
+            GameItem.objects.filter(pk__in=[item.pk for item in self.deleted.values()]).delete()
+
+    def changed_slots(self):
+        """
+        Every slot the operations touched, in inventory and position order, with the item now in it (or None).
+        """
+        slots = []
+        for inventory_id, position in sorted(self.touched):
+            item_uuid = self.slots.get((inventory_id, position))
+            slots.append((inventory_id, position, self.items[item_uuid] if item_uuid else None))
+        return slots
+
+
+def apply_inventory_operations(user, operations):
+    """
+    Applies ``operations`` to the inventories of ``user`` in one transaction and returns the changed slots as
+    (inventory id, position, game item or None) tuples. Raises ValidationError, leaving everything untouched, if any
+    operation is not possible.
+    """
+    item_uuids = set()
+    for operation in operations:
+        item_uuids.update(operation[key] for key in ('item', 'other', 'into') if operation.get(key))
+
+    with transaction.atomic():
+        items = GameItem.objects.select_for_update().filter(uuid__in=item_uuids, inventory__character__user=user)
+        items = {item.uuid: item for item in items}
+        creators = Character.objects.in_bulk({item.created_by_id for item in items.values()} - {None})
+        for item in items.values():
+            item.created_by = creators.get(item.created_by_id)
+
+        inventory_ids = {item.inventory_id for item in items.values()}
+        inventory_ids.update(operation['inventory'] for operation in operations if operation.get('inventory'))
+        inventories = Inventory.objects.filter(pk__in=inventory_ids, character__user=user).in_bulk()
+        occupants = GameItem.objects.filter(inventory__in=list(inventories))
+        occupied = {
+            (inventory_id, position): item_uuid
+            for item_uuid, inventory_id, position in occupants.values_list('uuid', 'inventory', 'inventory_position')
+        }
+
+        state = InventoryState(items, inventories, occupied)
+        for operation in operations:
+            getattr(state, operation['op'])(operation)
+        try:
+            state.save()
+        except IntegrityError:
+            raise serializers.ValidationError('A split off game item uuid is already in use.')
+
+    return state.changed_slots()
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from CraftScapeDatabase.modifiers import ExpiryScheduler, expire_modifiers
+
+
+class Command(BaseCommand):
+    help = 'Deletes expired item modifiers, once or (with --loop) continuously as they expire.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help='Keep running and delete modifiers as they expire.')
+        parser.add_argument('--interval', type=float, default=10.0,
+                            help='Seconds between reads of the modifiers about to expire when looping.')
+        parser.add_argument('--batch-size', type=int, default=500, help='Rows per DELETE statement.')
+
+    def handle(self, *args, **options):
+        if not options['loop']:
+            count = expire_modifiers(batch_size=options['batch_size'])
+            self.stdout.write(self.style.SUCCESS('Deleted {0} expired modifiers.'.format(count)))
+            return
+
+        scheduler = ExpiryScheduler(interval=options['interval'], batch_size=options['batch_size'])
+        try:
+            scheduler.run(on_expire=lambda count: self.stdout.write('Deleted {0} expired modifiers.'.format(count)))
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,37 @@
+import time
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from CraftScapeDatabase.world import generate_world
+
+
+class Command(BaseCommand):
+    help = 'Generates a reproducible synthetic world (catalog, users, characters, items, ...) for load tests.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10, help='Number of users to create.')
+        parser.add_argument('--characters', type=int, default=2, help='Characters per user.')
+        parser.add_argument('--bags', type=int, default=2, help='Bags per character, including the starter bag.')
+        parser.add_argument('--items', type=int, default=8, help='Game items per bag.')
+        parser.add_argument('--static-items', type=int, default=50, help='Static game items in the catalog.')
+        parser.add_argument('--skills', type=int, default=20, help='Skills in the catalog.')
+        parser.add_argument('--modifiers', type=int, default=100, help='Active item modifiers on random game items.')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed, the same seed builds the same world.')
+        parser.add_argument('--prefix', default='world', help='Prefix of generated user and catalog names.')
+        parser.add_argument('--password', default='password', help='Password of every generated user.')
+        parser.add_argument('--batch-size', type=int, default=500, help='Rows per INSERT statement.')
+
+    def handle(self, *args, **options):
+        if User.objects.filter(username__startswith=options['prefix']).exists():
+            raise CommandError('Users prefixed "{0}" already exist, pick another --prefix.'.format(options['prefix']))
+
+        start = time.perf_counter()
+        created = generate_world(
+            users=options['users'], characters=options['characters'], bags=options['bags'], items=options['items'],
+            static_items=options['static_items'], skills=options['skills'], modifiers=options['modifiers'],
+            seed=options['seed'], prefix=options['prefix'], password=options['password'],
+            batch_size=options['batch_size'],
+        )
+        elapsed = time.perf_counter() - start
+        for model, count in created.items():
+            self.stdout.write('  {0:<24} {1:>10}'.format(model, count))
+        self.stdout.write(self.style.SUCCESS('Generated {0} rows in {1:.2f} s.'.format(sum(created.values()), elapsed)))
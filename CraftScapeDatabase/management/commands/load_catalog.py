@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework import serializers
+from CraftScapeDatabase.catalog_loader import DEFAULT_CATALOG, load_catalog
+
+
+class Command(BaseCommand):
+    help = 'Loads catalog JSON or CSV files, inserting and updating only the rows that differ from the database.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='*', default=[DEFAULT_CATALOG],
+                            help='Catalog files, CraftScapeDatabase/data/catalog.json by default.')
+        parser.add_argument('--dry-run', action='store_true', help='Report the changes and roll them back.')
+        parser.add_argument('--batch-size', type=int, default=500, help='Rows per INSERT or UPDATE statement.')
+
+    def handle(self, *args, **options):
+        try:
+            changes = load_catalog(options['paths'], dry_run=options['dry_run'], batch_size=options['batch_size'])
+        except serializers.ValidationError as error:
+            raise CommandError(error.detail[0])
+        except (OSError, ValueError) as error:
+            raise CommandError(error)
+
+        changed = False
+        for table, counts in changes.items():
+            if any(counts.values()):
+                changed = True
+                self.stdout.write('  {0:<32} {1:>6} created {2:>6} updated {3:>6} deleted'.format(
+                    table, counts['created'], counts['updated'], counts['deleted']))
+        message = 'Catalog is up to date.' if not changed else \
+            'Catalog changes rolled back (dry run).' if options['dry_run'] else 'Catalog loaded.'
+        self.stdout.write(self.style.SUCCESS(message))
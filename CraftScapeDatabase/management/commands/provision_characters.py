@@ -0,0 +1,23 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from CraftScapeDatabase.provisioning import provision_characters
+
+
+class Command(BaseCommand):
+    help = 'Bulk creates characters, with equipment and a starter bag each, for load tests and event launches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('username', help='Owner of the new characters.')
+        parser.add_argument('count', type=int, help='Number of characters to create.')
+        parser.add_argument('--prefix', default='character', help='Name prefix, characters are numbered from 1.')
+        parser.add_argument('--batch-size', type=int, default=500, help='Rows per INSERT statement.')
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError('User "{0}" does not exist.'.format(options['username']))
+
+        character_ids = provision_characters(user, options['count'], name_prefix=options['prefix'],
+                                             batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS('Created {0} characters for {1}.'.format(len(character_ids), user)))
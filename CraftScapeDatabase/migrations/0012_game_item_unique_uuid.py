@@ -0,0 +1,33 @@
+# Generated by Django 2.0.3 on 2026-10-18 06:38
+
+from django.db import migrations, models
+from django.db.models import Count
+import uuid
+
+
+def deduplicate_uuids(apps, schema_editor):
+    """
+    Keeps the uuid on the oldest item sharing it and gives every other copy a fresh one.
+    """
+    GameItem = apps.get_model('CraftScapeDatabase', 'GameItem')
+    duplicates = GameItem.objects.values('uuid').annotate(copies=Count('id')).filter(copies__gt=1)
+    for duplicate in duplicates:
+        for item in GameItem.objects.filter(uuid=duplicate['uuid']).order_by('id')[1:]:
+            item.uuid = uuid.uuid4()
+            item.save(update_fields=['uuid'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('CraftScapeDatabase', '0011_auto_20180423_1536'),
+    ]
+
+    operations = [
+        migrations.RunPython(deduplicate_uuids, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='gameitem',
+            name='uuid',
+            field=models.UUIDField(default=uuid.uuid4, unique=True, verbose_name='uuid'),
+        ),
+    ]
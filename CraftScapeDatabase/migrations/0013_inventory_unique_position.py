@@ -0,0 +1,37 @@
+# Generated by Django 2.0.3 on 2026-10-18 06:39
+
+from django.db import migrations
+from django.db.models import Count
+
+
+def deduplicate_positions(apps, schema_editor):
+    """
+    Moves every bag sharing a position with an older bag of the same character to the lowest free position.
+    """
+    Inventory = apps.get_model('CraftScapeDatabase', 'Inventory')
+    duplicates = Inventory.objects.values('character', 'position').annotate(copies=Count('id')).filter(copies__gt=1)
+    for duplicate in duplicates:
+        taken = set(Inventory.objects.filter(character=duplicate['character']).values_list('position', flat=True))
+        inventories = Inventory.objects.filter(character=duplicate['character'], position=duplicate['position'])
+        for inventory in inventories.order_by('id')[1:]:
+            position = 1
+            while position in taken:
+                position += 1
+            taken.add(position)
+            inventory.position = position
+            inventory.save(update_fields=['position'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('CraftScapeDatabase', '0012_game_item_unique_uuid'),
+    ]
+
+    operations = [
+        migrations.RunPython(deduplicate_positions, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='inventory',
+            unique_together={('character', 'position')},
+        ),
+    ]
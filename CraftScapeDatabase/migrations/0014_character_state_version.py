@@ -0,0 +1,55 @@
+# Generated by Django 2.0.3 on 2026-10-18 06:48
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('CraftScapeDatabase', '0013_inventory_unique_position'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeletedObject',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(max_length=30)),
+                ('object_id', models.IntegerField()),
+                ('state_version', models.BigIntegerField()),
+            ],
+            options={
+                'db_table': 'deleted_object',
+            },
+        ),
+        migrations.AddField(
+            model_name='character',
+            name='state_version',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='equipment',
+            name='state_version',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='gameitem',
+            name='state_version',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='inventory',
+            name='state_version',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='deletedobject',
+            name='character',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='deleted_objects', to='CraftScapeDatabase.Character'),
+        ),
+        migrations.AddIndex(
+            model_name='deletedobject',
+            index=models.Index(fields=['character', 'state_version'], name='deleted_obj_charact_2ec008_idx'),
+        ),
+    ]
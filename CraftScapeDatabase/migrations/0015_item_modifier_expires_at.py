@@ -0,0 +1,56 @@
+# Generated by Django 2.0.3 on 2026-10-18 12:10
+
+import datetime
+import math
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def set_expiry(apps, schema_editor):
+    """
+    Turns the remaining duration of every modifier into an absolute expiry, one UPDATE per distinct duration.
+    """
+    ItemModifier = apps.get_model('CraftScapeDatabase', 'ItemModifier')
+    now = timezone.now()
+    durations = ItemModifier.objects.values_list('duration_remainder', flat=True).distinct()
+    for duration in list(durations):
+        ItemModifier.objects.filter(duration_remainder=duration) \
+            .update(expires_at=now + datetime.timedelta(seconds=max(0, duration)))
+
+
+def set_duration(apps, schema_editor):
+    ItemModifier = apps.get_model('CraftScapeDatabase', 'ItemModifier')
+    now = timezone.now()
+    for modifier in ItemModifier.objects.all():
+        modifier.duration_remainder = max(0, math.ceil((modifier.expires_at - now).total_seconds()))
+        modifier.save(update_fields=['duration_remainder'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('CraftScapeDatabase', '0014_character_state_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='itemmodifier',
+            name='expires_at',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AlterField(
+            model_name='itemmodifier',
+            name='duration_remainder',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(set_expiry, set_duration),
+        migrations.RemoveField(
+            model_name='itemmodifier',
+            name='duration_remainder',
+        ),
+        migrations.AlterField(
+            model_name='itemmodifier',
+            name='expires_at',
+            field=models.DateTimeField(db_index=True),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 2.0.3 on 2026-10-18 07:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('CraftScapeDatabase', '0015_item_modifier_expires_at'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='character',
+            index=models.Index(fields=['user', 'id'], name='character_user_id_5b2894_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='gameitem',
+            index=models.Index(fields=['inventory', 'inventory_position'], name='game_item_invento_7b5951_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='staticgameitem',
+            index=models.Index(fields=['name', 'id'], name='static_game_name_ce0315_idx'),
+        ),
+    ]
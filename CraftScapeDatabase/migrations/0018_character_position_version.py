@@ -0,0 +1,18 @@
+# Generated by Django 2.0.3 on 2026-10-18 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('CraftScapeDatabase', '0017_catalog_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='character',
+            name='position_version',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -1,13 +1,88 @@
+import datetime
+import math
 import uuid
-from django.db import models
+from django.db import models, transaction, IntegrityError
 from django.contrib.auth.models import User
 from django.shortcuts import reverse
 from django.conf import settings
+from django.utils import timezone
 from django.core.exceptions import ValidationError
 from rest_framework import serializers
 from rest_framework.exceptions import MethodNotAllowed
 
 
+class CharacterStateModel(models.Model):
+    """
+    A row owned by a character. Saving it increments the character's state version and stamps the row with the new
+    value in the same transaction, so delta sync can find every row written since a given version.
+    """
+    state_version = models.BigIntegerField(default=0, editable=False)
+
+    # The foreign key that moves the row to another character when it changes, and the lookup from the row to its
+    # character used to find the owner of the saved row
+    state_owner_field = None
+    state_owner_lookup = None
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.remember_state_owner()
+        return instance
+
+    def remember_state_owner(self):
+        if self.state_owner_field is not None:
+            attname = self._meta.get_field(self.state_owner_field).attname
+            if attname in self.__dict__:
+                self._loaded_state_owner = self.__dict__[attname]
+
+    def state_character_id(self):
+        """
+        Id of the character that owns the row, subclasses look it up. None leaves the row untracked: saving it bumps
+        no version and deleting it leaves no tombstone.
+        """
+        return None
+
+    def state_owner_changed(self, update_fields=None):
+        if self.pk is None or self.state_owner_field is None:
+            return False
+        attname = self._meta.get_field(self.state_owner_field).attname
+        if update_fields is not None and not {self.state_owner_field, attname} & set(update_fields):
+            return False
+        # Rows built with a primary key rather than loaded could belong to anyone
+        return '_loaded_state_owner' not in self.__dict__ or self._loaded_state_owner != getattr(self, attname)
+
+    def saved_state_character_id(self, using=None):
+        return type(self)._base_manager.using(using).filter(pk=self.pk) \
+            .values_list(self.state_owner_lookup, flat=True).first()
+
+    def save(self, force_insert=False, force_update=False, using=None, update_fields=None):
+        from CraftScapeDatabase.state import bump_state_versions
+
+        character_id = self.state_character_id()
+        moved = self.state_owner_changed(update_fields)
+        if character_id is None and not moved:
+            super().save(force_insert=force_insert, force_update=force_update, using=using, update_fields=update_fields)
+            self.remember_state_owner()
+            return
+
+        with transaction.atomic(using=using):
+            # A row moved away from a character bumps it too and leaves it a tombstone, as if the row was deleted
+            previous_id = self.saved_state_character_id(using=using) if moved else None
+            versions = bump_state_versions([character_id, previous_id], using=using)
+            if character_id is not None:
+                self.state_version = versions[character_id]
+                if update_fields is not None:
+                    update_fields = set(update_fields) | {'state_version'}
+            super().save(force_insert=force_insert, force_update=force_update, using=using, update_fields=update_fields)
+            if previous_id is not None and previous_id != character_id:
+                DeletedObject.objects.using(using).create(character_id=previous_id, model=self._meta.model_name,
+                                                          object_id=self.pk, state_version=versions[previous_id])
+        self.remember_state_owner()
+
+    class Meta:
+        abstract = True
+
+
 class Character(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='characters')
     name = models.CharField(max_length=255)
@@ -19,21 +94,32 @@ class Character(models.Model):
     equipment = models.OneToOneField('Equipment', on_delete=models.CASCADE, related_name='character')
     x_pos = models.FloatField(blank=True, null=True)
     y_pos = models.FloatField(blank=True, null=True)
+    # Incremented by every write to the character, its bags, game items or equipment, see CraftScapeDatabase.state
+    state_version = models.BigIntegerField(default=0, editable=False)
+    # Incremented by buffered position flushes instead of state_version, so movement does not wake change feed waiters
+    position_version = models.BigIntegerField(default=0, editable=False)
 
     def save(self, force_insert=False, force_update=False, using=None, update_fields=None):
-        inventory = None
-        if not self.pk:
-            equipment = Equipment()
-            equipment.save()
-            self.equipment = equipment
-
-            inventory = Inventory(position=0, size=16)
-
-        super().save(force_insert=force_insert, force_update=force_update, using=using, update_fields=update_fields)
-
-        if inventory:
-            inventory.character = self
-            inventory.save()
+        from CraftScapeDatabase.feed import publish_on_commit
+
+        if self.pk:
+            self.state_version = models.F('state_version') + 1
+            if update_fields is not None:
+                update_fields = set(update_fields) | {'state_version'}
+            super().save(force_insert=force_insert, force_update=force_update, using=using, update_fields=update_fields)
+            # post_save receivers still see the F() expression, only the refreshed value can be published
+            self.refresh_from_db(using=using, fields=['state_version'])
+            publish_on_commit({self.pk: self.state_version}, using=using)
+            return
+
+        with transaction.atomic(using=using):
+            self.equipment = Equipment.objects.using(using).create()
+            super().save(force_insert=force_insert, force_update=force_update, using=using, update_fields=update_fields)
+            # A new character has no bags yet, so the starter bag takes the first position without running the allocator
+            Inventory.objects.using(using).bulk_create([self.starter_inventory()])
+
+    def starter_inventory(self):
+        return Inventory(character=self, position=1, size=Inventory.INVENTORY_SIZES[Inventory.LARGE])
 
     def delete(self, using=None, keep_parents=False):
         raise MethodNotAllowed('Characters may not be deleted once created')
@@ -43,6 +129,8 @@ class Character(models.Model):
 
     class Meta:
         db_table = 'character'
+        # A player's characters, in the id order the API pages them in
+        indexes = [models.Index(fields=['user', 'id'])]
 
 
 class CharacterSkill(models.Model):
@@ -86,11 +174,19 @@ class SkillDependency(models.Model):
     def __str__(self):
         return self.child_skill.__str__() + " depends on " + self.parent_skill.__str__() + " (" + self.dependency_type + ")"
 
+    def clean(self):
+        from CraftScapeDatabase.skills import check_dependency
+
+        super().clean()
+        # Missing skills are reported by the field validation
+        if self.child_skill_id is not None and self.parent_skill_id is not None:
+            check_dependency(self.child_skill_id, self.parent_skill_id, self.dependency_type, exclude=self.pk)
+
     class Meta:
         db_table = 'skill_dependency'
 
 
-class Inventory(models.Model):
+class Inventory(CharacterStateModel):
     SMALL = 'SM'
     MEDIUM = 'MD'
     LARGE = 'LG'
@@ -105,23 +201,39 @@ class Inventory(models.Model):
     position = models.IntegerField(default=-1)
     size = models.IntegerField(default=INVENTORY_SIZES[SMALL])
 
-    def save(self, force_insert=False, force_update=False, using=None, update_fields=None):
-        if self.id is None or self.position < 0 or not self.position_is_available():
-            self.position = self.get_next_position()
-        super().save(force_insert=force_insert, force_update=force_update, using=using, update_fields=update_fields)
+    # How many times a save is retried after losing a race for a position to a concurrent save
+    POSITION_RETRIES = 5
 
-    def get_available_positions(self):
-        return [inv.position for inv in Inventory.objects.filter(character=self.character.id)]
+    state_owner_field = 'character'
+    state_owner_lookup = 'character_id'
 
-    def get_next_position(self):
-        curr_positions = self.get_available_positions()
-        remaining_pos = list(filter(lambda x: x not in curr_positions, list(range(1, self.character.max_inventories + 1))))
-        if len(remaining_pos) == 0:
-            raise Exception('maximum inventories reached.')
-        return remaining_pos[0]
+    def save(self, force_insert=False, force_update=False, using=None, update_fields=None):
+        allocate = self.id is None or self.position < 0
+        for attempt in range(self.POSITION_RETRIES):
+            try:
+                with transaction.atomic(using=using):
+                    if allocate:
+                        self.position = self.get_next_position()
+                    super().save(force_insert=force_insert, force_update=force_update, using=using,
+                                 update_fields=update_fields)
+                return
+            except IntegrityError:
+                # Either another bag already holds this position or a concurrent save took it first.
+                if attempt == self.POSITION_RETRIES - 1:
+                    raise
+                allocate = True
+
+    def state_character_id(self):
+        return self.character_id
 
-    def position_is_available(self):
-        return self.position not in [inv.position for inv in Inventory.objects.filter(character=self.character.id)]
+    def get_next_position(self):
+        rows = Character.objects.filter(pk=self.character_id) \
+            .values_list('max_inventories', 'inventories__id', 'inventories__position')
+        taken = {position for max_inventories, pk, position in rows if pk != self.pk}
+        for position in range(1, rows[0][0] + 1):
+            if position not in taken:
+                return position
+        raise Exception('maximum inventories reached.')
 
     def __str__(self):
         return "<Inventory<Owner: {}, pos: {}>>".format(self.character.name, self.position)
@@ -131,6 +243,7 @@ class Inventory(models.Model):
 
     class Meta:
         db_table = 'inventory'
+        unique_together = ('character', 'position')
 
 
 class StaticGameItem(models.Model):
@@ -169,33 +282,50 @@ class StaticGameItem(models.Model):
 
     class Meta:
         db_table = 'static_game_item'
+        # Name lookups and the (name, id) keyset the catalog API pages by
+        indexes = [models.Index(fields=['name', 'id'])]
 
 
-class GameItem(models.Model):
+class GameItem(CharacterStateModel):
     """
         Game Item
     """
-    uuid = models.UUIDField(verbose_name='uuid', default=uuid.uuid4)
+    uuid = models.UUIDField(verbose_name='uuid', default=uuid.uuid4, unique=True)
     inventory = models.ForeignKey(Inventory, on_delete=models.SET_NULL, related_name='game_items', null=True, blank=True)
     static_game_item = models.ForeignKey(StaticGameItem, on_delete=models.SET_NULL, related_name='static_game_item', null=True)
     created_by = models.ForeignKey(Character, on_delete=models.SET_NULL, related_name='created_by', blank=True, null=True)
     inventory_position = models.IntegerField()
     stack_size = models.IntegerField(default=1)
 
+    state_owner_field = 'inventory'
+    state_owner_lookup = 'inventory__character_id'
+
+    @property
+    def static_item(self):
+        from CraftScapeDatabase.catalog import catalog
+        return catalog.get_static_item(self.static_game_item_id)
+
     @property
     def types(self):
-        sgi = StaticGameItem.objects.get(pk=self.static_game_item.pk)
-        item_types = sgi.item_types.all()
-        return [t.item_type for t in item_types]
+        static_item = self.static_item
+        return list(static_item.item_types) if static_item else []
 
     @property
     def name(self):
-        return self.static_game_item.name
+        return self.static_item.name
 
     @property
     def created_by_name(self):
         return self.created_by.name if self.created_by else None
 
+    def state_character_id(self):
+        if self.inventory_id is None:
+            return None
+        field = self._meta.get_field('inventory')
+        if field.is_cached(self) and field.get_cached_value(self) is not None:
+            return field.get_cached_value(self).character_id
+        return Inventory.objects.filter(pk=self.inventory_id).values_list('character_id', flat=True).first()
+
     @property
     def url(self):
         url = reverse('api:game_item-detail', kwargs={'pk': self.pk})
@@ -206,11 +336,13 @@ class GameItem(models.Model):
 
     def clean(self):
         super().clean()
-        if self.stack_size > self.static_game_item.max_stack:
+        if self.stack_size > self.static_item.max_stack:
             raise ValidationError('Stack size has exceeded the max stack size.')
 
     class Meta:
         db_table = 'game_item'
+        # Slot lookups, bags are read and written one position at a time
+        indexes = [models.Index(fields=['inventory', 'inventory_position'])]
 
 
 class GameItemType(models.Model):
@@ -237,14 +369,38 @@ class GameItemModifier(models.Model):
         db_table = 'game_item__item_modifier'
 
 
+class ItemModifierQuerySet(models.QuerySet):
+    def active(self):
+        return self.filter(expires_at__gt=timezone.now())
+
+    def expired(self, now=None):
+        return self.filter(expires_at__lte=now or timezone.now())
+
+
 class ItemModifier(models.Model):
     item_modifier = models.ForeignKey('StaticItemModifier', on_delete=models.CASCADE)
-    duration_remainder = models.IntegerField()  # in seconds
+    # Expired rows are deleted in batches by the expire_modifiers command, see CraftScapeDatabase.modifiers
+    expires_at = models.DateTimeField(db_index=True)
     modifier_remainder = models.FloatField()
 
+    objects = ItemModifierQuerySet.as_manager()
+
     def __str__(self):
         return self.item_modifier.__str__()
 
+    @property
+    def duration_remainder(self):
+        """
+        Whole seconds until the modifier expires, computed when read instead of being counted down in the database.
+        """
+        if self.expires_at is None:
+            return None
+        return max(0, math.ceil((self.expires_at - timezone.now()).total_seconds()))
+
+    @duration_remainder.setter
+    def duration_remainder(self, seconds):
+        self.expires_at = timezone.now() + datetime.timedelta(seconds=seconds)
+
     class Meta:
         db_table = 'item_modifier'
 
@@ -273,7 +429,7 @@ class StaticItemTypeModifier(models.Model):
         db_table = 'static_item_type_modifier'
 
 
-class Equipment(models.Model):
+class Equipment(CharacterStateModel):
     ring = models.ForeignKey(GameItem, on_delete=models.SET_NULL, related_name='ring', null=True, blank=True)
     neck = models.ForeignKey(GameItem, on_delete=models.SET_NULL, related_name='neck', null=True, blank=True)
     head = models.ForeignKey(GameItem, on_delete=models.SET_NULL, related_name='head', null=True, blank=True)
@@ -285,29 +441,62 @@ class Equipment(models.Model):
     feet = models.ForeignKey(GameItem, on_delete=models.SET_NULL, related_name='feet', null=True, blank=True)
     legs = models.ForeignKey(GameItem, on_delete=models.SET_NULL, related_name='legs', null=True, blank=True)
 
+    # Equipment slot field names and the item type an item needs to be equipped in them
+    SLOTS = (
+        ('ring', 'ring'),
+        ('neck', 'neck'),
+        ('head', 'head'),
+        ('shoulders', 'shoulders'),
+        ('chest', 'chest'),
+        ('main_hand', 'mainHand'),
+        ('back', 'back'),
+        ('hands', 'hands'),
+        ('feet', 'feet'),
+        ('legs', 'legs'),
+    )
+    SLOT_MASKS = {item_type: 1 << index for index, (slot, item_type) in enumerate(SLOTS)}
+
+    @classmethod
+    def slot_mask(cls, item_types):
+        mask = 0
+        for item_type in item_types:
+            mask |= cls.SLOT_MASKS.get(item_type, 0)
+        return mask
+
     def save(self, force_insert=False, force_update=False, using=None, update_fields=None):
-        if self.ring and 'ring' not in self.ring.types:
-            raise serializers.ValidationError("Cannot equip {0} in ring slot".format(self.ring.name))
-        if self.neck and 'neck' not in self.neck.types:
-            raise serializers.ValidationError("Cannot equip {0} in neck slot".format(self.neck.name))
-        if self.head and 'head' not in self.head.types:
-            raise serializers.ValidationError("Cannot equip {0} in head slot".format(self.head.name))
-        if self.shoulders and 'shoulders' not in self.shoulders.types:
-            raise serializers.ValidationError("Cannot equip {0} in shoulders slot".format(self.head.name))
-        if self.chest and 'chest' not in self.chest.types:
-            raise serializers.ValidationError("Cannot equip {0} in chest slot".format(self.chest.name))
-        if self.main_hand and 'mainHand' not in self.main_hand.types:
-            raise serializers.ValidationError("Cannot equip {0} in main_hand slot".format(self.main_hand.name))
-        if self.back and 'back' not in self.back.types:
-            raise serializers.ValidationError("Cannot equip {0} in back slot".format(self.back.name))
-        if self.hands and 'hands' not in self.hands.types:
-            raise serializers.ValidationError("Cannot equip {0} in hands slot".format(self.hands.name))
-        if self.feet and 'feet' not in self.feet.types:
-            raise serializers.ValidationError("Cannot equip {0} in feet slot".format(self.feet.name))
-        if self.legs and 'legs' not in self.legs.types:
-            raise serializers.ValidationError("Cannot equip {0} in legs slot".format(self.legs.name))
+        self.validate_slots()
         super().save(force_insert=force_insert, force_update=force_update, using=using, update_fields=update_fields)
 
+    def state_character_id(self):
+        if self.pk is None:
+            return None
+        return Character.objects.filter(equipment_id=self.pk).values_list('id', flat=True).first()
+
+    def validate_slots(self):
+        from CraftScapeDatabase.catalog import catalog
+
+        static_item_ids = {}
+        missing = set()
+        for slot, item_type in self.SLOTS:
+            field = self._meta.get_field(slot)
+            if field.is_cached(self) and field.get_cached_value(self) is not None:
+                item = field.get_cached_value(self)
+                static_item_ids[item.pk] = item.static_game_item_id
+            elif getattr(self, field.attname) is not None:
+                missing.add(getattr(self, field.attname))
+
+        if missing:
+            static_item_ids.update(GameItem.objects.filter(pk__in=missing).values_list('pk', 'static_game_item_id'))
+
+        for slot, item_type in self.SLOTS:
+            item_id = getattr(self, self._meta.get_field(slot).attname)
+            if item_id is None:
+                continue
+            static_item = catalog.get_static_item(static_item_ids.get(item_id))
+            if static_item is None or not static_item.slot_mask & self.SLOT_MASKS[item_type]:
+                name = static_item.name if static_item else item_id
+                raise serializers.ValidationError("Cannot equip {0} in {1} slot".format(name, slot))
+
     def __str__(self):
         try:
             name = Character.objects.get(equipment=self.id).name
@@ -317,3 +506,33 @@ class Equipment(models.Model):
 
     class Meta:
         db_table = 'equipment'
+
+
+class DeletedObject(models.Model):
+    """
+    Tombstone left by a deleted bag or game item so delta sync can tell clients to drop it.
+    """
+    character = models.ForeignKey(Character, on_delete=models.CASCADE, related_name='deleted_objects')
+    model = models.CharField(max_length=30)
+    object_id = models.IntegerField()
+    state_version = models.BigIntegerField()
+
+    def __str__(self):
+        return "{0} {1} deleted at {2}".format(self.model, self.object_id, self.state_version)
+
+    class Meta:
+        db_table = 'deleted_object'
+        indexes = [models.Index(fields=['character', 'state_version'])]
+
+
+class CatalogVersion(models.Model):
+    """
+    The single row holding the version token of the static catalog, see CraftScapeDatabase.catalog.
+    """
+    version = models.CharField(max_length=32)
+
+    def __str__(self):
+        return self.version
+
+    class Meta:
+        db_table = 'catalog_version'
@@ -0,0 +1,111 @@
+"""
+Expiry of timed item modifiers.
+
+An ItemModifier stores when it expires rather than how long it has left, so nothing has to count it down: reads
+compute the remaining time and ``ItemModifier.objects.active()`` leaves expired rows out. The rows themselves (and,
+by cascade, their GameItemModifier links) are deleted by an ExpiryScheduler run by the ``expire_modifiers``
+command. It only ever reads the modifiers that expire within the next ``interval`` seconds, through the
+``expires_at`` index, and keeps them in a heap, so its cost follows the number of expiries rather than the number of
+active modifiers.
+"""
+import datetime
+import heapq
+import time
+from django.db import transaction
+from django.utils import timezone
+from CraftScapeDatabase.models import ItemModifier
+
+
+class ExpiryScheduler:
+    def __init__(self, interval=10.0, batch_size=500):
+        self.interval = interval
+        self.batch_size = batch_size
+        self._heap = []
+        self._scheduled = {}
+        self._loaded_at = None
+
+    def __len__(self):
+        return len(self._scheduled)
+
+    def load(self, now=None):
+        """
+        Schedules every modifier that expires before the load after this one, including ones created or extended
+        since the last load.
+        """
+        now = now or timezone.now()
+        until = now + datetime.timedelta(seconds=2 * self.interval)
+        for modifier_id, expires_at in ItemModifier.objects.filter(expires_at__lte=until) \
+                .values_list('id', 'expires_at').iterator():
+            if self._scheduled.get(modifier_id) != expires_at:
+                self._scheduled[modifier_id] = expires_at
+                heapq.heappush(self._heap, (expires_at, modifier_id))
+        self._loaded_at = time.monotonic()
+
+    def due(self, now):
+        """
+        Pops the ids of the scheduled modifiers that have expired by ``now``.
+        """
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            expires_at, modifier_id = heapq.heappop(self._heap)
+            # Entries superseded by a later load with a new expiry are skipped
+            if self._scheduled.get(modifier_id) == expires_at:
+                del self._scheduled[modifier_id]
+                due.append(modifier_id)
+        return due
+
+    def expire(self, now=None):
+        """
+        Deletes the modifiers that have expired by ``now`` in batches and returns how many were deleted.
+        """
+        now = now or timezone.now()
+        due = self.due(now)
+        deleted = 0
+        for offset in range(0, len(due), self.batch_size):
+            with transaction.atomic():
+                # A modifier extended since it was scheduled no longer matches and is picked up by the next load
+                batch = ItemModifier.objects.filter(pk__in=due[offset:offset + self.batch_size]).expired(now)
+                deleted += self._delete(batch)
+        return deleted
+
+    def run_once(self):
+        now = timezone.now()
+        if self._loaded_at is None or time.monotonic() - self._loaded_at >= self.interval:
+            self.load(now)
+        return self.expire(now)
+
+    def seconds_until_next(self):
+        """
+        How long ``run`` can sleep before something is due or the next load.
+        """
+        wait = self.interval - (time.monotonic() - self._loaded_at) if self._loaded_at is not None else 0
+        if self._heap:
+            wait = min(wait, (self._heap[0][0] - timezone.now()).total_seconds())
+        return max(0.0, wait)
+
+    def run(self, stop=None, on_expire=None):
+        """
+        Expires modifiers until ``stop`` (a threading.Event) is set, calling ``on_expire(count)`` after every batch.
+        """
+        while stop is None or not stop.is_set():
+            count = self.run_once()
+            if count and on_expire is not None:
+                on_expire(count)
+            wait = self.seconds_until_next()
+            if stop is not None:
+                stop.wait(wait)
+            else:
+                time.sleep(wait)
+
+    @staticmethod
+    def _delete(queryset):
+        return queryset.delete()[1].get(ItemModifier._meta.label, 0)
+
+
+def expire_modifiers(batch_size=500):
+    """
+    Deletes every modifier that has already expired, in batches, and returns how many were deleted.
+    """
+    scheduler = ExpiryScheduler(interval=0, batch_size=batch_size)
+    scheduler.load()
+    return scheduler.expire()
@@ -0,0 +1,125 @@
+"""
+Write-behind buffer for character positions.
+
+Position updates are the most frequent writes by far, and only the latest one per character matters. They are kept
+in memory (last write wins per character) and written by a background thread every ``POSITION_FLUSH_INTERVAL``
+seconds with one bulk UPDATE of ``x_pos``, ``y_pos`` and ``position_version``. Whatever is still buffered is flushed
+when the process exits. A position is therefore only durable after the next flush, and a worker that is killed
+outright loses at most one interval of movement.
+
+Flushes leave ``state_version`` alone, so movement neither wakes change feed waiters nor shows up in delta sync;
+other characters' positions are read from ``character/nearby/``.
+"""
+import atexit
+import logging
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections
+from django.db.models import F
+from CraftScapeDatabase.bulk import bulk_update
+from CraftScapeDatabase.models import Character
+
+logger = logging.getLogger('CraftScape.positions')
+
+
+class PositionBuffer:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._stop = threading.Event()
+        self._started = False
+        self._thread = None
+        self._received = 0
+        self._coalesced = 0
+        self._flushes = 0
+        self._written = 0
+        self._errors = 0
+        self._last_flush_ms = None
+
+    def put(self, character_id, x_pos, y_pos):
+        with self._lock:
+            if character_id in self._pending:
+                self._coalesced += 1
+            self._pending[character_id] = (x_pos, y_pos)
+            self._received += 1
+            if not self._started:
+                self._start()
+
+    def pending(self):
+        """
+        Copy of the positions that have not been written yet, by character id.
+        """
+        with self._lock:
+            return dict(self._pending)
+
+    def flush(self):
+        """
+        Writes every buffered position and returns how many characters were updated.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+
+        start = time.perf_counter()
+        characters = []
+        for character_id, (x_pos, y_pos) in pending.items():
+            character = Character(id=character_id, x_pos=x_pos, y_pos=y_pos)
+            character.position_version = F('position_version') + 1
+            characters.append(character)
+        try:
+            written = bulk_update(characters, ['x_pos', 'y_pos', 'position_version'])
+        except DatabaseError:
+            logger.exception('Writing %d buffered positions failed, they will be retried.', len(pending))
+            with self._lock:
+                self._errors += 1
+                for character_id, position in pending.items():
+                    # Positions received since the failed flush are newer and win
+                    self._pending.setdefault(character_id, position)
+            return 0
+
+        with self._lock:
+            self._flushes += 1
+            self._written += written
+            self._last_flush_ms = round((time.perf_counter() - start) * 1000, 3)
+        return written
+
+    def metrics(self):
+        with self._lock:
+            return OrderedDict((
+                ('pending', len(self._pending)),
+                ('received', self._received),
+                ('coalesced', self._coalesced),
+                ('flushes', self._flushes),
+                ('written', self._written),
+                ('errors', self._errors),
+                ('last_flush_ms', self._last_flush_ms),
+            ))
+
+    def stop(self):
+        self._stop.set()
+        thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+        self.flush()
+
+    def _start(self):
+        self._started = True
+        atexit.register(self.stop)
+        # A falsy interval leaves flushing to explicit flush() calls and process exit
+        interval = getattr(settings, 'POSITION_FLUSH_INTERVAL', 0.5)
+        if interval:
+            self._thread = threading.Thread(target=self._run, args=(interval,), name='position-flush', daemon=True)
+            self._thread.start()
+
+    def _run(self, interval):
+        while not self._stop.wait(interval):
+            try:
+                self.flush()
+            finally:
+                close_old_connections()
+
+
+positions = PositionBuffer()
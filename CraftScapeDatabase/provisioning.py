@@ -0,0 +1,35 @@
+from django.db import connections, router, transaction
+from CraftScapeDatabase.models import Character, Equipment, Inventory
+
+
+def provision_characters(user, count, name_prefix='character', batch_size=500):
+    """
+    Creates ``count`` characters for ``user``, each with empty equipment and a starter bag, inside a single
+    transaction. Characters and bags take one bulk INSERT per batch, equipment one INSERT per character unless the
+    backend returns ids from bulk inserts. Returns the ids of the new characters.
+    """
+    using = router.db_for_write(Character)
+    character_ids = []
+    with transaction.atomic(using=using):
+        for offset in range(0, count, batch_size):
+            size = min(batch_size, count - offset)
+            equipment_ids = bulk_create_equipment(size, using)
+            Character.objects.using(using).bulk_create([
+                Character(user=user, name='{0}{1}'.format(name_prefix, offset + index + 1), equipment_id=equipment_id)
+                for index, equipment_id in enumerate(equipment_ids)
+            ])
+
+            characters = Character.objects.using(using).filter(equipment_id__in=equipment_ids).order_by('id')
+            characters = list(characters.only('id'))
+            Inventory.objects.using(using).bulk_create([character.starter_inventory() for character in characters])
+            character_ids.extend(character.pk for character in characters)
+    return character_ids
+
+
+def bulk_create_equipment(count, using):
+    if connections[using].features.can_return_ids_from_bulk_insert:
+        return [item.pk for item in Equipment.objects.using(using).bulk_create([Equipment() for index in range(count)])]
+
+    # SQLite and MySQL do not return ids from a bulk insert, and nothing tells these rows apart from equipment other
+    # transactions insert at the same time, so each one is inserted on its own (still inside the one transaction)
+    return [Equipment.objects.using(using).create().pk for index in range(count)]
@@ -0,0 +1,72 @@
+import threading
+from django.db.models.signals import post_save, pre_delete, post_delete, m2m_changed
+from django.dispatch import receiver
+from CraftScapeDatabase import catalog, spatial
+from CraftScapeDatabase.skills import skill_graph
+from CraftScapeDatabase.models import StaticGameItem, GameItemType, StaticItemModifier, StaticItemTypeModifier, \
+    Skill, SkillDependency, Character, Inventory, GameItem
+from CraftScapeDatabase.state import record_deletions
+
+CATALOG_MODELS = (StaticGameItem, GameItemType, StaticItemModifier, StaticItemTypeModifier, Skill, SkillDependency)
+
+# Ids of the characters the current thread is deleting, see record_deletion
+_deleting = threading.local()
+
+
+def deleting_character_ids():
+    if not hasattr(_deleting, 'ids'):
+        _deleting.ids = set()
+    return _deleting.ids
+
+
+def invalidate_catalog(sender, **kwargs):
+    catalog.invalidate()
+
+
+for model in CATALOG_MODELS:
+    post_save.connect(invalidate_catalog, sender=model, dispatch_uid='catalog_save_{0}'.format(model.__name__))
+    post_delete.connect(invalidate_catalog, sender=model, dispatch_uid='catalog_delete_{0}'.format(model.__name__))
+
+
+@receiver(post_save, sender=Skill)
+@receiver(post_delete, sender=Skill)
+@receiver(post_save, sender=SkillDependency)
+@receiver(post_delete, sender=SkillDependency)
+def invalidate_skill_graph(sender, **kwargs):
+    # Other workers recompile when the catalog version changes on commit
+    skill_graph.clear()
+
+
+@receiver(m2m_changed, sender=StaticGameItem.item_types.through)
+def invalidate_catalog_item_types(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        catalog.invalidate()
+
+
+@receiver(post_delete, sender=Inventory)
+@receiver(post_delete, sender=GameItem)
+def record_deletion(sender, instance, using, **kwargs):
+    character_id = instance.state_character_id()
+    # Bags deleted along with their character (a deleted user) would leave tombstones pointing at a deleted row
+    if character_id is not None and character_id not in deleting_character_ids():
+        record_deletions([(character_id, instance._meta.model_name, instance.pk)], using=using)
+
+
+@receiver(pre_delete, sender=Character)
+def mark_deleted_character(sender, instance, **kwargs):
+    deleting_character_ids().add(instance.pk)
+
+
+@receiver(post_save, sender=Character)
+def update_spatial_grid(sender, instance, **kwargs):
+    spatial.characters.update(instance.pk, instance.x_pos, instance.y_pos)
+
+
+@receiver(post_delete, sender=Character)
+def remove_from_spatial_grid(sender, instance, **kwargs):
+    spatial.characters.remove(instance.pk)
+
+
+@receiver(post_delete, sender=Character)
+def unmark_deleted_character(sender, instance, **kwargs):
+    deleting_character_ids().discard(instance.pk)
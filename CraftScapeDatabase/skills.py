@@ -0,0 +1,123 @@
+"""
+Skill dependency graph.
+
+Every SkillDependency row is an edge from a child skill to the parent skill it helps unlock. A parent is unlockable
+once a character knows any of its UNION children, or all of its INTERSECTION children; a skill no row names as a
+parent has no requirements. The table is compiled once per catalog version into adjacency maps in topological order
+(rejecting cycles), so evaluating a character only looks at the parents of the skills it knows.
+"""
+import threading
+from collections import deque
+from django.core.exceptions import ValidationError
+from CraftScape.db_router import use_primary
+from CraftScapeDatabase import catalog
+from CraftScapeDatabase.models import Skill, SkillDependency
+
+
+class SkillGraph:
+    def __init__(self, skills, dependencies):
+        """
+        ``skills`` maps skill ids to Skill objects, ``dependencies`` is a list of (child id, parent id, dependency
+        type) tuples.
+        """
+        self.skills = skills
+        self.parents = {}
+        self.any_of = {}
+        self.all_of = {}
+        for child_id, parent_id, dependency_type in dependencies:
+            self.parents.setdefault(child_id, set()).add(parent_id)
+            required = self.any_of if dependency_type == SkillDependency.UNION else self.all_of
+            required.setdefault(parent_id, set()).add(child_id)
+        self.order = self.topological_order()
+        self.rank = {skill_id: index for index, skill_id in enumerate(self.order)}
+        self.roots = frozenset(skill_id for skill_id in skills if skill_id not in self.any_of
+                               and skill_id not in self.all_of)
+
+    def topological_order(self):
+        """
+        Skill ids ordered so that every child comes before its parents (Kahn's algorithm). Raises ValidationError
+        naming the skills involved if the dependencies contain a cycle.
+        """
+        incoming = {skill_id: len(self.any_of.get(skill_id, ())) + len(self.all_of.get(skill_id, ()))
+                    for skill_id in self.skills}
+        ready = deque(sorted(skill_id for skill_id, count in incoming.items() if not count))
+        order = []
+        while ready:
+            skill_id = ready.popleft()
+            order.append(skill_id)
+            for parent_id in sorted(self.parents.get(skill_id, ())):
+                incoming[parent_id] -= 1
+                if not incoming[parent_id]:
+                    ready.append(parent_id)
+
+        if len(order) != len(incoming):
+            cycle = sorted(str(self.skills[skill_id]) for skill_id, count in incoming.items() if count)
+            raise ValidationError('Skill dependencies form a cycle between: {0}.'.format(', '.join(cycle)))
+        return order
+
+    def is_unlockable(self, skill_id, known):
+        any_of, all_of = self.any_of.get(skill_id), self.all_of.get(skill_id)
+        if not any_of and not all_of:
+            return True
+        return bool(any_of and not any_of.isdisjoint(known)) or bool(all_of and all_of <= known)
+
+    def unlockable(self, known):
+        """
+        Ids of the skills that are not in ``known`` but can be unlocked with it, in topological order. Only the
+        skills without requirements and the parents of known skills are evaluated.
+        """
+        known = set(known)
+        candidates = set(self.roots)
+        for skill_id in known:
+            candidates.update(self.parents.get(skill_id, ()))
+        return self._evaluate(candidates, known)
+
+    def _evaluate(self, candidates, known):
+        unlockable = [skill_id for skill_id in candidates
+                      if skill_id in self.skills and skill_id not in known and self.is_unlockable(skill_id, known)]
+        return sorted(unlockable, key=self.rank.__getitem__)
+
+
+def compile_graph(extra=(), exclude=None):
+    """
+    Compiles the dependency table, without the row with pk ``exclude`` and with the ``extra`` (child id, parent id,
+    dependency type) edges, which is how a dependency is checked before it is saved.
+    """
+    # Read from the primary, the compiled graph is cached under the catalog version read there
+    with use_primary():
+        skills = Skill.objects.in_bulk()
+        dependencies = list(SkillDependency.objects.exclude(pk=exclude).order_by('id')
+                            .values_list('child_skill_id', 'parent_skill_id', 'dependency_type'))
+    return SkillGraph(skills, dependencies + list(extra))
+
+
+def check_dependency(child_id, parent_id, dependency_type, exclude=None):
+    """
+    Raises ValidationError if the child to parent dependency would close a cycle, ``exclude`` is the pk of the row it
+    replaces.
+    """
+    compile_graph(extra=[(child_id, parent_id, dependency_type)], exclude=exclude)
+
+
+class SkillGraphCache:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._graph = None
+
+    def graph(self):
+        # Editing skills or dependencies bumps the catalog version, see CraftScapeDatabase.signals
+        version = catalog.get_version()
+        if self._graph is not None and self._version == version:
+            return self._graph
+        with self._lock:
+            if self._graph is None or self._version != version:
+                self._graph = compile_graph()
+                self._version = version
+            return self._graph
+
+    def clear(self):
+        self._graph = None
+
+
+skill_graph = SkillGraphCache()
@@ -0,0 +1,145 @@
+"""
+In-memory spatial index of character positions.
+
+Positions are bucketed into a uniform grid of ``SPATIAL_GRID_CELL_SIZE`` sized square cells, so a radius query only
+visits the cells overlapping the circle and costs time proportional to how many characters are nearby, not to how
+many exist. Each worker loads the grid from the database on its first query and keeps it current from its own
+position writes; since it cannot see other workers' writes it reloads once it is older than ``SPATIAL_GRID_MAX_AGE``
+seconds. That reload runs on a background thread, queries keep using the old grid until the new one is ready.
+"""
+import logging
+import math
+import threading
+import time
+from django.conf import settings
+from django.db import close_old_connections
+from CraftScape.db_router import use_primary
+from CraftScapeDatabase.models import Character
+from CraftScapeDatabase.positions import positions
+
+logger = logging.getLogger('CraftScape.spatial')
+
+
+class SpatialGrid:
+    def __init__(self, cell_size):
+        self.cell_size = float(cell_size)
+        self._lock = threading.Lock()
+        self._cells = {}
+        self._positions = {}
+
+    def __len__(self):
+        return len(self._positions)
+
+    def cell(self, x_pos, y_pos):
+        return math.floor(x_pos / self.cell_size), math.floor(y_pos / self.cell_size)
+
+    def update(self, character_id, x_pos, y_pos):
+        with self._lock:
+            self._remove(character_id)
+            if x_pos is None or y_pos is None:
+                return
+            self._positions[character_id] = (x_pos, y_pos)
+            self._cells.setdefault(self.cell(x_pos, y_pos), set()).add(character_id)
+
+    def remove(self, character_id):
+        with self._lock:
+            self._remove(character_id)
+
+    def position(self, character_id):
+        return self._positions.get(character_id)
+
+    def nearby(self, x_pos, y_pos, radius, limit=None):
+        """
+        (character id, distance) of every character within ``radius`` of the point, closest first.
+        """
+        min_x, min_y = self.cell(x_pos - radius, y_pos - radius)
+        max_x, max_y = self.cell(x_pos + radius, y_pos + radius)
+        found = []
+        with self._lock:
+            for cell_x in range(min_x, max_x + 1):
+                for cell_y in range(min_y, max_y + 1):
+                    for character_id in self._cells.get((cell_x, cell_y), ()):
+                        other_x, other_y = self._positions[character_id]
+                        distance = math.hypot(other_x - x_pos, other_y - y_pos)
+                        if distance <= radius:
+                            found.append((character_id, distance))
+        found.sort(key=lambda entry: (entry[1], entry[0]))
+        return found[:limit] if limit is not None else found
+
+    def _remove(self, character_id):
+        position = self._positions.pop(character_id, None)
+        if position is None:
+            return
+        cell = self.cell(*position)
+        members = self._cells[cell]
+        members.discard(character_id)
+        if not members:
+            del self._cells[cell]
+
+
+class CharacterGrid:
+    """
+    The grid of all characters, loaded from the database on first use and reloaded in the background once it is too
+    old.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Held while a background reload runs, so a stale grid starts one reload however many requests notice it
+        self._refreshing = threading.Lock()
+        self._grid = None
+        self._loaded_at = 0.0
+
+    def grid(self):
+        grid = self._grid
+        max_age = getattr(settings, 'SPATIAL_GRID_MAX_AGE', 30)
+        if grid is None:
+            return self.reload(max_age)
+        if time.monotonic() - self._loaded_at > max_age and self._refreshing.acquire(blocking=False):
+            threading.Thread(target=self._refresh, args=(max_age,), name='spatial-grid-reload', daemon=True).start()
+        return grid
+
+    def reload(self, max_age=None):
+        """
+        Loads the grid from the database. With ``max_age`` a grid loaded by another thread while this one waited for
+        the lock is returned instead of being loaded again.
+        """
+        with self._lock, use_primary():
+            if max_age is not None and self._grid is not None and time.monotonic() - self._loaded_at <= max_age:
+                return self._grid
+            grid = SpatialGrid(getattr(settings, 'SPATIAL_GRID_CELL_SIZE', 50.0))
+            rows = Character.objects.filter(x_pos__isnull=False, y_pos__isnull=False) \
+                .values_list('id', 'x_pos', 'y_pos')
+            for character_id, x_pos, y_pos in rows.iterator():
+                grid.update(character_id, x_pos, y_pos)
+            # Positions still waiting in the write-behind buffer are newer than the database
+            for character_id, (x_pos, y_pos) in positions.pending().items():
+                grid.update(character_id, x_pos, y_pos)
+            self._grid = grid
+            self._loaded_at = time.monotonic()
+            return grid
+
+    def _refresh(self, max_age):
+        try:
+            self.reload(max_age)
+        except Exception:
+            # Queries keep the old grid, the next one past the age starts another reload
+            logger.exception('Reloading the character grid failed.')
+        finally:
+            self._refreshing.release()
+            close_old_connections()
+
+    def update(self, character_id, x_pos, y_pos):
+        # Nothing to keep current before the first load, which reads the database anyway
+        if self._grid is not None:
+            self._grid.update(character_id, x_pos, y_pos)
+
+    def remove(self, character_id):
+        if self._grid is not None:
+            self._grid.remove(character_id)
+
+    def clear(self):
+        self._grid = None
+
+
+characters = CharacterGrid()
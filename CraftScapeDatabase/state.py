@@ -0,0 +1,41 @@
+"""
+Per-character state versions used by delta sync.
+
+Every write to a character or to one of its bags, game items or equipment increments ``Character.state_version`` and
+stamps the written row with the new value; deleting a bag or game item, or moving it to another character, leaves
+the character that lost it a DeletedObject stamped the same way.
+A client that remembers the last version it saw only needs the rows stamped with a later one.
+"""
+from django.db.models import F
+from CraftScapeDatabase.feed import publish_on_commit
+from CraftScapeDatabase.models import Character, DeletedObject
+
+
+def bump_state_versions(character_ids, using=None):
+    """
+    Increments the state version of every given character and returns {character id: new version}. Call it inside
+    the transaction that writes the rows, the row lock it takes orders concurrent writers.
+    """
+    character_ids = set(character_ids) - {None}
+    if not character_ids:
+        return {}
+    characters = Character.objects.using(using).filter(pk__in=character_ids)
+    characters.update(state_version=F('state_version') + 1)
+    versions = dict(characters.values_list('id', 'state_version'))
+    publish_on_commit(versions, using=using)
+    return versions
+
+
+def bump_state_version(character_id, using=None):
+    return bump_state_versions([character_id], using=using).get(character_id)
+
+
+def record_deletions(deleted, using=None):
+    """
+    Leaves tombstones for ``deleted``, a list of (character id, model name, object id) tuples.
+    """
+    versions = bump_state_versions({character_id for character_id, model, object_id in deleted}, using=using)
+    DeletedObject.objects.using(using).bulk_create([
+        DeletedObject(character_id=character_id, model=model, object_id=object_id, state_version=versions[character_id])
+        for character_id, model, object_id in deleted if character_id in versions
+    ])
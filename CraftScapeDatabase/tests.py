@@ -1,3 +1,715 @@
-from django.test import TestCase
+from django.contrib.auth.models import User
+import asyncio
+import datetime
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+from unittest import mock
+from django.core.exceptions import ImproperlyConfigured, ValidationError
+from django.core.management import call_command, CommandError
+from django.db import connection, transaction, OperationalError
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework import serializers
+from CraftScapeDatabase import spatial
+from CraftScapeDatabase.catalog import catalog
+from CraftScapeDatabase.catalog_loader import CatalogLoader, load_catalog
+from CraftScapeDatabase import feed
+from CraftScapeDatabase.feed import LocalBroker, RedisBroker
+from CraftScapeDatabase.modifiers import ExpiryScheduler
+from CraftScapeDatabase.provisioning import provision_characters
+from CraftScapeDatabase.skills import skill_graph
+from CraftScapeDatabase.spatial import SpatialGrid
+from CraftScapeDatabase.world import generate_world
+from CraftScapeDatabase.models import Character, GameItem, StaticGameItem, GameItemType, StaticItemModifier, \
+    StaticItemTypeModifier, Equipment, Inventory, Skill, SkillDependency, ItemModifier, GameItemModifier, \
+    CharacterSkill, CatalogVersion, DeletedObject
 
-# Create your tests here.
+
+def create_static_item(name='axe', types=(), **kwargs):
+    data = {
+        'name': name,
+        'sprite_name': name,
+        'description': 'An {0}.'.format(name),
+        'max_stack': 1,
+        'value': 10.0,
+        'equipable': bool(types),
+    }
+    data.update(kwargs)
+    static_item = StaticGameItem.objects.create(**data)
+    for item_type in types:
+        static_item.item_types.add(GameItemType.objects.get_or_create(item_type=item_type)[0])
+    return static_item
+
+
+class CatalogTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('catalog', password='password')
+        self.character = Character.objects.create(name='catalog', user=self.user)
+        self.inventory = self.character.inventories.get()
+        self.axe = create_static_item('axe', types=('mainHand',))
+
+    def test_types_are_served_from_memory(self):
+        item = GameItem.objects.create(inventory=self.inventory, inventory_position=0, static_game_item=self.axe)
+        catalog.snapshot()
+
+        with self.assertNumQueries(0):
+            self.assertEqual(item.types, ['mainHand'])
+            self.assertEqual(item.name, 'axe')
+
+    def test_item_type_changes_invalidate_catalog(self):
+        self.assertEqual(catalog.get_static_item(self.axe.pk).item_types, ('mainHand',))
+
+        self.axe.item_types.add(GameItemType.objects.create(item_type='back'))
+
+        self.assertEqual(catalog.get_static_item(self.axe.pk).item_types, ('mainHand', 'back'))
+
+    def test_modifiers_are_attached_to_records(self):
+        modifier = StaticItemModifier.objects.create(name='sharp', description='Sharp.', modifier=1.5, duration=60)
+        StaticItemTypeModifier.objects.create(item_type_id=self.axe, item_modifier_id=modifier)
+
+        record = catalog.get_static_item(self.axe.pk)
+
+        self.assertEqual([m.name for m in record.modifiers], ['sharp'])
+
+    def test_deleted_items_leave_catalog(self):
+        pk = self.axe.pk
+        self.axe.delete()
+
+        self.assertIsNone(catalog.get_static_item(pk))
+
+    def test_unknown_items_do_not_reload(self):
+        catalog.snapshot()
+
+        with self.assertNumQueries(0):
+            self.assertIsNone(catalog.get_static_item(self.axe.pk + 1000))
+
+    def test_rolled_back_changes_are_not_cached(self):
+        catalog.snapshot()
+        with self.assertRaises(ZeroDivisionError), transaction.atomic():
+            apple = create_static_item('apple')
+            self.assertEqual(catalog.get_static_item(apple.pk).name, 'apple')
+            1 / 0
+
+        # What the next version check does
+        catalog.mark_stale()
+
+        self.assertIsNone(catalog.get_static_item(apple.pk))
+        self.assertEqual(catalog.version(), CatalogVersion.objects.get().version)
+
+
+class EquipmentTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('equipment', password='password')
+        self.character = Character.objects.create(name='equipment', user=self.user)
+        self.inventory = self.character.inventories.get()
+
+    def create_item(self, static_item, position=0):
+        return GameItem.objects.create(inventory=self.inventory, inventory_position=position,
+                                       static_game_item=static_item)
+
+    def test_slot_masks_are_precomputed(self):
+        axe = create_static_item('axe', types=('mainHand', 'back'))
+
+        record = catalog.get_static_item(axe.pk)
+
+        self.assertEqual(record.slot_mask, Equipment.SLOT_MASKS['mainHand'] | Equipment.SLOT_MASKS['back'])
+
+    def test_full_equipment_validates_in_one_query(self):
+        equipment = Equipment.objects.get(pk=self.character.equipment_id)
+        for position, (slot, item_type) in enumerate(Equipment.SLOTS):
+            item = self.create_item(create_static_item(slot, types=(item_type,)), position)
+            setattr(equipment, '{0}_id'.format(slot), item.pk)
+        catalog.snapshot()
+
+        # The one game item lookup plus the six statements of test_cached_items_need_no_lookup
+        with self.assertNumQueries(7):
+            equipment.save()
+
+    def test_cached_items_need_no_lookup(self):
+        equipment = Equipment.objects.get(pk=self.character.equipment_id)
+        equipment.ring = self.create_item(create_static_item('ring', types=('ring',)))
+        catalog.snapshot()
+
+        # Owner lookup, savepoint, state version update and read back, equipment update, savepoint release
+        with self.assertNumQueries(6):
+            equipment.save()
+
+    def test_wrong_slot_is_rejected(self):
+        equipment = Equipment.objects.get(pk=self.character.equipment_id)
+        equipment.shoulders = self.create_item(create_static_item('apple'))
+
+        with self.assertRaisesMessage(serializers.ValidationError, 'Cannot equip apple in shoulders slot'):
+            equipment.save()
+
+
+class InventoryPositionTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('bags', password='password')
+        self.character = Character.objects.create(name='bags', user=self.user)
+
+    def test_lowest_free_position_is_used(self):
+        second = Inventory.objects.create(character=self.character)
+        third = Inventory.objects.create(character=self.character)
+        second.delete()
+
+        fourth = Inventory.objects.create(character=self.character)
+
+        self.assertEqual((third.position, fourth.position), (3, 2))
+
+    def test_allocation_takes_one_query(self):
+        inventory = Inventory(character_id=self.character.pk)
+
+        with self.assertNumQueries(1):
+            self.assertEqual(inventory.get_next_position(), 2)
+
+    def test_saving_keeps_position(self):
+        inventory = Inventory.objects.create(character=self.character)
+        inventory.size = 12
+        inventory.save()
+
+        self.assertEqual(Inventory.objects.get(pk=inventory.pk).position, 2)
+
+    def test_taken_position_is_reallocated(self):
+        inventory = Inventory.objects.create(character=self.character)
+        inventory.position = 1
+        inventory.save()
+
+        self.assertEqual(Inventory.objects.get(pk=inventory.pk).position, 2)
+
+    def test_maximum_inventories(self):
+        for position in range(self.character.max_inventories - 1):
+            Inventory.objects.create(character=self.character)
+
+        with self.assertRaisesMessage(Exception, 'maximum inventories reached.'):
+            Inventory.objects.create(character=self.character)
+
+
+class CharacterDeletionTestCase(TransactionTestCase):
+    """
+    Foreign keys are only checked when a transaction commits, which TestCase never does.
+    """
+
+    def test_users_with_characters_can_be_deleted(self):
+        user = User.objects.create_user('leaving', password='password')
+        character = Character.objects.create(name='leaving', user=user)
+        Inventory.objects.create(character=character)
+        GameItem.objects.create(inventory=character.inventories.first(), inventory_position=0,
+                                static_game_item=create_static_item('axe'))
+        staying = Character.objects.create(name='staying', user=User.objects.create_user('staying'))
+
+        user.delete()
+        Inventory.objects.create(character=staying).delete()
+
+        self.assertFalse(Character.objects.filter(pk=character.pk).exists())
+        self.assertEqual(list(DeletedObject.objects.values_list('character_id', 'model')), [(staying.pk, 'inventory')])
+
+
+class InventoryPositionConcurrencyTestCase(TransactionTestCase):
+    attempts = 200
+
+    def test_concurrent_creates_get_distinct_positions(self):
+        user = User.objects.create_user('concurrent', password='password')
+        character = Character.objects.create(name='concurrent', user=user, max_inventories=12)
+        barrier = threading.Barrier(10)
+        errors = []
+
+        def create_inventory():
+            try:
+                barrier.wait()
+                for attempt in range(self.attempts):
+                    try:
+                        Inventory.objects.create(character=character)
+                        return
+                    except OperationalError:
+                        # SQLite reports a locked database rather than queueing writers
+                        time.sleep(0.001)
+                raise AssertionError('Database still locked after {0} attempts'.format(self.attempts))
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=create_inventory) for index in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        positions = list(Inventory.objects.filter(character=character).values_list('position', flat=True))
+        self.assertEqual(errors, [])
+        self.assertEqual(sorted(positions), list(range(1, 12)))
+
+
+class CharacterBootstrapTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('bootstrap', password='password')
+
+    def test_creation_is_three_inserts_in_one_transaction(self):
+        with CaptureQueriesContext(connection) as queries:
+            character = Character.objects.create(name='bootstrap', user=self.user)
+
+        statements = [query['sql'].split()[0] for query in queries]
+        self.assertEqual(statements, ['SAVEPOINT', 'INSERT', 'INSERT', 'INSERT', 'RELEASE'])
+        self.assertEqual(list(character.inventories.values_list('position', 'size')), [(1, 16)])
+
+    def test_failed_creation_leaves_no_equipment(self):
+        with self.assertRaises(Exception):
+            Character.objects.create(name=None, user=self.user)
+
+        self.assertFalse(Equipment.objects.exists())
+
+    def test_provisioning(self):
+        orphan = Equipment.objects.create()
+        with CaptureQueriesContext(connection) as queries:
+            character_ids = provision_characters(self.user, 25, name_prefix='bot', batch_size=10)
+
+        self.assertEqual(len(character_ids), 25)
+        # One INSERT per equipment row, then a bulk INSERT of characters, their ids and a bulk INSERT of bags per
+        # batch of 10, all inside one savepoint
+        self.assertEqual(len(queries), 2 + 25 + 3 * 3)
+        self.assertFalse(Character.objects.filter(equipment=orphan).exists())
+        characters = Character.objects.filter(pk__in=character_ids)
+        self.assertEqual(len({character.equipment_id for character in characters}), 25)
+        self.assertEqual(Inventory.objects.filter(character__in=character_ids, position=1).count(), 25)
+        self.assertEqual(characters.get(name='bot25').user, self.user)
+
+    def test_provisioning_command(self):
+        call_command('provision_characters', 'bootstrap', '3', prefix='npc', stdout=io.StringIO())
+
+        self.assertEqual(sorted(self.user.characters.values_list('name', flat=True)), ['npc1', 'npc2', 'npc3'])
+
+
+class SpatialGridTestCase(TestCase):
+    def test_nearby_is_sorted_and_bounded_by_radius(self):
+        grid = SpatialGrid(10)
+        grid.update(1, 0.0, 0.0)
+        grid.update(2, 3.0, 4.0)
+        grid.update(3, -12.0, 0.0)
+        grid.update(4, 30.0, 30.0)
+
+        self.assertEqual(grid.nearby(0.0, 0.0, 12.0), [(1, 0.0), (2, 5.0), (3, 12.0)])
+        self.assertEqual(grid.nearby(0.0, 0.0, 12.0, limit=2), [(1, 0.0), (2, 5.0)])
+
+    def test_moving_and_removing(self):
+        grid = SpatialGrid(10)
+        grid.update(1, 0.0, 0.0)
+        grid.update(1, 100.0, 100.0)
+
+        self.assertEqual(grid.nearby(0.0, 0.0, 50.0), [])
+        self.assertEqual(grid.nearby(100.0, 100.0, 1.0), [(1, 0.0)])
+
+        grid.remove(1)
+        grid.update(2, None, None)
+        self.assertEqual(len(grid), 0)
+
+    def test_character_grid_follows_saves(self):
+        user = User.objects.create_user('player', password='password')
+        character = Character.objects.create(name='player', user=user, x_pos=1.0, y_pos=1.0)
+        spatial.characters.reload()
+
+        character.x_pos = 40.0
+        character.save()
+        self.assertEqual(spatial.characters.grid().position(character.pk), (40.0, 1.0))
+
+        user.delete()
+        self.assertIsNone(spatial.characters.grid().position(character.pk))
+
+
+class CharacterGridReloadTestCase(TestCase):
+    def setUp(self):
+        self.grids = []
+        self.release = threading.Event()
+        self.release.set()
+
+        def load(cell_size):
+            self.release.wait(5)
+            grid = SpatialGrid(cell_size)
+            self.grids.append(grid)
+            return grid
+        patcher = mock.patch.object(spatial, 'SpatialGrid', side_effect=load)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.characters = spatial.CharacterGrid()
+
+    def test_concurrent_first_queries_load_once(self):
+        self.release.clear()
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(self.characters.grid())) for index in range(5)]
+        for thread in threads:
+            thread.start()
+        self.release.set()
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual(len(self.grids), 1)
+        self.assertEqual(results, self.grids * 5)
+
+    def test_stale_grid_is_reloaded_off_the_request_path(self):
+        old = self.characters.grid()
+        self.characters._loaded_at -= 3600
+        self.release.clear()
+
+        self.assertIs(self.characters.grid(), old)
+        self.assertIs(self.characters.grid(), old)
+        self.release.set()
+        while self.characters._refreshing.locked():
+            time.sleep(0.001)
+
+        self.assertEqual(len(self.grids), 2)
+        self.assertIs(self.characters.grid(), self.grids[1])
+
+
+class SkillGraphTestCase(TestCase):
+    def setUp(self):
+        item = create_static_item('book')
+        self.skills = {name: Skill.objects.create(name=name, skill_type='crafting', value=1.0, static_game_item=item)
+                       for name in ('chop', 'saw', 'carve', 'build', 'boat')}
+        # build: chop or saw, boat: build and carve
+        for child, parent, dependency_type in (('chop', 'build', SkillDependency.UNION),
+                                               ('saw', 'build', SkillDependency.UNION),
+                                               ('build', 'boat', SkillDependency.INTERSECTION),
+                                               ('carve', 'boat', SkillDependency.INTERSECTION)):
+            SkillDependency.objects.create(child_skill=self.skills[child], parent_skill=self.skills[parent],
+                                           dependency_type=dependency_type)
+
+    def unlockable(self, *known):
+        graph = skill_graph.graph()
+        return [graph.skills[skill_id].name for skill_id in graph.unlockable(self.skills[name].pk for name in known)]
+
+    def test_topological_order(self):
+        order = [skill_graph.graph().skills[skill_id].name for skill_id in skill_graph.graph().order]
+
+        self.assertLess(order.index('chop'), order.index('build'))
+        self.assertLess(order.index('build'), order.index('boat'))
+        self.assertLess(order.index('carve'), order.index('boat'))
+
+    def test_union_and_intersection(self):
+        self.assertEqual(self.unlockable(), ['chop', 'saw', 'carve'])
+        self.assertEqual(self.unlockable('chop', 'carve', 'saw'), ['build'])
+        self.assertEqual(self.unlockable('saw', 'carve', 'build', 'chop'), ['boat'])
+
+    def test_cycles_are_rejected(self):
+        with self.assertRaisesMessage(ValidationError, 'Skill dependencies form a cycle between: boat, build, chop.'):
+            SkillDependency(child_skill=self.skills['boat'], parent_skill=self.skills['chop']).full_clean()
+        with self.assertRaises(ValidationError):
+            SkillDependency(child_skill=self.skills['saw'], parent_skill=self.skills['saw']).full_clean()
+        # Changing an existing dependency is checked without the row it replaces
+        dependency = SkillDependency.objects.get(child_skill=self.skills['build'], parent_skill=self.skills['boat'])
+        dependency.full_clean()
+
+    def test_edits_invalidate_the_graph(self):
+        graph = skill_graph.graph()
+        SkillDependency.objects.create(child_skill=self.skills['carve'], parent_skill=self.skills['saw'])
+
+        self.assertIsNot(skill_graph.graph(), graph)
+        self.assertEqual(self.unlockable(), ['chop', 'carve'])
+
+
+class ModifierExpiryTestCase(TestCase):
+    def setUp(self):
+        self.static_modifier = StaticItemModifier.objects.create(name='haste', description='Haste.', modifier=1.5,
+                                                                 duration=60)
+
+    def modifier(self, seconds):
+        return ItemModifier.objects.create(item_modifier=self.static_modifier, duration_remainder=seconds,
+                                           modifier_remainder=1.5)
+
+    def test_remaining_duration_is_computed_on_read(self):
+        modifier = self.modifier(30)
+        modifier.expires_at -= datetime.timedelta(seconds=10)
+
+        self.assertEqual(modifier.duration_remainder, 20)
+        modifier.expires_at -= datetime.timedelta(seconds=60)
+        self.assertEqual(modifier.duration_remainder, 0)
+
+    def test_scheduler_deletes_due_modifiers_in_batches(self):
+        expired = [self.modifier(0) for index in range(5)]
+        soon, later = self.modifier(5), self.modifier(3600)
+        game_item = GameItem.objects.create(static_game_item=create_static_item('ring'), inventory_position=0)
+        link = GameItemModifier.objects.create(game_item=game_item, modifier=expired[0])
+        scheduler = ExpiryScheduler(interval=10, batch_size=2)
+        scheduler.load()
+
+        self.assertEqual(len(scheduler), 6)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(scheduler.expire(), 5)
+        self.assertLess(len([query for query in queries if query['sql'].startswith('DELETE')]), 10)
+        self.assertFalse(GameItemModifier.objects.filter(pk=link.pk).exists())
+
+        self.assertEqual(scheduler.expire(soon.expires_at), 1)
+        self.assertEqual(list(ItemModifier.objects.values_list('id', flat=True)), [later.pk])
+
+    def test_extended_modifiers_survive(self):
+        modifier = self.modifier(1)
+        scheduler = ExpiryScheduler(interval=10)
+        scheduler.load()
+        modifier.duration_remainder = 3600
+        modifier.save()
+
+        self.assertEqual(scheduler.expire(timezone.now() + datetime.timedelta(seconds=5)), 0)
+        self.assertTrue(ItemModifier.objects.filter(pk=modifier.pk).exists())
+
+    def test_command(self):
+        self.modifier(0)
+        self.modifier(3600)
+        out = io.StringIO()
+
+        call_command('expire_modifiers', stdout=out)
+
+        self.assertIn('Deleted 1 expired modifiers.', out.getvalue())
+        self.assertEqual(ItemModifier.objects.active().count(), 1)
+
+
+class LocalBrokerTestCase(TestCase):
+    def test_thread_waiters_are_released_by_publish(self):
+        broker = LocalBroker()
+        threading.Timer(0.05, broker.publish, args=(1, 3)).start()
+
+        self.assertEqual(broker.wait(1, 2, timeout=5), 3)
+        self.assertIsNone(broker.wait(1, 3, timeout=0.01))
+        self.assertIsNone(broker.wait(2, 0, timeout=0.01))
+        self.assertEqual(broker._conditions, {})
+
+    def test_thread_waiters_are_woken_per_channel(self):
+        broker = LocalBroker()
+        waiter = threading.Thread(target=broker.wait, args=(1, 0, 5))
+        waiter.start()
+        while not broker._conditions:
+            time.sleep(0.001)
+
+        with mock.patch.object(broker._conditions[1][0], 'notify_all') as notify_all:
+            broker.publish(2, 1)
+            notify_all.assert_not_called()
+        broker.publish(1, 1)
+        waiter.join(5)
+
+        self.assertFalse(waiter.is_alive())
+        self.assertEqual(broker._conditions, {})
+
+    def test_async_waiters_are_released_by_publish(self):
+        broker = LocalBroker()
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        loop.call_later(0.05, threading.Thread(target=broker.publish, args=(1, 3)).start)
+
+        self.assertEqual(loop.run_until_complete(broker.wait_async(1, 2, timeout=5)), 3)
+        self.assertIsNone(loop.run_until_complete(broker.wait_async(1, 3, timeout=0.01)))
+        self.assertEqual(broker._futures, {})
+
+    def test_older_versions_are_ignored(self):
+        broker = LocalBroker()
+        broker.publish(1, 5)
+        broker.publish(1, 4)
+
+        self.assertEqual(broker.latest(1), 5)
+
+    def test_broker_class_comes_from_settings(self):
+        with self.settings(FEED_BROKER='CraftScapeDatabase.feed.LocalBroker'):
+            self.assertIsInstance(feed.load_broker(), LocalBroker)
+        with self.settings(FEED_BROKER='CraftScapeDatabase.feed.RedisBroker'), mock.patch.object(feed, 'redis', None):
+            self.assertRaises(ImproperlyConfigured, feed.load_broker)
+
+
+class RedisBrokerTestCase(TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(feed, 'redis')
+        self.redis = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.redis.RedisError = Exception
+        self.client = self.redis.StrictRedis.from_url.return_value
+
+    def test_publishes_go_to_every_process(self):
+        broker = RedisBroker('redis://feed/1')
+        broker.publish(7, 3)
+
+        self.redis.StrictRedis.from_url.assert_called_once_with('redis://feed/1')
+        self.client.publish.assert_called_once_with('craftscape-feed:7', 3)
+        self.assertEqual(broker.latest(7), 3)
+
+    def test_failed_publishes_are_not_raised(self):
+        self.client.publish.side_effect = Exception('down')
+        broker = RedisBroker()
+        with self.assertLogs('CraftScape.feed', 'ERROR'):
+            broker.publish(7, 3)
+
+        self.assertEqual(broker.latest(7), 3)
+
+    def test_waiters_are_released_by_other_processes(self):
+        broker = RedisBroker()
+        pubsub = self.client.pubsub.return_value
+        message = {'channel': b'craftscape-feed:7', 'data': b'4'}
+        threading.Timer(0.05, broker.receive, args=(message,)).start()
+
+        self.assertEqual(broker.wait(7, 3, timeout=5), 4)
+        self.assertIsNone(broker.wait(7, 4, timeout=0.01))
+        pubsub.psubscribe.assert_called_once_with(**{'craftscape-feed:*': broker.receive})
+        pubsub.run_in_thread.assert_called_once_with(sleep_time=0.05, daemon=True)
+        self.client.publish.assert_not_called()
+
+
+class WorldGeneratorTestCase(TestCase):
+    options = {'users': 3, 'characters': 2, 'bags': 2, 'items': 4, 'static_items': 10, 'skills': 8, 'modifiers': 5}
+
+    def world(self):
+        return {
+            'characters': list(Character.objects.order_by('id').values_list('name', 'x_pos', 'y_pos')),
+            'game_items': list(GameItem.objects.order_by('id').values_list('uuid', 'static_game_item__name',
+                                                                         'inventory_position')),
+            'skills': list(SkillDependency.objects.order_by('id').values_list('child_skill__name',
+                                                                             'parent_skill__name')),
+        }
+
+    def test_generates_requested_scale(self):
+        created = generate_world(**self.options)
+
+        self.assertEqual(created['user'], 3)
+        self.assertEqual(Character.objects.count(), 6)
+        self.assertEqual(Inventory.objects.count(), 12)
+        self.assertEqual(GameItem.objects.count(), 48)
+        self.assertEqual(StaticGameItem.objects.count(), 10)
+        self.assertEqual(GameItemModifier.objects.count(), 5)
+        self.assertEqual(ItemModifier.objects.active().count(), 5)
+        self.assertEqual(created['character_skill'], CharacterSkill.objects.count())
+        self.assertEqual(len(skill_graph.graph().topological_order()), 8)
+        self.assertTrue(User.objects.get(username='world1').check_password('password'))
+
+    def test_modifiers_inserted_meanwhile_are_not_claimed(self):
+        static_modifier = StaticItemModifier.objects.create(name='other', description='Other.', modifier=1, duration=60)
+        bulk_create = ItemModifier.objects.bulk_create
+
+        def bulk_create_then_insert(*args, **kwargs):
+            created = bulk_create(*args, **kwargs)
+            ItemModifier.objects.create(item_modifier=static_modifier, modifier_remainder=1,
+                                        expires_at=timezone.now() + datetime.timedelta(hours=1))
+            return created
+
+        with mock.patch.object(ItemModifier.objects, 'bulk_create', bulk_create_then_insert):
+            generate_world(**self.options)
+
+        self.assertEqual(GameItemModifier.objects.count(), 5)
+        self.assertFalse(GameItemModifier.objects.filter(modifier__item_modifier=static_modifier).exists())
+
+    def test_same_seed_builds_same_world(self):
+        generate_world(seed=7, **self.options)
+        first = self.world()
+        call_command('flush', interactive=False, verbosity=0)
+        generate_world(seed=7, **self.options)
+
+        self.assertEqual(self.world(), first)
+
+    def test_command_refuses_existing_prefix(self):
+        call_command('generate_world', users=1, static_items=2, skills=2, stdout=io.StringIO())
+
+        with self.assertRaises(CommandError):
+            call_command('generate_world', users=1, stdout=io.StringIO())
+
+
+class CatalogLoaderTestCase(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def write(self, name, content):
+        path = os.path.join(self.directory.name, name)
+        with open(path, 'w') as catalog_file:
+            catalog_file.write(content if isinstance(content, str) else json.dumps(content))
+        return path
+
+    def test_default_catalog(self):
+        load_catalog()
+
+        self.assertEqual(sorted(StaticGameItem.objects.values_list('name', flat=True)), ['apple', 'axe', 'bag'])
+        self.assertEqual(list(StaticGameItem.objects.get(name='axe').item_types.values_list('item_type', flat=True)),
+                         ['mainHand'])
+
+    def test_reload_without_changes_only_reads(self):
+        load_catalog()
+
+        with CaptureQueriesContext(connection) as queries:
+            changes = load_catalog()
+
+        statements = {query['sql'].split()[0] for query in queries}
+        self.assertEqual(statements, {'SAVEPOINT', 'SELECT', 'RELEASE'})
+        self.assertFalse(any(any(counts.values()) for counts in changes.values()))
+
+    def test_changes_are_applied_in_bulk(self):
+        load_catalog()
+        path = self.write('catalog.json', {
+            'modifiers': [{'name': 'sharp', 'description': 'Sharper.', 'modifier': 1.5, 'duration': 60}],
+            'static_items': [{'name': 'axe', 'value': 20.0, 'item_types': ['mainHand', 'consumable'],
+                              'modifiers': ['sharp']},
+                             {'name': 'apple', 'item_types': []}],
+            'skills': [{'name': 'chopping', 'skill_type': 'gathering', 'value': 1, 'static_game_item': 'axe'},
+                       {'name': 'carpentry', 'skill_type': 'crafting', 'value': 2, 'static_game_item': 'axe'}],
+            'skill_dependencies': [{'child_skill': 'chopping', 'parent_skill': 'carpentry',
+                                    'dependency_type': 'intersection'}],
+        })
+
+        changes = load_catalog([path])
+
+        axe = StaticGameItem.objects.get(name='axe')
+        self.assertEqual(axe.value, 20.0)
+        self.assertEqual(axe.description, 'An axe.')
+        self.assertEqual(sorted(axe.item_types.values_list('item_type', flat=True)), ['consumable', 'mainHand'])
+        self.assertFalse(StaticGameItem.objects.get(name='apple').item_types.exists())
+        self.assertTrue(StaticItemTypeModifier.objects.filter(item_type_id=axe, item_modifier_id__name='sharp')
+                        .exists())
+        self.assertEqual(SkillDependency.objects.get().dependency_type, SkillDependency.INTERSECTION)
+        self.assertEqual(changes['static_game_item'], {'created': 0, 'updated': 1, 'deleted': 0})
+        self.assertEqual(changes['static_game_item_item_types'], {'created': 1, 'updated': 0, 'deleted': 1})
+
+    def test_created_rows_are_read_back_by_name(self):
+        GameItemType.objects.create(item_type='back')
+        bulk_create = GameItemType.objects.bulk_create
+
+        def create_then_race(objs, batch_size=None):
+            created = bulk_create(objs, batch_size=batch_size)
+            # A row another writer inserts right after is not one of the loaded types
+            GameItemType.objects.create(item_type='other')
+            return created
+
+        loader = CatalogLoader({}, batch_size=1)
+        with mock.patch.object(GameItemType.objects, 'bulk_create', side_effect=create_then_race):
+            ids = loader.sync(GameItemType, 'item_type', [{'item_type': 'head'}, {'item_type': 'feet'}])
+
+        self.assertEqual(ids, dict(GameItemType.objects.exclude(item_type='other').values_list('item_type', 'id')))
+
+    def test_csv(self):
+        load_catalog()
+        path = self.write('static_items.csv', 'name,sprite_name,description,max_stack,value,equipable,item_types\n'
+                                              'pear,pear,A pear.,10,4.5,false,consumable\n'
+                                              'bag,,,,12,,container;consumable\n')
+
+        load_catalog([path])
+
+        pear = StaticGameItem.objects.get(name='pear')
+        self.assertEqual((pear.max_stack, pear.value, pear.equipable), (10, 4.5, False))
+        bag = StaticGameItem.objects.get(name='bag')
+        self.assertEqual((bag.value, bag.description), (12.0, 'A bag.'))
+        self.assertEqual(bag.item_types.count(), 2)
+
+    def test_invalid_catalog_changes_nothing(self):
+        path = self.write('catalog.json', {
+            'static_items': [{'name': 'axe', 'sprite_name': 'axe', 'description': 'An axe.', 'max_stack': 1,
+                              'value': 1.0, 'equipable': True}],
+            'skills': [{'name': 'a', 'skill_type': 'crafting', 'value': 1, 'static_game_item': 'axe'},
+                       {'name': 'b', 'skill_type': 'crafting', 'value': 1, 'static_game_item': 'axe'}],
+            'skill_dependencies': [{'child_skill': 'a', 'parent_skill': 'b'},
+                                   {'child_skill': 'b', 'parent_skill': 'a'}],
+        })
+
+        with self.assertRaisesMessage(CommandError, 'Skill dependencies form a cycle between: a, b.'):
+            call_command('load_catalog', path, stdout=io.StringIO())
+        self.assertFalse(StaticGameItem.objects.exists())
+
+    def test_dry_run(self):
+        out = io.StringIO()
+        call_command('load_catalog', dry_run=True, stdout=out)
+
+        self.assertIn('rolled back', out.getvalue())
+        self.assertFalse(StaticGameItem.objects.exists())
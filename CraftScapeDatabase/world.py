@@ -0,0 +1,189 @@
+"""
+Reproducible synthetic worlds for benchmarks and load tests.
+
+``generate_world`` fills the database with a catalog (item types, static items, modifiers, skills and their
+dependencies) and with users, characters, bags, game items, known skills and active item modifiers, all derived from
+a seed so the same arguments always build the same world. Rows are written with bulk INSERTs inside one transaction.
+"""
+import datetime
+import uuid
+from collections import OrderedDict
+from random import Random
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.utils import timezone
+from CraftScapeDatabase import catalog
+from CraftScapeDatabase.bulk import bulk_update
+from CraftScapeDatabase.models import Character, CharacterSkill, Equipment, GameItem, GameItemModifier, \
+    GameItemType, Inventory, ItemModifier, Skill, SkillDependency, StaticGameItem, StaticItemModifier, \
+    StaticItemTypeModifier
+from CraftScapeDatabase.provisioning import provision_characters
+from CraftScapeDatabase.skills import skill_graph
+
+MAX_INVENTORIES = Character._meta.get_field('max_inventories').default
+ITEM_TYPES = tuple(item_type for slot, item_type in Equipment.SLOTS) + ('consumable', 'material')
+
+
+def generate_world(users=10, characters=2, bags=2, items=8, static_items=50, skills=20, modifiers=100, seed=0,
+                   prefix='world', password='password', world_size=1000.0, batch_size=500):
+    """
+    Creates ``users`` users named ``<prefix><n>``, each with ``characters`` characters that have ``bags`` bags
+    (at most ``max_inventories``) holding ``items`` game items each, on top of a catalog of ``static_items`` items
+    and ``skills`` skills. ``modifiers`` item modifiers are attached to random game items. Returns the number of rows
+    created per model.
+    """
+    random = Random(seed)
+    created = OrderedDict()
+    with transaction.atomic():
+        type_ids = item_type_ids()
+        static_item_ids = create_static_items(random, prefix, static_items, type_ids, batch_size)
+        created['static_game_item'] = len(static_item_ids)
+        static_modifier_ids = create_static_modifiers(random, prefix, static_item_ids, batch_size)
+        created['static_item_modifier'] = len(static_modifier_ids)
+        skill_ids = create_skills(random, prefix, skills, static_item_ids, batch_size)
+        created['skill'] = len(skill_ids)
+
+        hashed = make_password(password)
+        User.objects.bulk_create([User(username='{0}{1}'.format(prefix, index + 1), password=hashed)
+                                  for index in range(users)], batch_size=batch_size)
+        character_ids = []
+        for user in User.objects.filter(username__in=['{0}{1}'.format(prefix, index + 1) for index in range(users)]) \
+                .order_by('id'):
+            character_ids.extend(provision_characters(user, characters, name_prefix='{0}-'.format(user.username),
+                                                      batch_size=batch_size))
+        created['user'] = users
+        created['character'] = len(character_ids)
+        bulk_update([Character(id=character_id, x_pos=random.uniform(0, world_size),
+                               y_pos=random.uniform(0, world_size)) for character_id in character_ids],
+                    ['x_pos', 'y_pos'], batch_size=batch_size)
+
+        Inventory.objects.bulk_create([
+            Inventory(character_id=character_id, position=position, size=Inventory.INVENTORY_SIZES[Inventory.SMALL])
+            for character_id in character_ids for position in range(2, min(bags, MAX_INVENTORIES) + 1)
+        ], batch_size=batch_size)
+        inventories = list(Inventory.objects.filter(character__in=character_ids).order_by('id')
+                           .values_list('id', 'character_id', 'size'))
+        created['inventory'] = len(inventories)
+
+        game_items = [
+            GameItem(uuid=uuid.UUID(int=random.getrandbits(128), version=4), inventory_id=inventory_id,
+                     inventory_position=position, static_game_item_id=random.choice(static_item_ids),
+                     created_by_id=character_id)
+            for inventory_id, character_id, size in inventories for position in range(min(items, size))
+        ]
+        GameItem.objects.bulk_create(game_items, batch_size=batch_size)
+        created['game_item'] = len(game_items)
+
+        CharacterSkill.objects.bulk_create([
+            CharacterSkill(character_id=character_id, skill_id=skill_id)
+            for character_id in character_ids
+            for skill_id in random.sample(skill_ids, min(len(skill_ids), random.randint(0, 3)))
+        ], batch_size=batch_size)
+        created['character_skill'] = CharacterSkill.objects.filter(character__in=character_ids).count()
+
+        created['item_modifier'] = create_item_modifiers(random, prefix, modifiers, static_modifier_ids, game_items,
+                                                         batch_size)
+
+    # Bulk inserts send no signals
+    catalog.invalidate()
+    skill_graph.clear()
+    return created
+
+
+def item_type_ids():
+    existing = dict(GameItemType.objects.filter(item_type__in=ITEM_TYPES).values_list('item_type', 'id'))
+    GameItemType.objects.bulk_create([GameItemType(item_type=item_type) for item_type in ITEM_TYPES
+                                      if item_type not in existing])
+    return dict(GameItemType.objects.filter(item_type__in=ITEM_TYPES).values_list('item_type', 'id'))
+
+
+def create_static_items(random, prefix, count, type_ids, batch_size):
+    names = ['{0}-item-{1}'.format(prefix, index + 1) for index in range(count)]
+    types = {}
+    static_items = []
+    for name in names:
+        item_type = random.choice(ITEM_TYPES)
+        types[name] = item_type
+        stackable = item_type in ('consumable', 'material')
+        static_items.append(StaticGameItem(
+            name=name, sprite_name=name, description='A generated item.', max_stack=20 if stackable else 1,
+            value=round(random.uniform(1, 100), 2), equipable=not stackable,
+            rarity=random.choice(StaticGameItem.RARITIES)[0], power=random.randint(0, 20),
+            defense=random.randint(0, 20), vitality=random.randint(0, 20),
+        ))
+    StaticGameItem.objects.bulk_create(static_items, batch_size=batch_size)
+
+    ids = dict(StaticGameItem.objects.filter(name__in=names).values_list('name', 'id'))
+    StaticGameItem.item_types.through.objects.bulk_create([
+        StaticGameItem.item_types.through(staticgameitem_id=ids[name], gameitemtype_id=type_ids[types[name]])
+        for name in names
+    ], batch_size=batch_size)
+    return [ids[name] for name in names]
+
+
+def create_static_modifiers(random, prefix, static_item_ids, batch_size):
+    names = ['{0}-modifier-{1}'.format(prefix, index + 1) for index in range(max(1, len(static_item_ids) // 5))]
+    StaticItemModifier.objects.bulk_create([
+        StaticItemModifier(name=name, description='A generated modifier.', modifier=round(random.uniform(0.5, 2), 2),
+                           duration=random.choice((60, 300, 3600)))
+        for name in names
+    ], batch_size=batch_size)
+    ids = dict(StaticItemModifier.objects.filter(name__in=names).values_list('name', 'id'))
+    StaticItemTypeModifier.objects.bulk_create([
+        StaticItemTypeModifier(item_type_id_id=static_item_id, item_modifier_id_id=ids[random.choice(names)])
+        for static_item_id in static_item_ids
+    ], batch_size=batch_size)
+    return [ids[name] for name in names]
+
+
+def create_skills(random, prefix, count, static_item_ids, batch_size):
+    names = ['{0}-skill-{1}'.format(prefix, index + 1) for index in range(count)]
+    Skill.objects.bulk_create([
+        Skill(name=name, skill_type=random.choice(('combat', 'crafting', 'gathering')), value=random.randint(1, 10),
+              static_game_item_id=random.choice(static_item_ids))
+        for name in names
+    ], batch_size=batch_size)
+    ids = dict(Skill.objects.filter(name__in=names).values_list('name', 'id'))
+    skill_ids = [ids[name] for name in names]
+
+    # Children always come earlier in the list than their parent, so the graph cannot contain a cycle
+    dependencies = []
+    for index, parent_id in enumerate(skill_ids[1:], start=1):
+        dependency_type = random.choice(SkillDependency.DEPENDENCY_TYPES)[0]
+        for child_id in random.sample(skill_ids[:index], min(index, random.randint(0, 2))):
+            dependencies.append(SkillDependency(child_skill_id=child_id, parent_skill_id=parent_id,
+                                                dependency_type=dependency_type))
+    SkillDependency.objects.bulk_create(dependencies, batch_size=batch_size)
+    return skill_ids
+
+
+def create_item_modifiers(random, prefix, count, static_modifier_ids, game_items, batch_size):
+    if not count or not game_items:
+        return 0
+    now = timezone.now()
+    # The index in microseconds keeps the expiries of up to a million modifiers unique, so the rows can be found again
+    modifiers = [
+        ItemModifier(item_modifier_id=random.choice(static_modifier_ids), modifier_remainder=random.uniform(0.5, 2),
+                     expires_at=now + datetime.timedelta(seconds=random.randint(60, 3600), microseconds=index))
+        for index in range(count)
+    ]
+    modifiers = ItemModifier.objects.bulk_create(modifiers, batch_size=batch_size)
+    if not connection.features.can_return_ids_from_bulk_insert:
+        # Rows inserted by anyone else would need the same microsecond and the same drawn remainder to match
+        keys = {(modifier.expires_at, modifier.modifier_remainder): modifier for modifier in modifiers}
+        for offset in range(0, count, batch_size):
+            rows = ItemModifier.objects.filter(expires_at__in=[modifier.expires_at for modifier
+                                                               in modifiers[offset:offset + batch_size]])
+            for pk, expires_at, modifier_remainder in rows.values_list('id', 'expires_at', 'modifier_remainder'):
+                modifier = keys.get((expires_at, modifier_remainder))
+                if modifier is not None:
+                    modifier.pk = pk
+    modifier_ids = [modifier.pk for modifier in modifiers]
+
+    item_ids = dict(GameItem.objects.filter(uuid__in=[item.uuid for item in game_items]).values_list('uuid', 'id'))
+    GameItemModifier.objects.bulk_create([
+        GameItemModifier(game_item_id=item_ids[random.choice(game_items).uuid], modifier_id=modifier_id)
+        for modifier_id in modifier_ids
+    ], batch_size=batch_size)
+    return len(modifier_ids)